@@ -1,22 +1,181 @@
+import codecs
+import re
+
 from lnt.util import json
+from lnt.formats.util import FormatError, read_prefix
 
 def _matches_format(path_or_file):
+    return read_prefix(path_or_file)[:1] in ('{', '[')
+
+def _load_format(path_or_file):
     if isinstance(path_or_file, str):
         path_or_file = open(path_or_file)
 
-    try:
-        json.load(path_or_file)
+    return json.load(path_or_file)
+
+class _StreamReader(object):
+    """
+    Incremental reader for a JSON document, which decodes a single value at a
+    time from a window of the input instead of loading the whole file.
+    """
+
+    chunk_size = 1 << 16
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+        # Skip any byte order mark.
+        self._read_more(len(codecs.BOM_UTF8))
+        if self.buffer.startswith(codecs.BOM_UTF8):
+            self.pos = len(codecs.BOM_UTF8)
+
+    def _read_more(self, size=0):
+        if self.eof:
+            return False
+
+        # Drop the part of the buffer which has already been consumed.
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        data = self.file.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
         return True
-    except:
-        return False
 
-def _load_format(path_or_file):
+    def peek(self):
+        """peek() -> str
+
+        Skip any whitespace and return the next character, or '' at the end of
+        the input.
+        """
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                return ''
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise FormatError("expected %r in JSON input" % (c,))
+        self.pos += 1
+
+    def expect_end(self):
+        if self.peek() != '':
+            raise FormatError("unexpected data after JSON document")
+
+    def decode(self):
+        """decode() -> object
+
+        Decode the next complete value from the input.
+        """
+        self.peek()
+        while True:
+            try:
+                value,end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError,e:
+                error = e
+            else:
+                # A value which ends with the buffer (a number, say) may have
+                # been truncated, only trust it once more input has been seen.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+                error = None
+
+            # Grow the window geometrically, so large values are only retried a
+            # logarithmic number of times.
+            if not self._read_more(len(self.buffer) - self.pos) and error:
+                raise FormatError(str(error))
+
+def _iter_object(reader):
+    # Yield each key of an object, leaving the reader positioned at its value,
+    # which the consumer must read before resuming.
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        key = reader.decode()
+        if not isinstance(key, basestring):
+            raise FormatError("expected a string key in JSON object")
+        reader.expect(':')
+        yield key
+        if reader.peek() == '}':
+            reader.pos += 1
+            return
+        reader.expect(',')
+
+def _iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.decode()
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+        reader.expect(',')
+
+def _iter_tests(reader, members, data, file_to_close):
+    try:
+        for test in _iter_array(reader):
+            yield test
+
+        # Read any members which follow the tests.
+        for key in members:
+            data[key] = reader.decode()
+        reader.expect_end()
+    finally:
+        if file_to_close is not None:
+            file_to_close.close()
+
+def _stream_format(path_or_file):
+    """
+    Load a report, decoding the entries of its 'Tests' list lazily.
+
+    The 'Machine' and 'Run' members are decoded up front, and when they precede
+    the tests (as they do in rendered reports) the 'Tests' member of the result
+    is an iterator which decodes each entry as it is consumed. Otherwise, the
+    document is loaded as a whole.
+    """
+    file_to_close = None
     if isinstance(path_or_file, str):
-        path_or_file = open(path_or_file)
-    
-    return json.load(path_or_file)
-    
+        path_or_file = file_to_close = open(path_or_file, 'rb')
+
+    try:
+        reader = _StreamReader(path_or_file)
+        if reader.peek() != '{':
+            value = reader.decode()
+            reader.expect_end()
+            return value
+
+        data = {}
+        members = _iter_object(reader)
+        for key in members:
+            if key == 'Tests' and 'Machine' in data and 'Run' in data and \
+                    reader.peek() == '[':
+                data[key] = _iter_tests(reader, members, data, file_to_close)
+                file_to_close = None
+                return data
+            data[key] = reader.decode()
+        reader.expect_end()
+        return data
+    finally:
+        if file_to_close is not None:
+            file_to_close.close()
+
 format = { 'name' : 'json',
            'predicate' : _matches_format,
            'read' : _load_format,
+           'stream' : _stream_format,
            'write' : json.dump }
@@ -1,11 +1,11 @@
 import plistlib
+from lnt.formats.util import read_prefix
 
 def _matches_format(path_or_file):
-    try:
-        plistlib.readPlist(path_or_file)
-        return True
-    except:
-        return False
+    # Only XML property lists are supported by plistlib.
+    prefix = read_prefix(path_or_file)
+    return prefix.startswith('<?xml') or prefix.startswith('<!DOCTYPE plist') \
+        or prefix.startswith('<plist')
 
 format = { 'name' : 'plist',
            'predicate' : _matches_format,
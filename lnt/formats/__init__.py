@@ -1,14 +1,19 @@
 """
 Utilities for converting to LNT's test format.
 
-LNT formats are described by dictionaries with 'name', 'read', and 'write'
-fields. Only the 'name' field is required. The 'read' field should be a callable
-taking a path_or_file object, the 'write' function should be a callable taking a
-Python object to write, and the path_or_file to write to.
+LNT formats are described by dictionaries with 'name', 'predicate', 'read',
+'stream' and 'write' fields. Only the 'name' field is required. The 'read'
+field should be a callable taking a path_or_file object, the 'write' function
+should be a callable taking a Python object to write, and the path_or_file to
+write to. The 'predicate' field should be a callable taking a path_or_file
+object, which cheaply checks (from the leading bytes) whether the file is in
+this format. The optional 'stream' field is like 'read', but may return a
+report whose 'Tests' member is an iterator decoded as it is consumed.
 """
 
 from PlistFormat import format as plist
 from JSONFormat import format as json
+from util import FormatError
 
 formats = [plist, json]
 formats_by_name = dict((f['name'], f) for f in formats)
@@ -26,7 +31,7 @@ def guess_format(path_or_file):
     """guess_format(path_or_file) -> [format]
 
     Guess which format should be used to load the given file and return it, if
-    found.
+    found. Only the leading bytes of the file are inspected.
     """
 
     # Check that files are seekable.
@@ -57,11 +62,13 @@ def guess_format(path_or_file):
 
     return matches
 
-def read_any(path_or_file, format_name):
-    """read_any(path_or_file, format_name) -> [format]
+def read_any(path_or_file, format_name, stream=False):
+    """read_any(path_or_file, format_name, [stream]) -> [format]
 
     Attempt to read any compatible LNT test format file. The format_name can be
-    an actual format name, or "<auto>".
+    an actual format name, or "<auto>". If stream is true and the format
+    supports it, the 'Tests' of the report are decoded lazily as they are
+    iterated, and decoding errors in them are raised as FormatError.
     """
     # Figure out the input format.
     if format_name == '<auto>':
@@ -77,6 +84,9 @@ def read_any(path_or_file, format_name):
         if f is None or not f.get('read'):
             raise SystemExit("unknown input format: %r" % format_name)
 
+    if stream and f.get('stream'):
+        return f['stream'](path_or_file)
     return f['read'](path_or_file)
 
-__all__ = ['get_format', 'guess_format', 'read_any'] + format_names
+__all__ = ['FormatError', 'get_format', 'guess_format',
+           'read_any'] + format_names
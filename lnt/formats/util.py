@@ -0,0 +1,32 @@
+"""
+Helpers shared by the LNT format implementations.
+"""
+
+import codecs
+
+class FormatError(ValueError):
+    """Raised when an input file cannot be decoded by its format."""
+
+def read_prefix(path_or_file, size=512):
+    """read_prefix(path_or_file, [size]) -> str
+
+    Return the leading bytes of the given file, with any byte order mark and
+    leading whitespace removed. File objects are restored to their original
+    position.
+    """
+    if isinstance(path_or_file, str):
+        f = open(path_or_file, 'rb')
+        try:
+            prefix = f.read(size)
+        finally:
+            f.close()
+    else:
+        pos = path_or_file.tell()
+        try:
+            prefix = path_or_file.read(size)
+        finally:
+            path_or_file.seek(pos)
+
+    if prefix.startswith(codecs.BOM_UTF8):
+        prefix = prefix[len(codecs.BOM_UTF8):]
+    return prefix.lstrip()
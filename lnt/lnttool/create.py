@@ -39,12 +39,30 @@ profile_dir = %(profile_dir)r
 secret_key = %(secret_key)r
 
 # The list of available databases, and their properties. At a minimum, there
-# should be a 'default' entry for the default database.
+# should be a 'default' entry for the default database. A database may set a
+# 'group_commit_window' (in seconds), for submissions arriving within it to be
+# committed in a single transaction, which helps with bursts of submissions to
+# SQLite databases.
 databases = {
     'default' : { 'path' : %(default_db)r,
                   'db_version' : %(default_db_version)r },
     }
 
+# Admission control for submissions. While a server process is importing
+# 'max_inflight_imports' submissions, or the database has 'max_background_jobs'
+# background jobs waiting, further submissions are answered with "429 Too Many
+# Requests" and asked to retry after 'retry_after' seconds. The limits are
+# disabled when not set.
+#
+# max_inflight_imports = 4
+# max_background_jobs = 10
+# retry_after = 5
+
+# The largest submission accepted, in bytes once decompressed. Larger
+# submissions are answered with "413 Request Entity Too Large".
+#
+# max_submission_size = 1 << 30
+
 # The LNT email configuration.
 #
 # The 'to' field can be either a single email address, or a list of
@@ -1,10 +1,126 @@
-import os, pprint, sys, time
+import os, pprint, sys, time, traceback
 
 import lnt.formats
 import lnt.util.ImportData
 import lnt.server.instance
 import contextlib
+import functools
+import itertools
+import multiprocessing
 
+def _fail_batch(results, error):
+    """
+    Return the results of a batch of imports which were rolled back, with the
+    imports which succeeded reported as failed with the error.
+    """
+    return [result if not result.get('success') else
+            {'success': False, 'error': error,
+             'import_file': result['import_file']}
+            for result in results]
+
+def _commit_batch(opts, config, db, results):
+    """
+    Commit a batch of imports, returning their results. If the commit fails,
+    it is rolled back and the imports are reported as failed.
+    """
+    try:
+        lnt.util.ImportData.commit_deferred(config, opts.database, db,
+                                            results)
+    except KeyboardInterrupt:
+        raise
+    except:
+        db.rollback()
+        return _fail_batch(results,
+                           "commit failure: %s" % traceback.format_exc())
+    return results
+
+def _import_parallel(opts, config, db, files):
+    """
+    Import the files, with a pool of worker processes loading the reports
+    concurrently, and this process importing them into the database one at a
+    time, in order. Commits are batched.
+
+    Yields the import result for each file, once its batch is committed. If an
+    import fails with an exception, the uncommitted imports of its batch are
+    rolled back and reported as failed.
+    """
+    pool = multiprocessing.Pool(opts.jobs)
+    try:
+        start_time = time.time()
+        load_time = import_time = 0.0
+        num_imported = num_samples = 0
+        pending = []
+        reports = pool.imap(
+            functools.partial(lnt.util.ImportData.load_report,
+                              format=opts.format), files)
+        for file,(data, error, file_load_time, file_samples) in \
+                itertools.izip(files, reports):
+            load_time += file_load_time
+            if error is not None:
+                pending.append({'success': False, 'error': error,
+                                'import_file': file})
+                continue
+
+            import_start_time = time.time()
+            try:
+                result = lnt.util.ImportData.import_and_report(
+                    config, opts.database, db, file,
+                    opts.format, opts.commit, opts.show_sample_count,
+                    opts.no_email, opts.no_report, data=data,
+                    defer_commit=True)
+            except KeyboardInterrupt:
+                raise
+            except:
+                error = "import failure: %s" % traceback.format_exc()
+                db.rollback()
+                pending = _fail_batch(
+                    pending, "rolled back with its batch, after the import "
+                    "of %s failed" % (file,))
+                pending.append({'success': False, 'error': error,
+                                'import_file': file})
+                for result in pending:
+                    yield result
+                pending = []
+                continue
+            result['load_time'] = file_load_time
+            num_imported += 1
+            num_samples += file_samples
+            pending.append(result)
+            results = []
+            if len(pending) >= opts.batch_size:
+                results = _commit_batch(opts, config, db, pending)
+                pending = []
+            import_time += time.time() - import_start_time
+            for result in results:
+                yield result
+
+        import_start_time = time.time()
+        results = _commit_batch(opts, config, db, pending)
+        import_time += time.time() - import_start_time
+        for result in results:
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+    # Report the throughput of each stage. Loading is spread over the workers,
+    # so its rate is based on the combined time they spent.
+    if opts.quiet:
+        return
+    total_time = time.time() - start_time
+    def rate(count, elapsed):
+        return count / elapsed if elapsed else 0.0
+    print "--- Throughput ---"
+    print "Load (%d jobs): %d files, %d samples, %.2f files/s, " \
+        "%.2f samples/s per job" % (
+            opts.jobs, len(files), num_samples,
+            rate(len(files), load_time), rate(num_samples, load_time))
+    print "Import: %d files, %d samples, %.2f files/s, %.2f samples/s" % (
+        num_imported, num_samples, rate(num_imported, import_time),
+        rate(num_samples, import_time))
+    print "Total: %.2fs, %.2f files/s, %.2f samples/s" % (
+        total_time, rate(len(files), total_time),
+        rate(num_samples, total_time))
 
 def action_import(name, args):
     """import test data into a database"""
@@ -35,10 +151,21 @@ def action_import(name, args):
                       action="store_true", default=False)
     parser.add_option("", "--no-report", dest="no_report",
                       action="store_true", default=False)
+    parser.add_option("-j", "--jobs", dest="jobs", type=int, default=1,
+                      help="number of processes to load reports with "
+                      "[%default]")
+    parser.add_option("", "--batch-size", dest="batch_size", type=int,
+                      default=50, metavar="N",
+                      help="with --jobs, commit after every N imported "
+                      "files [%default]")
     (opts, args) = parser.parse_args(args)
 
     if len(args) < 2:
         parser.error("invalid number of arguments")
+    if opts.jobs < 1:
+        parser.error("invalid number of jobs")
+    if opts.batch_size < 1:
+        parser.error("invalid batch size")
 
     path = args.pop(0)
 
@@ -51,12 +178,15 @@ def action_import(name, args):
                                                 echo=opts.show_sql)) as db:
         # Load the database.
         success = True
-        for file in args:
-            result = lnt.util.ImportData.import_and_report(
-                config, opts.database, db, file,
-                opts.format, opts.commit, opts.show_sample_count,
-                opts.no_email, opts.no_report)
-
+        if opts.jobs > 1:
+            results = _import_parallel(opts, config, db, args)
+        else:
+            results = (lnt.util.ImportData.import_and_report(
+                    config, opts.database, db, file,
+                    opts.format, opts.commit, opts.show_sample_count,
+                    opts.no_email, opts.no_report)
+                       for file in args)
+        for result in results:
             success &= result.get('success', False)
             if opts.quiet:
                 continue
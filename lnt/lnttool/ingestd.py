@@ -0,0 +1,315 @@
+import contextlib
+import errno
+import itertools
+import logging
+import os
+import re
+import stat
+import time
+import traceback
+import uuid
+
+import lnt.formats
+import lnt.server.instance
+import lnt.util.ImportData
+from lnt.testing.util.commands import note, warning, LOGGER_NAME
+
+# The longest time to wait before retrying a batch whose commit failed.
+MAX_RETRY_DELAY = 300.0
+
+def _move(path, dir, name):
+    """_move(path, dir, name) -> path
+
+    Move a file into the directory under the name, or under a numbered variant
+    of it when the name is taken, never replacing an existing file. Returns
+    the new path.
+    """
+    base, ext = os.path.splitext(name)
+    for i in itertools.count():
+        new_path = os.path.join(dir, name if i == 0 else
+                                "%s.%d%s" % (base, i, ext))
+        try:
+            os.link(path, new_path)
+        except OSError,e:
+            if e.errno != errno.EEXIST:
+                raise
+            continue
+        os.unlink(path)
+        return new_path
+
+class SpoolDirectory(object):
+    """
+    A directory report files are dropped into for importing.
+
+    Reports are claimed by atomically renaming them into the 'processing'
+    subdirectory, so several daemons can serve the same spool without importing
+    a report twice. Once imported, reports are moved to the 'done' or 'failed'
+    subdirectory. Files whose name starts with a '.' are ignored, so writers
+    should write reports under a hidden name and rename them once complete.
+
+    Reports may reuse the name of an earlier report. Claimed reports are given
+    a unique prefix, and reports are moved to the other directories under a
+    numbered variant of their name when it is taken, so no report replaces
+    another.
+    """
+
+    _claimed_re = re.compile(r'^[0-9a-f]{32}-')
+
+    def __init__(self, path):
+        self.path = path
+        self.processing_path = os.path.join(path, 'processing')
+        self.done_path = os.path.join(path, 'done')
+        self.failed_path = os.path.join(path, 'failed')
+        for subdir in (self.processing_path, self.done_path,
+                       self.failed_path):
+            if not os.path.isdir(subdir):
+                os.makedirs(subdir)
+
+    def pending(self):
+        """pending() -> [name]
+
+        Return the names of the unclaimed reports, oldest first.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith('.'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                # The report was claimed by someone else.
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries.append((st.st_mtime, name))
+        entries.sort()
+        return [name for _,name in entries]
+
+    def claim(self, name):
+        """claim(name) -> path or None
+
+        Claim the named report, returning its path in the processing
+        directory, or None if it was claimed by someone else.
+        """
+        path = os.path.join(self.processing_path,
+                            "%s-%s" % (uuid.uuid4().hex, name))
+        try:
+            os.rename(os.path.join(self.path, name), path)
+        except OSError,e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return path
+
+    def _name(self, path):
+        """Return the name a claimed report was submitted under."""
+        return self._claimed_re.sub('', os.path.basename(path))
+
+    def unclaim(self, path):
+        _move(path, self.path, self._name(path))
+
+    def finish(self, path, error=None):
+        """finish(path, [error]) -> None
+
+        Move a claimed report to the done directory, or to the failed
+        directory when given the error it failed with. The error is saved next
+        to the report.
+        """
+        if error is None:
+            _move(path, self.done_path, self._name(path))
+            return
+
+        path = _move(path, self.failed_path, self._name(path))
+        with open(path + '.error', 'w') as f:
+            f.write(error)
+
+    def recover(self):
+        """recover() -> int
+
+        Return the reports left in the processing directory (by a daemon which
+        exited while importing them) to the spool, and return their number.
+        """
+        names = os.listdir(self.processing_path)
+        for name in names:
+            self.unclaim(os.path.join(self.processing_path, name))
+        return len(names)
+
+def _import_batch(opts, config, db, spool, paths):
+    """
+    Import the claimed reports, committing them together, and return a
+    (num_imported, num_failed, num_samples) tuple. If the commit fails, the
+    reports are returned to the spool and the exception is raised.
+    """
+    num_failed = num_samples = 0
+    pending = []
+    for i,path in enumerate(paths):
+        data, error, _, file_samples = lnt.util.ImportData.load_report(
+            path, opts.format)
+        if error is None:
+            try:
+                result = lnt.util.ImportData.import_and_report(
+                    config, opts.database, db, path, opts.format, True,
+                    disable_email=opts.no_email,
+                    disable_report=opts.no_report, data=data,
+                    defer_commit=True)
+                error = result['error']
+            except KeyboardInterrupt:
+                raise
+            except:
+                error = "import failure: %s" % traceback.format_exc()
+
+                # The other imports of the batch are lost along with the
+                # transaction, return them to the spool so they are retried.
+                db.rollback()
+                for retry_path in [p for p,_ in pending] + paths[i + 1:]:
+                    spool.unclaim(retry_path)
+                warning("failed to import %r" % (path,))
+                spool.finish(path, error)
+                return 0, num_failed + 1, 0
+
+        if error is not None:
+            warning("failed to import %r" % (path,))
+            spool.finish(path, error)
+            num_failed += 1
+            continue
+
+        num_samples += file_samples
+        pending.append((path, result))
+
+    if pending:
+        try:
+            lnt.util.ImportData.commit_deferred(
+                config, opts.database, db, [result for _,result in pending])
+        except KeyboardInterrupt:
+            raise
+        except:
+            # The database may be busy, return the batch to the spool to be
+            # retried.
+            db.rollback()
+            for path,_ in pending:
+                spool.unclaim(path)
+            raise
+        for path,_ in pending:
+            spool.finish(path)
+    return len(pending), num_failed, num_samples
+
+def action_ingestd(name, args):
+    """import the reports dropped into a spool directory"""
+
+    from optparse import OptionParser
+
+    parser = OptionParser("""\
+%s [options] <instance path> <spool directory>
+
+Watch a spool directory for report files, and import them into the instance.
+Reports are claimed by moving them to the 'processing' subdirectory, and moved
+to the 'done' or 'failed' subdirectory once they have been imported. Reports
+should be written under a name starting with a '.', and renamed once complete,
+so that they are not claimed while being written.\
+""" % name)
+    parser.add_option("", "--database", dest="database", default="default",
+                      help="database to write to [%default]")
+    parser.add_option("", "--format", dest="format",
+                      choices=lnt.formats.format_names + ['<auto>'],
+                      default='<auto>')
+    parser.add_option("", "--batch-size", dest="batch_size", type=int,
+                      default=50, metavar="N",
+                      help="import and commit up to N reports at a time "
+                      "[%default]")
+    parser.add_option("", "--poll-interval", dest="poll_interval", type=float,
+                      default=5.0, metavar="SECONDS",
+                      help="time to wait for new reports when the spool is "
+                      "empty [%default]")
+    parser.add_option("", "--once", dest="once", action="store_true",
+                      default=False,
+                      help="exit once the spool is empty")
+    parser.add_option("", "--recover", dest="recover", action="store_true",
+                      default=False,
+                      help="requeue the reports left in the processing "
+                      "directory; only use this when no other daemon is "
+                      "serving the spool")
+    parser.add_option("", "--no-email", dest="no_email",
+                      action="store_true", default=False)
+    parser.add_option("", "--no-report", dest="no_report",
+                      action="store_true", default=False)
+    parser.add_option("", "--show-sql", dest="show_sql", action="store_true",
+                      default=False)
+    (opts, args) = parser.parse_args(args)
+
+    if len(args) != 2:
+        parser.error("invalid number of arguments")
+    if opts.batch_size < 1:
+        parser.error("invalid batch size")
+
+    path, spool_path = args
+
+    # Setup the base LNT logger.
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'))
+    logger.addHandler(handler)
+
+    # The instance and its database are only loaded once, and used for every
+    # import.
+    instance = lnt.server.instance.Instance.frompath(path)
+    config = instance.config
+    spool = SpoolDirectory(spool_path)
+    if opts.recover:
+        note("requeued %d reports" % spool.recover())
+
+    def rate(count, elapsed):
+        return count / elapsed if elapsed else 0.0
+
+    start_time = time.time()
+    total_imported = total_failed = total_samples = 0
+    retry_delay = opts.poll_interval
+    with contextlib.closing(config.get_database(opts.database,
+                                                echo=opts.show_sql)) as db:
+        while True:
+            names = spool.pending()
+            if not names:
+                if opts.once:
+                    break
+                time.sleep(opts.poll_interval)
+                continue
+
+            batch_start_time = time.time()
+            paths = [claimed for claimed in map(spool.claim,
+                                                names[:opts.batch_size])
+                     if claimed is not None]
+            if not paths:
+                continue
+            try:
+                num_imported, num_failed, num_samples = _import_batch(
+                    opts, config, db, spool, paths)
+            except KeyboardInterrupt:
+                raise
+            except:
+                if opts.once:
+                    raise
+                # Back off while the database keeps failing.
+                warning("failed to import %d reports, retrying in %.2fs: "
+                        "%s" % (len(paths), retry_delay,
+                                traceback.format_exc()))
+                time.sleep(retry_delay)
+                retry_delay = min(max(retry_delay * 2, 1.0), MAX_RETRY_DELAY)
+                continue
+            retry_delay = opts.poll_interval
+            total_imported += num_imported
+            total_failed += num_failed
+            total_samples += num_samples
+
+            elapsed = time.time() - batch_start_time
+            note("imported %d reports (%d failed), %d samples in %.2fs "
+                 "(%.2f reports/s, %.2f samples/s), backlog: %d reports" % (
+                    num_imported, num_failed, num_samples, elapsed,
+                    rate(num_imported, elapsed), rate(num_samples, elapsed),
+                    len(names[opts.batch_size:])))
+
+    elapsed = time.time() - start_time
+    note("imported %d reports (%d failed), %d samples in %.2fs "
+         "(%.2f reports/s, %.2f samples/s)" % (
+            total_imported, total_failed, total_samples, elapsed,
+            rate(total_imported, elapsed), rate(total_samples, elapsed)))
@@ -121,6 +121,7 @@ view the results.\
 from create import action_create
 from convert import action_convert
 from import_data import action_import
+from ingestd import action_ingestd
 from updatedb import action_updatedb
 from viewcomparison import action_view_comparison
 from import_report import action_importreport
@@ -227,10 +228,22 @@ def action_submit(name, args):
     parser.add_option("-v", "--verbose", dest="verbose",
                       help="show verbose test results",
                       action="store_true", default=False)
+    parser.add_option("", "--compress", dest="compress",
+                      help="gzip compress the reports sent to the server",
+                      action="store_true", default=False)
+    parser.add_option("", "--batch-size", dest="batch_size", type=int,
+                      metavar="N", default=1,
+                      help="number of reports to send per request [%default]")
+    parser.add_option("-j", "--jobs", dest="jobs", type=int, default=1,
+                      help="number of concurrent requests [%default]")
 
     (opts, args) = parser.parse_args(args)
     if len(args) < 2:
         parser.error("incorrect number of argments")
+    if opts.batch_size < 1:
+        parser.error("invalid batch size")
+    if opts.jobs < 1:
+        parser.error("invalid number of jobs")
 
     if not opts.commit:
         warning("submit called with --commit=0, your results will not be saved"
@@ -238,7 +251,8 @@ def action_submit(name, args):
 
     from lnt.util import ServerUtil
     files = ServerUtil.submitFiles(args[0], args[1:],
-                                   opts.commit, opts.verbose)
+                                   opts.commit, opts.verbose, opts.compress,
+                                   opts.batch_size, opts.jobs)
     if opts.verbose:
         for f in files:
             lnt.util.ImportData.print_report_result(f, sys.stdout,
@@ -1,10 +1,107 @@
 import os
 from optparse import OptionParser, OptionGroup
 import contextlib
+import multiprocessing
+import time
 
+import lnt.server.db.fieldchange
+import lnt.server.db.jobqueue
+import lnt.server.db.util
+import lnt.server.db.v4db
 import lnt.server.instance
+from lnt.server.db import rules_manager as rules
 from lnt.testing.util.commands import note, warning, error, fatal
 
+def _stored_profiles(instance, db_name, db, digests):
+    """
+    Return the set of the given profile hashes which a test suite of any
+    database of the instance stores, as they all share the profile directory.
+    """
+    digests = set(digest for digest in digests if digest is not None)
+    stored = set()
+    if not digests:
+        return stored
+    for name in instance.config.get_database_names():
+        other_db = db if name == db_name else instance.get_database(name)
+        try:
+            for ts in other_db.testsuite.values():
+                stored.update(digest for digest in digests - stored
+                              if ts.has_profile(digest))
+        finally:
+            if other_db is not db:
+                other_db.close()
+    return stored
+
+def _recompute_machine(args):
+    """
+    Regenerate the field changes of a machine, returning a
+    (machine_name, num_orders, elapsed) tuple.
+    """
+    path, database, testsuite, machine_id, since = args
+    start_time = time.time()
+    instance = lnt.server.instance.Instance.frompath(path)
+    with contextlib.closing(instance.get_database(database)) as db:
+        ts = db.testsuite[testsuite]
+        machine = ts.query(ts.Machine).get(machine_id)
+        num_orders = lnt.server.db.fieldchange.\
+            recompute_fieldchanges_for_machine(ts, machine_id, since)
+        return machine.name, num_orders, time.time() - start_time
+
+def _recompute_fieldchanges(opts, path, db, ts):
+    """
+    Regenerate the field changes of the selected machines, with a pool of
+    worker processes each working on one machine at a time.
+    """
+    machines = ts.query(ts.Machine.id, ts.Machine.name)
+    if opts.machines:
+        machines = machines.filter(ts.Machine.name.in_(opts.machines))
+    machines = machines.order_by(ts.Machine.id).all()
+    for name in set(opts.machines) - set(name for _, name in machines):
+        warning("unable to find machine named: %r" % name)
+
+    since = None
+    if opts.since is not None:
+        since = lnt.server.db.util.order_sort_key([opts.since])
+
+    # The rules decide which changes are kept, register them before starting
+    # the workers.
+    rules.register_hooks()
+
+    work = [(path, opts.database, opts.testsuite, machine_id, since)
+            for machine_id, _ in machines]
+    start_time = time.time()
+    num_orders = 0
+    if opts.jobs > 1:
+        # The workers must not share the connections of this process.
+        pool = multiprocessing.Pool(
+            opts.jobs, initializer=lnt.server.db.v4db.V4DB.close_all_engines)
+        results = pool.imap_unordered(_recompute_machine, work)
+    else:
+        pool = None
+        results = (_recompute_machine(args) for args in work)
+    try:
+        for i, (name, machine_orders, elapsed) in enumerate(results):
+            num_orders += machine_orders
+            total_time = time.time() - start_time
+            print "[%d/%d] %s: %d orders in %.2fs, " \
+                "%.2f orders/s overall" % (
+                    i + 1, len(work), name, machine_orders, elapsed,
+                    num_orders / total_time if total_time else 0.0)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+
+    # Update the regressions once all the field changes are regenerated.
+    rules.post_submission_hooks(ts, [])
+    total_time = time.time() - start_time
+    print "Recomputed the field changes of %d orders on %d machines " \
+        "in %.2fs" % (num_orders, len(work), total_time)
+
 def action_updatedb(name, args):
     """modify a database"""
 
@@ -24,23 +121,64 @@ def action_updatedb(name, args):
     parser.add_option("", "--delete-run", dest="delete_runs",
                       action="append", default=[], type=int)    
     parser.add_option("", "--delete-order", dest="delete_order", default=[], type=int)
+    parser.add_option("", "--update-profile-sizes",
+                      dest="update_profile_sizes", action="store_true",
+                      default=False,
+                      help="record the sizes of the profiles stored before "
+                      "sizes were recorded")
+    parser.add_option("", "--recompute-fieldchanges",
+                      dest="recompute_fieldchanges", action="store_true",
+                      default=False,
+                      help="regenerate the field changes of past runs")
+    parser.add_option("", "--machine", dest="machines", action="append",
+                      default=[],
+                      help="only recompute the field changes of this machine")
+    parser.add_option("", "--since", dest="since", metavar="ORDER",
+                      help="only recompute the field changes of this order "
+                      "and later ones (for test suites with a single order "
+                      "field)")
+    parser.add_option("", "--jobs", dest="jobs", type=int, default=1,
+                      help="number of machines to recompute in parallel "
+                      "[%default]")
+    parser.add_option("", "--retry-failed-jobs", dest="retry_failed_jobs",
+                      action="store_true", default=False,
+                      help="queue the failed background jobs of the database "
+                      "again")
     (opts, args) = parser.parse_args(args)
 
     if len(args) != 1:
         parser.error("invalid number of arguments")
 
-    if opts.testsuite is None:
+    if opts.testsuite is None and not opts.retry_failed_jobs:
         parser.error("--testsuite is required")
 
+    if opts.recompute_fieldchanges and not opts.commit:
+        parser.error("--recompute-fieldchanges requires --commit=1")
+    if opts.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
     path, = args
 
     # Load the instance.
     instance = lnt.server.instance.Instance.frompath(path)
 
+    if opts.retry_failed_jobs:
+        # The job queue belongs to the database, not a test suite. Servers
+        # pick the retried jobs up when they next check the queue.
+        with contextlib.closing(instance.get_database(opts.database)) as db:
+            note("queued %d failed background job(s) again" % (
+                    lnt.server.db.jobqueue.retry_failed_jobs(db),))
+        if opts.testsuite is None:
+            return
+
     # Get the database and test suite.
     with contextlib.closing(instance.get_database(opts.database,
                                                   echo=opts.show_sql)) as db:
         ts = db.testsuite[opts.testsuite]
+        if opts.since is not None and len(ts.order_fields) != 1:
+            # There is no way to spell the value of several fields.
+            fatal("--since is only supported for test suites with a single "
+                  "order field")
         order = None
         # Compute a list of all the runs to delete.
         if opts.delete_order:
@@ -57,10 +195,12 @@ def action_updatedb(name, args):
                     join(ts.Machine).\
                     filter(ts.Machine.name.in_(opts.delete_machines)))
 
-        # Delete all samples associated with those runs.
-        ts.query(ts.Sample).\
-            filter(ts.Sample.run_id.in_(runs_to_delete)).\
-            delete(synchronize_session=False)
+        # Delete all samples associated with those runs, along with the
+        # profiles only they refer to.
+        samples_to_delete = ts.query(ts.Sample).\
+            filter(ts.Sample.run_id.in_(runs_to_delete))
+        profiles_to_delete = ts.release_profiles(samples_to_delete)
+        samples_to_delete.delete(synchronize_session=False)
         
         # Delete all FieldChanges and RegressionIndicators
         for r in runs_to_delete:
@@ -92,7 +232,29 @@ def action_updatedb(name, args):
         if order:
             ts.delete(order)
 
+        if opts.update_profile_sizes:
+            note("recorded the sizes of %d profiles" %
+                 ts.update_profile_sizes())
+
         if opts.commit:
             db.commit()
+
+            # The profile files can only go once the database no longer
+            # refers to them, and no profile with the same contents was stored
+            # since.
+            profileDir = instance.config.profileDir
+            stored = _stored_profiles(instance, opts.database, db,
+                                      [digest for digest, _ in
+                                       profiles_to_delete])
+            for digest, filename in profiles_to_delete:
+                if digest in stored:
+                    continue
+                try:
+                    os.remove(os.path.join(profileDir, filename))
+                except OSError:
+                    warning("unable to remove profile: %r" % filename)
         else:
             db.rollback()
+
+        if opts.recompute_fieldchanges:
+            _recompute_fieldchanges(opts, path, db, ts)
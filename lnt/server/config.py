@@ -62,11 +62,16 @@ class DBInfo:
         baseline_revision = config_data.get('baseline_revision',
                                             default_baseline_revision)
 
+        # Submissions arriving within the group commit window (in seconds) are
+        # committed together.
+        group_commit_window = float(config_data.get('group_commit_window', 0))
+
         return DBInfo(dbPath,
                       str(config_data.get('db_version', '0.4')),
                       config_data.get('shadow_import', None),
                       email_config,
-                      baseline_revision)
+                      baseline_revision,
+                      group_commit_window)
     
     @staticmethod
     def dummy_instance():
@@ -75,18 +80,22 @@ class DBInfo:
     
     def __init__(self, path,
                  db_version, shadow_import, email_config,
-                 baseline_revision):
+                 baseline_revision, group_commit_window=0):
         self.config = None
         self.path = path
         self.db_version = db_version
         self.shadow_import = shadow_import
         self.email_config = email_config
         self.baseline_revision = baseline_revision
+        self.group_commit_window = group_commit_window
         
     def __str__(self):
         return "DBInfo(" + self.path + ")"
 
 
+# The default limit on the size of a submission, in bytes.
+DEFAULT_MAX_SUBMISSION_SIZE = 1 << 30
+
 class Config:
     @staticmethod
     def from_data(path, data):
@@ -116,6 +125,14 @@ class Config:
             blacklist = None
         secretKey = data.get('secret_key', None)
 
+        # Submissions are turned away while the server is this busy.
+        max_inflight_imports = data.get('max_inflight_imports', None)
+        max_background_jobs = data.get('max_background_jobs', None)
+        retry_after = data.get('retry_after', 5)
+        # The largest submission accepted, once decompressed.
+        max_submission_size = data.get('max_submission_size',
+                                       DEFAULT_MAX_SUBMISSION_SIZE)
+
         return Config(data.get('name', 'LNT'), data['zorgURL'],
                       dbDir, os.path.join(baseDir, tempDir),
                       os.path.join(baseDir, profileDir), secretKey,
@@ -123,7 +140,8 @@ class Config:
                                                  default_email_config,
                                                  0))
                            for k, v in data['databases'].items()]),
-                      blacklist)
+                      blacklist, max_inflight_imports, max_background_jobs,
+                      retry_after, max_submission_size)
     
     @staticmethod
     def dummy_instance():
@@ -144,7 +162,10 @@ class Config:
                       dbInfo,
                       blacklist)
 
-    def __init__(self, name, zorgURL, dbDir, tempDir, profileDir, secretKey, databases, blacklist):
+    def __init__(self, name, zorgURL, dbDir, tempDir, profileDir, secretKey,
+                 databases, blacklist, max_inflight_imports=None,
+                 max_background_jobs=None, retry_after=5,
+                 max_submission_size=DEFAULT_MAX_SUBMISSION_SIZE):
         self.name = name
         self.zorgURL = zorgURL
         self.dbDir = dbDir
@@ -152,6 +173,10 @@ class Config:
         self.secretKey = secretKey
         self.blacklist = blacklist
         self.profileDir = profileDir
+        self.max_inflight_imports = max_inflight_imports
+        self.max_background_jobs = max_background_jobs
+        self.retry_after = retry_after
+        self.max_submission_size = max_submission_size
         while self.zorgURL.endswith('/'):
             self.zorgURL = zorgURL[:-1]
         self.databases = databases
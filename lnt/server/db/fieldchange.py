@@ -1,11 +1,13 @@
+import bisect
 import difflib
+import itertools
 import sqlalchemy.sql
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import ObjectDeletedError
 import lnt.server.reporting.analysis
 from lnt.testing.util.commands import warning
 from lnt.testing.util.commands import note, timed
 from lnt.server.db.regression import new_regression, RegressionState
-from lnt.server.db.regression import get_ris
 from lnt.server.db.regression import rebuild_title
 from sqlalchemy import or_
 from lnt.server.db import rules_manager as rules
@@ -16,13 +18,37 @@ FIELD_CHANGE_LOOKBACK = 10
 
 
 def post_submit_tasks(ts, run_id):
-    regenerate_fieldchanges_for_run(ts, run_id)
+    post_submit_tasks_for_runs(ts, [run_id])
 
 
-def delete_fieldchange(ts, change):
+def post_submit_tasks_for_runs(ts, run_ids):
+    """Run the post submission tasks for several runs at once.
+
+    The field changes are regenerated once for each machine and order, as
+    they cover all the runs of the order, and the post submission hooks are
+    only run once at the end.
+    """
+    regenerated = set()
+    for run_id in run_ids:
+        run = ts.query(ts.Run).get(run_id)
+        if run is None:
+            # The run was deleted since it was submitted.
+            continue
+        ts.process_pending_profiles(run_id)
+        key = (run.machine_id, run.order_id)
+        if key in regenerated:
+            continue
+        regenerated.add(key)
+        regenerate_fieldchanges_for_run(ts, run_id, run_hooks=False)
+
+    if regenerated:
+        rules.post_submission_hooks(ts, run_ids)
+
+
+def delete_fieldchange(ts, change, commit=True):
     """Delete this field change.  Since it might be attahed to a regression
     via regression indicators, fix those up too.  If this orphans a regression
-    delete it as well."""
+    delete it as well.  The deletion is committed unless commit is False."""
     # Find the indicators.
     indicators = ts.query(ts.RegressionIndicator). \
         filter(ts.RegressionIndicator.field_change_id == change.id). \
@@ -49,13 +75,35 @@ def delete_fieldchange(ts, change):
             note("Deleting regression because it has not changes:" + repr(r))
             ts.delete(r)
             deleted_ids.append(r)
-    ts.commit()
+    if commit:
+        ts.commit()
     return deleted_ids
 
 
+# The number of ids to put in a single IN clause, SQLite limits the number of
+# bound parameters of a query to 999.
+QUERY_CHUNK_SIZE = 500
+
+
+def _load_by_id(ts, table, ids):
+    """Load the objects of the table with the given ids, returning them in a
+    dict by id."""
+    ids = list(ids)
+    objects = {}
+    for i in range(0, len(ids), QUERY_CHUNK_SIZE):
+        chunk = ids[i:i + QUERY_CHUNK_SIZE]
+        for obj in ts.query(table).filter(table.id.in_(chunk)):
+            objects[obj.id] = obj
+    return objects
+
+
 @timed
-def regenerate_fieldchanges_for_run(ts, run_id):
+def regenerate_fieldchanges_for_run(ts, run_id, run_hooks=True):
     """Regenerate the set of FieldChange objects for the given run.
+
+    The existing field changes of the run are loaded with a single query, and
+    all the changes are written in a single transaction. The post submission
+    hooks are run afterwards, unless run_hooks is False.
     """
     # Allow for potentially a few different runs, previous_runs, next_runs
     # all with the same order_id which we will aggregate together to make
@@ -67,17 +115,6 @@ def regenerate_fieldchanges_for_run(ts, run_id):
         all()
 
     previous_runs = ts.get_previous_runs_on_machine(run, FIELD_CHANGE_LOOKBACK)
-    next_runs = ts.get_next_runs_on_machine(run, FIELD_CHANGE_LOOKBACK)
-
-    # Find our start/end order.
-    if previous_runs != []:
-        start_order = previous_runs[0].order
-    else:
-        start_order = run.order
-    if next_runs != []:
-        end_order = next_runs[-1].order
-    else:
-        end_order = run.order
 
     # Load our run data for the creation of the new fieldchanges.
     runs_to_load = [r.id for r in (runs + previous_runs)]
@@ -90,63 +127,142 @@ def regenerate_fieldchanges_for_run(ts, run_id):
         warning("Generating field changes for {} runs."
                 "That will be very slow.".format(run_size))
     runinfo = lnt.server.reporting.analysis.RunInfo(ts, runs_to_load)
+    _update_fieldchanges(ts, run, runs, previous_runs, runinfo)
+
+    if run_hooks:
+        rules.post_submission_hooks(ts, [run_id])
+
+
+def _update_fieldchanges(ts, run, runs, previous_runs, runinfo):
+    """Update the field changes between the previous runs and the runs of the
+    order of run, whose samples are loaded in runinfo, and commit them."""
+    # Find our start order. Field changes end at the order of the run, so
+    # regenerating them for a run again finds the ones created before.
+    if previous_runs != []:
+        start_order = previous_runs[0].order
+    else:
+        start_order = run.order
+
+    # Load all the field changes we could update, by (test_id, field_id).
+    existing = {}
+    for f in ts.query(ts.FieldChange) \
+            .filter(ts.FieldChange.machine_id == run.machine_id) \
+            .filter(ts.FieldChange.end_order_id == run.order_id) \
+            .filter(ts.FieldChange.start_order_id == start_order.id):
+        existing[(f.test_id, f.field_id)] = f
 
     # Only store fieldchanges for "metric" samples like execution time;
     # not for fields with other data, e.g. hash of a binary
+    changes = []
     for field in list(ts.Sample.get_metric_fields()):
         for test_id in runinfo.test_ids:
-            f = None
             result = runinfo.get_comparison_result(
                 runs, previous_runs, test_id, field,
                 ts.Sample.get_hash_of_binary_field())
-            # Try and find a matching FC and update, else create one.
-            try:
-                f = ts.query(ts.FieldChange) \
-                    .filter(ts.FieldChange.start_order == start_order) \
-                    .filter(ts.FieldChange.end_order == end_order) \
-                    .filter(ts.FieldChange.test_id == test_id) \
-                    .filter(ts.FieldChange.machine == run.machine) \
-                    .filter(ts.FieldChange.field == field) \
-                    .one()
-            except sqlalchemy.orm.exc.NoResultFound:
-                f = None
-
-            if not result.is_result_performance_change() and f:
-                # With more data, its not a regression. Kill it!
-                note("Removing field change: {}".format(f.id))
-                deleted = delete_fieldchange(ts, f)
+            f = existing.get((test_id, field.id))
+
+            if not result.is_result_performance_change():
+                if f:
+                    # With more data, its not a regression. Kill it!
+                    note("Removing field change: {}".format(f.id))
+                    delete_fieldchange(ts, f, commit=False)
                 continue
+            changes.append((test_id, field, result, f))
+
+    # Create the field changes which are new, loading all their tests at once.
+    tests = _load_by_id(ts, ts.Test,
+                        set(test_id for test_id, _, _, f in changes
+                            if f is None))
+    new_changes = []
+    for test_id, field, result, f in changes:
+        is_new = f is None
+        if is_new:
+            f = ts.FieldChange(start_order=start_order,
+                               end_order=run.order,
+                               machine=run.machine,
+                               test=tests[test_id],
+                               field=field)
+
+        # Always update FCs with new values.
+        f.old_value = result.previous
+        f.new_value = result.current
+
+        # Check the rules to see if this change matters. The rules may have
+        # changed since an existing change was made, so check those too.
+        if not rules.is_useful_change(ts, f):
+            if not is_new:
+                note("Removing filtered field change: {}".format(f.id))
+                delete_fieldchange(ts, f, commit=False)
+            continue
+        if is_new:
+            ts.add(f)
+            new_changes.append(f)
+        f.run = run
 
-            if result.is_result_performance_change() and not f:
-                test = ts.query(ts.Test).filter(ts.Test.id == test_id).one()
-                f = ts.FieldChange(start_order=start_order,
-                                   end_order=run.order,
-                                   machine=run.machine,
-                                   test=test,
-                                   field=field)
-                # Check the rules to see if this change matters.
-                if rules.is_useful_change(ts, f):
-                    ts.add(f)
-                    ts.commit()
-                    try:
-                        found, new_reg = identify_related_changes(ts, f)
-                    except ObjectDeletedError:
-                        # This can happen from time to time.
-                        # So, lets retry once.
-                        found, new_reg = identify_related_changes(ts, f)
-                        
-                    if found:
-                        note("Found field change: {}".format(run.machine))
-
-            # Always update FCs with new values.
-            if f:
-                f.old_value = result.previous
-                f.new_value = result.current
-                f.run = run
+    # Write all the changes, and then find a regression for each new one.
+    ts.session.flush()
+    index = RegressionIndex(ts) if new_changes else None
+    for f in new_changes:
+        try:
+            found, new_reg = identify_related_changes(ts, f, commit=False,
+                                                      index=index)
+        except ObjectDeletedError:
+            # This can happen from time to time.
+            # So, lets retry once.
+            index = RegressionIndex(ts)
+            found, new_reg = identify_related_changes(ts, f, commit=False,
+                                                      index=index)
+
+        if found:
+            note("Found field change: {}".format(run.machine))
     ts.commit()
 
-    regressions = ts.query(ts.Regression).all()[::-1]
-    rules.post_submission_hooks(ts, regressions)
+
+def recompute_fieldchanges_for_machine(ts, machine_id, since=None,
+                                       progress=None):
+    """
+    recompute_fieldchanges_for_machine(ts, machine_id[, since, progress])
+      -> int
+
+    Regenerate the field changes of every order with runs on the machine, or
+    only of the orders whose sort key is at least since, walking them in
+    order. The samples of the lookback window are kept loaded as it slides
+    over the orders, so each run is only loaded once. The progress function,
+    if given, is called with the number of orders done and the total.
+
+    Returns the number of orders the field changes were regenerated for.
+    """
+    runs = ts.query(ts.Run) \
+        .filter(ts.Run.machine_id == machine_id) \
+        .options(joinedload(ts.Run.order)) \
+        .all()
+    runs.sort(key=lambda r: (r.order, r.order_id, r.id))
+    orders = [list(order_runs) for _, order_runs in
+              itertools.groupby(runs, key=lambda r: r.order_id)]
+
+    first = 0
+    if since is not None:
+        while first < len(orders) and \
+                _order_key(orders[first][0].order) < since:
+            first += 1
+
+    runinfo = lnt.server.reporting.analysis.RunInfo(ts, [])
+    for i in range(first, len(orders)):
+        window = orders[max(0, i - FIELD_CHANGE_LOOKBACK):i]
+        window_ids = set(r.id for order_runs in window + [orders[i]]
+                         for r in order_runs)
+        runinfo.unload_runs(runinfo.loaded_run_ids - window_ids)
+        runinfo.load_runs(window_ids)
+
+        # Like get_previous_runs_on_machine(), the closest runs come first.
+        previous_runs = [r for order_runs in reversed(window)
+                         for r in order_runs]
+        # The field changes refer to the most recent run of the order.
+        _update_fieldchanges(ts, orders[i][-1], orders[i], previous_runs,
+                             runinfo)
+        if progress is not None:
+            progress(i - first + 1, len(orders) - first)
+    return len(orders) - first
 
 
 def is_overlaping(fc1, fc2):
@@ -163,6 +279,11 @@ def is_overlaping(fc1, fc2):
            (r1_min < r2_max and r2_min < r1_max)
 
 
+# Upper bound on the number of memoized similarity scores.
+MAX_CACHED_SIMILARITIES = 100000
+_similarity_cache = {}
+
+
 def percent_similar(a, b):
     """
     Percent similar: are these strings similar to each other?
@@ -170,53 +291,129 @@ def percent_similar(a, b):
     :param b: second string
     """
     # type: (str, str) -> float
-    s = difflib.SequenceMatcher(lambda x: x.isdigit(), a, b)
-    return s.ratio()
+    # The same machine and test names are compared over and over, and
+    # matching them is expensive, so remember the scores.
+    key = (a, b)
+    ratio = _similarity_cache.get(key)
+    if ratio is None:
+        s = difflib.SequenceMatcher(lambda x: x.isdigit(), a, b)
+        ratio = s.ratio()
+        if len(_similarity_cache) >= MAX_CACHED_SIMILARITIES:
+            _similarity_cache.clear()
+        _similarity_cache[key] = ratio
+    return ratio
+
+
+def _order_key(order):
+    return order.sort_key or order.compute_sort_key()
+
+
+class RegressionIndex(object):
+    """An index of the field changes in the open regressions by order range,
+    to find the ones overlapping a field change without visiting every
+    regression.
+
+    The changes are kept sorted by the end of their range, so the changes
+    which end before a new change starts, which for a new change are almost
+    all of them, are skipped with a binary search. The changes are loaded with
+    a single query, along with the rows needed to compare them.
+    """
+
+    def __init__(self, ts):
+        self._end_keys = []
+        self._entries = []
+        self._sequence = itertools.count()
+
+        open_changes = ts.query(ts.Regression, ts.FieldChange) \
+            .join(ts.RegressionIndicator,
+                  ts.RegressionIndicator.regression_id == ts.Regression.id) \
+            .join(ts.FieldChange,
+                  ts.RegressionIndicator.field_change_id ==
+                  ts.FieldChange.id) \
+            .filter(or_(ts.Regression.state == RegressionState.DETECTED,
+                        ts.Regression.state ==
+                        RegressionState.DETECTED_FIXED)) \
+            .options(joinedload(ts.FieldChange.start_order),
+                     joinedload(ts.FieldChange.end_order),
+                     joinedload(ts.FieldChange.machine),
+                     joinedload(ts.FieldChange.test)) \
+            .order_by(ts.Regression.id, ts.RegressionIndicator.id)
+        for regression, change in open_changes:
+            self.add(regression, change)
+
+    def add(self, regression, change):
+        """Add a change of the open regression to the index."""
+        if change.start_order is None or change.end_order is None:
+            return
+        end_key = _order_key(change.end_order)
+        position = bisect.bisect_right(self._end_keys, end_key)
+        self._end_keys.insert(position, end_key)
+        # Changes are matched in the order they were added, like regressions
+        # and then indicators in the database.
+        self._entries.insert(position, (next(self._sequence),
+                                        _order_key(change.start_order),
+                                        end_key, regression, change))
+
+    def overlapping(self, fc):
+        """
+        overlapping(fc) -> [(regression, change)]
+
+        Return the indexed changes whose order range overlaps the one of the
+        field change, in the order they were added.
+        """
+        if fc.start_order is None or fc.end_order is None:
+            return []
+        start_key = _order_key(fc.start_order)
+        end_key = _order_key(fc.end_order)
+        # Only changes ending at or after the start of this one can overlap.
+        first = bisect.bisect_left(self._end_keys, start_key)
+        found = [entry for entry in self._entries[first:]
+                 if (entry[1] == start_key and entry[2] == end_key) or
+                 (entry[1] < end_key and start_key < entry[2])]
+        found.sort()
+        return [(regression, change)
+                for _, _, _, regression, change in found]
 
 
 @timed
-def identify_related_changes(ts, fc):
+def identify_related_changes(ts, fc, commit=True, index=None):
     """Can we find a home for this change in some existing regression? If a
     match is found add a regression indicator adding this change to that
-    regression, otherwise create a new regression for this change.
+    regression, otherwise create a new regression for this change. The
+    changes are committed unless commit is False.
 
     Regression matching looks for regressions that happen in overlapping order
-    ranges. Then looks for changes that are similar.
-
+    ranges. Then looks for changes that are similar. The regressions are
+    looked up in index, a RegressionIndex which is updated with the change,
+    or in a new index if it is None.
     """
-    regressions = ts.query(ts.Regression.id) \
-        .filter(or_(ts.Regression.state == RegressionState.DETECTED,
-                ts.Regression.state == RegressionState.DETECTED_FIXED)) \
-        .all()
+    if index is None:
+        index = RegressionIndex(ts)
+
+    for regression, regression_change in index.overlapping(fc):
+        confidence = 0.0
+
+        confidence += percent_similar(regression_change.machine.name,
+                                      fc.machine.name)
+        confidence += percent_similar(regression_change.test.name, fc.test.name)
+
+        if regression_change.field_id == fc.field.id:
+            confidence += 1.0
 
-    for regression_packed in regressions:
-        regression_id = regression_packed[0]
-        regression_indicators = get_ris(ts, regression_id)
-        print "RIs:", regression_indicators
-        for change in regression_indicators:
-            regression_change = change.field_change
-            if is_overlaping(regression_change, fc):
-                confidence = 0.0
-
-                confidence += percent_similar(regression_change.machine.name,
-                                              fc.machine.name)
-                confidence += percent_similar(regression_change.test.name, fc.test.name)
-
-                if regression_change.field == fc.field:
-                    confidence += 1.0
-
-                if confidence >= 2.0:
-                    # Matching
-                    MSG = "Found a match: {} with score {}."
-                    regression = ts.query(ts.Regression).get(regression_id)
-                    note(MSG.format(str(regression),
-                                    confidence))
-                    ri = ts.RegressionIndicator(regression, fc)
-                    ts.add(ri)
-                    # Update the default title if needed.
-                    rebuild_title(ts, regression)
-                    ts.commit()
-                    return True, regression
+        if confidence >= 2.0:
+            # Matching
+            MSG = "Found a match: {} with score {}."
+            note(MSG.format(str(regression),
+                            confidence))
+            ri = ts.RegressionIndicator(regression, fc)
+            ts.add(ri)
+            # Update the default title if needed.
+            rebuild_title(ts, regression)
+            if commit:
+                ts.commit()
+            index.add(regression, fc)
+            return True, regression
     note("Could not find a partner, creating new Regression for change")
-    new_reg = new_regression(ts, [fc.id])
+    new_reg = new_regression(ts, [fc.id], commit=commit)
+    index.add(new_reg, fc)
     return False, new_reg
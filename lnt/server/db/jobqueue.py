@@ -0,0 +1,217 @@
+"""
+A durable queue of the background jobs to run for submitted runs.
+
+Jobs are kept in the BackgroundJob table, and are added in the same transaction
+as the run they are for, so they are not lost when the server is restarted or
+the worker running them crashes; every job is run at least once. The waiting
+jobs of a machine are run together. A failed job is retried with an
+exponential backoff, and after MAX_ATTEMPTS failures it is kept as failed
+until it is retried with lnt updatedb --retry-failed-jobs.
+
+Jobs must be idempotent, as a job may be run again after running partially.
+"""
+
+import datetime
+import itertools
+import os
+import socket
+import sys
+import traceback
+
+from sqlalchemy import *
+
+import lnt.server.db.fieldchange as fieldchange
+from lnt.server.db.testsuite import Base
+from lnt.testing.util.commands import error
+
+# The functions run by jobs, by job name. They take a test suite and a list of
+# run ids.
+JOB_FUNCTIONS = {
+    'post_submit_tasks': fieldchange.post_submit_tasks_for_runs,
+}
+
+# The number of times a job is run before it is marked as failed.
+MAX_ATTEMPTS = 5
+# The delay before retrying a failed job, in seconds, doubled with each
+# attempt.
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+# How long a job may run, in seconds, before it is assumed that the worker
+# running it crashed, and it is run again.
+JOB_LEASE = 3600
+
+
+class JobState:
+    # Waiting to be run.
+    PENDING = 0
+    # Claimed by a worker.
+    RUNNING = 1
+    # Failed MAX_ATTEMPTS times.
+    FAILED = 2
+    names = {PENDING: u'Pending',
+             RUNNING: u'Running',
+             FAILED: u'Failed'
+             }
+
+
+class BackgroundJob(Base):
+    __tablename__ = 'BackgroundJob'
+
+    id = Column("ID", Integer, primary_key=True)
+    job = Column("Job", String(256))
+    testsuite = Column("TestSuite", String(256))
+    machine_id = Column("MachineID", Integer, index=True)
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    attempts = Column("Attempts", Integer)
+    created = Column("Created", DateTime)
+    # When the job can next be run.
+    not_before = Column("NotBefore", DateTime)
+    # When, and by which worker, the job was last claimed.
+    claimed_at = Column("ClaimedAt", DateTime)
+    worker = Column("Worker", String(256))
+    # The error of the last failed attempt.
+    error = Column("Error", Text)
+
+    def __init__(self, job, testsuite, machine_id, run_id):
+        self.job = job
+        self.testsuite = testsuite
+        self.machine_id = machine_id
+        self.run_id = run_id
+        self.state = JobState.PENDING
+        self.attempts = 0
+        self.created = self.not_before = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '%s%r' % (self.__class__.__name__, (self.job, self.testsuite,
+                                                   self.run_id, self.state))
+
+    @property
+    def state_name(self):
+        return JobState.names[self.state]
+
+
+# Identifies the claims made by this process.
+_claim_ids = itertools.count()
+
+
+def queue_job(db, job, ts, run):
+    """Queue the job for the run, in the current transaction."""
+    assert job in JOB_FUNCTIONS, "unknown job %r" % (job,)
+    db.add(BackgroundJob(job, ts.name, run.machine_id, run.id))
+
+
+def _retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def _runnable(now):
+    return or_(and_(BackgroundJob.state == JobState.PENDING,
+                    BackgroundJob.not_before <= now),
+               and_(BackgroundJob.state == JobState.RUNNING,
+                    BackgroundJob.claimed_at <=
+                    now - datetime.timedelta(seconds=JOB_LEASE)))
+
+
+def _next_attempt(db, job, ts_name, machine_id, now):
+    """Return the number of seconds until waiting jobs of the machine can be
+    run, or None if there are none."""
+    jobs = db.query(BackgroundJob.state, BackgroundJob.not_before,
+                    BackgroundJob.claimed_at).\
+        filter(BackgroundJob.job == job).\
+        filter(BackgroundJob.testsuite == ts_name).\
+        filter(BackgroundJob.machine_id == machine_id).\
+        filter(BackgroundJob.state != JobState.FAILED).all()
+    times = [not_before if state == JobState.PENDING else
+             claimed_at + datetime.timedelta(seconds=JOB_LEASE)
+             for state, not_before, claimed_at in jobs]
+    if not times:
+        return None
+    return max(0, (min(times) - now).total_seconds())
+
+
+def run_jobs(db, job, ts_name, machine_id):
+    """
+    run_jobs(db, job, ts_name, machine_id) -> delay or None
+
+    Claim and run the runnable jobs of the machine. Return the number of
+    seconds until the remaining jobs of the machine can be run, or None if
+    there are none. Failures of the jobs are logged, and the jobs are retried
+    later.
+    """
+    now = datetime.datetime.utcnow()
+    claim = "%s:%d:%d" % (socket.gethostname(), os.getpid(), next(_claim_ids))
+    group = and_(BackgroundJob.job == job,
+                 BackgroundJob.testsuite == ts_name,
+                 BackgroundJob.machine_id == machine_id)
+
+    # Claim the jobs with a single update, so that several workers never run
+    # the same job.
+    db.query(BackgroundJob).filter(group).filter(_runnable(now)).\
+        update({BackgroundJob.state: JobState.RUNNING,
+                BackgroundJob.claimed_at: now,
+                BackgroundJob.worker: claim}, synchronize_session=False)
+    db.commit()
+    claimed = db.query(BackgroundJob).\
+        filter(BackgroundJob.worker == claim).\
+        filter(BackgroundJob.state == JobState.RUNNING).all()
+    if claimed:
+        ts = db.testsuite[ts_name]
+        try:
+            JOB_FUNCTIONS[job](ts, sorted(set(j.run_id for j in claimed)))
+        except:
+            error_text = "".join(traceback.format_exception(*sys.exc_info()))
+            error("Background job {} for runs {} failed with:{}".format(
+                    job, [j.run_id for j in claimed], error_text))
+            db.rollback()
+            now = datetime.datetime.utcnow()
+            for claimed_job in claimed:
+                claimed_job.attempts += 1
+                claimed_job.error = error_text
+                if claimed_job.attempts >= MAX_ATTEMPTS:
+                    claimed_job.state = JobState.FAILED
+                else:
+                    claimed_job.state = JobState.PENDING
+                    claimed_job.not_before = now + datetime.timedelta(
+                        seconds=_retry_delay(claimed_job.attempts))
+            db.commit()
+        else:
+            for claimed_job in claimed:
+                db.delete(claimed_job)
+            db.commit()
+
+    return _next_attempt(db, job, ts_name, machine_id,
+                         datetime.datetime.utcnow())
+
+
+def waiting_jobs(db):
+    """
+    waiting_jobs(db) -> [((job, ts_name, machine_id), delay)]
+
+    Return the machines with jobs which are not failed, with the number of
+    seconds until their jobs can be run.
+    """
+    now = datetime.datetime.utcnow()
+    groups = db.query(BackgroundJob.job, BackgroundJob.testsuite,
+                      BackgroundJob.machine_id).\
+        filter(BackgroundJob.state != JobState.FAILED).distinct().all()
+    return [(tuple(group), _next_attempt(db, *(tuple(group) + (now,))))
+            for group in groups]
+
+
+def num_waiting_jobs(db):
+    """Return the number of jobs which are not failed."""
+    return db.query(BackgroundJob).\
+        filter(BackgroundJob.state != JobState.FAILED).count()
+
+
+def retry_failed_jobs(db):
+    """Queue the failed jobs again, returning how many there were."""
+    num_retried = db.query(BackgroundJob).\
+        filter(BackgroundJob.state == JobState.FAILED).\
+        update({BackgroundJob.state: JobState.PENDING,
+                BackgroundJob.attempts: 0,
+                BackgroundJob.not_before: datetime.datetime.utcnow()},
+               synchronize_session=False)
+    db.commit()
+    return num_retried
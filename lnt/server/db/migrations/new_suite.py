@@ -2,6 +2,13 @@ from . import upgrade_0_to_1
 from . import upgrade_2_to_3
 from . import upgrade_7_to_8
 from . import upgrade_8_to_9
+from . import upgrade_11_to_12
+from . import upgrade_12_to_13
+from . import upgrade_13_to_14
+from . import upgrade_14_to_15
+from . import upgrade_16_to_17
+from . import upgrade_17_to_18
+from . import upgrade_18_to_19
 
 
 def init_new_testsuite(engine, session, name):
@@ -17,3 +24,17 @@ def init_new_testsuite(engine, session, name):
     session.commit()
     upgrade_8_to_9.upgrade_testsuite(engine, session, name)
     session.commit()
+    upgrade_11_to_12.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_12_to_13.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_13_to_14.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_14_to_15.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_16_to_17.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_17_to_18.upgrade_testsuite(engine, session, name)
+    session.commit()
+    upgrade_18_to_19.upgrade_testsuite(engine, session, name)
+    session.commit()
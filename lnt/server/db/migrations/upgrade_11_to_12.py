@@ -0,0 +1,66 @@
+# Version 12 materializes the total ordering of orders, by adding an indexed
+# sort key and an ordinal to the Order table of every test suite.
+
+import logging
+
+import sqlalchemy
+from sqlalchemy.sql import bindparam, column, table
+
+# Import the original schema from upgrade_0_to_1 since upgrade_11_to_12 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+from lnt.server.db.util import order_sort_key
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+    field_names = [f.name for f in sorted(test_suite.order_fields,
+                                          key=lambda f: f.ordinal)]
+
+    session.connection().execute("""
+ALTER TABLE "%s_Order"
+ADD COLUMN "SortKey" VARCHAR
+""" % (db_key_name,))
+    session.connection().execute("""
+ALTER TABLE "%s_Order"
+ADD COLUMN "Ordinal" INTEGER
+""" % (db_key_name,))
+    session.connection().execute("""
+CREATE INDEX "ix_%s_Order_SortKey" ON "%s_Order" ("SortKey")
+""" % (db_key_name, db_key_name))
+    session.connection().execute("""
+CREATE INDEX "ix_%s_Order_Ordinal" ON "%s_Order" ("Ordinal")
+""" % (db_key_name, db_key_name))
+
+    # Backfill the keys and ordinals of the existing orders.
+    logger.info("computing order sort keys for %r", name)
+    order_table = table(db_key_name + '_Order',
+                        column('ID'), column('SortKey'), column('Ordinal'),
+                        *[column(f) for f in field_names])
+    rows = session.connection().execute(sqlalchemy.select(
+            [order_table.c.ID] + [order_table.c[f] for f in field_names]))
+    keyed = sorted((order_sort_key(row[1:]), row[0])
+                   for row in rows)
+    if keyed:
+        session.connection().execute(
+            order_table.update().\
+                where(order_table.c.ID == bindparam('order_id')).\
+                values(SortKey=bindparam('sort_key'),
+                       Ordinal=bindparam('ordinal')),
+            [{'order_id': order_id, 'sort_key': key, 'ordinal': i}
+             for i, (key, order_id) in enumerate(keyed)])
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
@@ -0,0 +1,44 @@
+# Version 13 stores profiles content addressed, adding the content hash and a
+# reference count to the Profile table of every test suite.
+
+import sqlalchemy
+
+# Import the original schema from upgrade_0_to_1 since upgrade_12_to_13 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    session.connection().execute("""
+ALTER TABLE "%s_Profile"
+ADD COLUMN "Hash" VARCHAR(64)
+""" % (db_key_name,))
+    session.connection().execute("""
+ALTER TABLE "%s_Profile"
+ADD COLUMN "RefCount" INTEGER
+""" % (db_key_name,))
+    session.connection().execute("""
+CREATE INDEX "ix_%s_Profile_Hash" ON "%s_Profile" ("Hash")
+""" % (db_key_name, db_key_name))
+
+    # Existing profiles were never shared, count the samples using them.
+    session.connection().execute("""
+UPDATE "%s_Profile"
+SET "RefCount" = (SELECT COUNT(*) FROM "%s_Sample"
+                  WHERE "%s_Sample"."ProfileID" = "%s_Profile"."ID")
+""" % (db_key_name, db_key_name, db_key_name, db_key_name))
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
@@ -0,0 +1,71 @@
+# Version 14 adds indexed fingerprint columns to the Machine and Run tables of
+# every test suite, used to find existing machines and duplicate runs on
+# import.
+
+import logging
+
+import sqlalchemy
+from sqlalchemy import DateTime, Integer, LargeBinary, String
+from sqlalchemy.sql import bindparam, column, table
+
+# Import the original schema from upgrade_0_to_1 since upgrade_13_to_14 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+from lnt.server.db.util import fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def _add_fingerprints(session, db_key_name, kind, key_columns, field_names):
+    session.connection().execute("""
+ALTER TABLE "%s_%s"
+ADD COLUMN "Fingerprint" VARCHAR(40)
+""" % (db_key_name, kind))
+    session.connection().execute("""
+CREATE INDEX "ix_%s_%s_Fingerprint" ON "%s_%s" ("Fingerprint")
+""" % (db_key_name, kind, db_key_name, kind))
+
+    # Backfill the fingerprints of the existing records. This must hash the
+    # same values, in the same order, as the model's compute_fingerprint().
+    columns = key_columns + [column(f, String) for f in sorted(field_names)] + \
+        [column('Parameters', LargeBinary)]
+    record_table = table('%s_%s' % (db_key_name, kind),
+                         column('ID', Integer), column('Fingerprint'),
+                         *columns)
+    rows = session.connection().execute(sqlalchemy.select(
+            [record_table.c.ID] + columns)).fetchall()
+    if rows:
+        session.connection().execute(
+            record_table.update().\
+                where(record_table.c.ID == bindparam('record_id')).\
+                values(Fingerprint=bindparam('fingerprint')),
+            [{'record_id': row[0], 'fingerprint': fingerprint(row[1:])}
+             for row in rows])
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    logger.info("computing machine and run fingerprints for %r", name)
+    _add_fingerprints(session, db_key_name, 'Machine',
+                      [column('Name', String)],
+                      [f.name for f in test_suite.machine_fields])
+    _add_fingerprints(session, db_key_name, 'Run',
+                      [column('MachineID', Integer),
+                       column('OrderID', Integer),
+                       column('StartTime', DateTime),
+                       column('EndTime', DateTime)],
+                      [f.name for f in test_suite.run_fields])
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
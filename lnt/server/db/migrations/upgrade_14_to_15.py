@@ -0,0 +1,37 @@
+# Version 15 adds the content hash of the submission each run was imported
+# from to the Run table of every test suite, so exact resubmissions can be
+# recognized without loading them.
+#
+# Existing runs are not backfilled, the files they were imported from may no
+# longer exist.
+
+import sqlalchemy
+
+# Import the original schema from upgrade_0_to_1 since upgrade_14_to_15 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    session.connection().execute("""
+ALTER TABLE "%s_Run"
+ADD COLUMN "ContentHash" VARCHAR(40)
+""" % (db_key_name,))
+    session.connection().execute("""
+CREATE INDEX "ix_%s_Run_ContentHash" ON "%s_Run" ("ContentHash")
+""" % (db_key_name, db_key_name))
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
@@ -0,0 +1,29 @@
+# Version 16 adds the BackgroundJob table, a durable queue of the background
+# jobs to run for the submitted runs.
+#
+# Runs submitted before the upgrade have already had their background jobs
+# started, so nothing is queued for them.
+
+import sqlalchemy
+from sqlalchemy import *
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+class BackgroundJob(Base):
+    __tablename__ = 'BackgroundJob'
+    id = Column("ID", Integer, primary_key=True)
+    job = Column("Job", String(256))
+    testsuite = Column("TestSuite", String(256))
+    machine_id = Column("MachineID", Integer, index=True)
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    attempts = Column("Attempts", Integer)
+    created = Column("Created", DateTime)
+    not_before = Column("NotBefore", DateTime)
+    claimed_at = Column("ClaimedAt", DateTime)
+    worker = Column("Worker", String(256))
+    error = Column("Error", Text)
+
+
+def upgrade(engine):
+    Base.metadata.create_all(engine)
@@ -0,0 +1,31 @@
+# Version 17 adds an index on the machine and end order of the FieldChange
+# table of every test suite, so the field changes of a run can be loaded with
+# a single query when they are regenerated.
+
+import sqlalchemy
+
+# Import the original schema from upgrade_0_to_1 since upgrade_16_to_17 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    session.connection().execute("""
+CREATE INDEX "ix_%s_FieldChangeV2_MachineID_EndOrderID"
+ON "%s_FieldChangeV2" ("MachineID", "EndOrderID")
+""" % (db_key_name, db_key_name))
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
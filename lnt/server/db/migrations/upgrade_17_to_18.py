@@ -0,0 +1,34 @@
+# Version 18 adds the size of the stored file to the Profile table of every
+# test suite, so the storage used by profiles can be accounted for without
+# scanning the profile directory.
+#
+# The profile directory is not known here, the sizes of the existing profiles
+# are filled in by `lnt updatedb --update-profile-sizes`.
+
+import sqlalchemy
+
+# Import the original schema from upgrade_0_to_1 since upgrade_17_to_18 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    session.connection().execute("""
+ALTER TABLE "%s_Profile"
+ADD COLUMN "Size" INTEGER
+""" % (db_key_name,))
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
@@ -0,0 +1,67 @@
+# Version 19 makes the content hash of the Profile table of every test suite
+# unique, so concurrent imports of the same profile can't both store it.
+#
+# Profiles which were stored more than once are merged into the first of them:
+# their samples are moved over to it, and its reference count is recomputed.
+
+import sqlalchemy
+
+# Import the original schema from upgrade_0_to_1 since upgrade_18_to_19 does
+# not change the core schema.
+import lnt.server.db.migrations.upgrade_0_to_1 as upgrade_0_to_1
+
+
+def upgrade_testsuite(engine, session, name):
+    # Grab Test Suite.
+    test_suite = session.query(upgrade_0_to_1.TestSuite).\
+                 filter_by(name=name).first()
+    assert(test_suite is not None)
+    db_key_name = test_suite.db_key_name
+
+    # Move the samples of the duplicates over to the first profile with their
+    # hash.
+    session.connection().execute("""
+UPDATE "%(key)s_Sample"
+SET "ProfileID" = (SELECT MIN(kept."ID")
+                   FROM "%(key)s_Profile" kept, "%(key)s_Profile" duplicate
+                   WHERE kept."Hash" = duplicate."Hash"
+                   AND duplicate."ID" = "%(key)s_Sample"."ProfileID")
+WHERE "ProfileID" IN (SELECT duplicate."ID"
+                      FROM "%(key)s_Profile" kept,
+                           "%(key)s_Profile" duplicate
+                      WHERE kept."Hash" = duplicate."Hash"
+                      AND kept."ID" < duplicate."ID")
+""" % {'key': db_key_name})
+
+    # Recount the references to the profiles which had duplicates, which
+    # leaves none to the duplicates themselves, and remove those.
+    session.connection().execute("""
+UPDATE "%(key)s_Profile"
+SET "RefCount" = (SELECT COUNT(*) FROM "%(key)s_Sample"
+                  WHERE "%(key)s_Sample"."ProfileID" = "%(key)s_Profile"."ID")
+WHERE "Hash" IN (SELECT "Hash" FROM "%(key)s_Profile"
+                 GROUP BY "Hash" HAVING COUNT(*) > 1)
+""" % {'key': db_key_name})
+    session.connection().execute("""
+DELETE FROM "%(key)s_Profile"
+WHERE "ID" IN (SELECT duplicate."ID"
+               FROM "%(key)s_Profile" kept, "%(key)s_Profile" duplicate
+               WHERE kept."Hash" = duplicate."Hash"
+               AND kept."ID" < duplicate."ID")
+""" % {'key': db_key_name})
+
+    session.connection().execute("""
+DROP INDEX "ix_%s_Profile_Hash"
+""" % (db_key_name,))
+    session.connection().execute("""
+CREATE UNIQUE INDEX "ix_%s_Profile_Hash" ON "%s_Profile" ("Hash")
+""" % (db_key_name, db_key_name))
+    session.commit()
+
+
+def upgrade(engine):
+    # Create a session.
+    session = sqlalchemy.orm.sessionmaker(engine)()
+
+    for name, in session.query(upgrade_0_to_1.TestSuite.name).all():
+        upgrade_testsuite(engine, session, name)
@@ -1,4 +1,5 @@
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, and_, func
+from sqlalchemy.orm import joinedload
 import datetime
 import re
 from collections import namedtuple
@@ -35,8 +36,9 @@ ChangeRuns = namedtuple("ChangeRuns", ["before", "after"])
 ChangeData = namedtuple("ChangeData", ["ri", "cr", "run", "latest_cr"])
 
 
-def new_regression(ts, field_changes):
-    """Make a new regression and add to DB."""
+def new_regression(ts, field_changes, commit=True):
+    """Make a new regression and add to DB, committing unless commit is
+    False."""
     today = datetime.date.today()
     MSG = "Regression of 0 benchmarks"
     title = MSG
@@ -47,7 +49,8 @@ def new_regression(ts, field_changes):
         ri1 = ts.RegressionIndicator(regression, fc)
         ts.add(ri1)
     rebuild_title(ts, regression)
-    ts.commit()
+    if commit:
+        ts.commit()
     return regression
 
 
@@ -56,6 +59,8 @@ def rebuild_title(ts, regression):
     if re.match("Regression of \d+ benchmarks.*", regression.title):
         old_changes = ts.query(ts.RegressionIndicator) \
             .filter(ts.RegressionIndicator.regression_id == regression.id) \
+            .options(joinedload(ts.RegressionIndicator.field_change)
+                     .joinedload(ts.FieldChange.test)) \
             .all()
         new_size = len(old_changes)
         benchmarks = set()
@@ -80,6 +85,24 @@ def get_all_orders_for_machine(ts, machine):
         .all()
 
 
+def get_latest_orders_of_machines(ts, machine_ids):
+    """Get the newest order with a run on each of the machines, by machine
+    id. The orders are compared with their indexed sort keys."""
+    if not machine_ids:
+        return {}
+    latest = ts.query(ts.Run.machine_id.label('machine_id'),
+                      func.max(ts.Order.sort_key).label('sort_key')) \
+        .join(ts.Order, ts.Run.order_id == ts.Order.id) \
+        .filter(ts.Run.machine_id.in_(machine_ids)) \
+        .group_by(ts.Run.machine_id) \
+        .subquery()
+    orders = ts.query(ts.Run.machine_id, ts.Order) \
+        .join(ts.Order, ts.Run.order_id == ts.Order.id) \
+        .join(latest, and_(ts.Run.machine_id == latest.c.machine_id,
+                           ts.Order.sort_key == latest.c.sort_key))
+    return dict(orders)
+
+
 def get_ris(ts, regression_id):
     return ts.query(ts.RegressionIndicator) \
         .filter(ts.RegressionIndicator.regression_id == regression_id) \
@@ -106,8 +129,9 @@ def get_runs_of_fieldchange(ts, fc):
 def get_current_runs_of_fieldchange(ts, fc):
     before_runs = get_runs_for_order_and_machine(ts, fc.start_order_id,
                                                  fc.machine_id)
-    newest_order = get_all_orders_for_machine(ts, fc.machine_id)[-1]
-        
+    newest_order = get_latest_orders_of_machines(ts, [fc.machine_id])[
+        fc.machine_id]
+
     after_runs = get_runs_for_order_and_machine(ts, newest_order.id,
                                                 fc.machine_id)
     return ChangeRuns(before_runs, after_runs)
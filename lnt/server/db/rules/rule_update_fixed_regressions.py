@@ -1,71 +1,137 @@
 """Check if a regression is fixed, and move to differnt sate.
 Detcted + fixed -> Ignored
 Staged or Active + fixed -> Verify
+
+After a submission only the regressions with changes on the machines of the
+submitted runs are checked, since the others cannot have been fixed by it.
 """
+from sqlalchemy.orm import joinedload
 from lnt.server.db.regression import RegressionState
-from lnt.server.db.regression import get_cr_for_field_change, get_ris
+from lnt.server.db.regression import get_latest_orders_of_machines
+from lnt.server.reporting.analysis import RunInfo
+from lnt.server.ui import util
 from lnt.testing.util.commands import note, timed
 
-def _fixed_rind(ts, rind):
-    """Is this regression indicator fixed?"""
-    fc = rind.field_change
-    if fc is None:
-        return False
-    current_cr, _, _ = get_cr_for_field_change(ts, fc, current=True)
-    if current_cr.pct_delta < 0.01:
-        return True
-    else:
-        return False
+# The states of the regressions which can be detected as fixed.
+OPEN_STATES = [RegressionState.DETECTED, RegressionState.STAGED,
+               RegressionState.ACTIVE]
+
+# The number of regression indicators to check with a single sample load.
+CHECK_CHUNK_SIZE = 200
+
+
+def _fixed_rinds(ts, rinds):
+    """Return the ids of the regression indicators which are fixed, i.e.
+    whose change is gone at the newest order of its machine. The samples of
+    all the indicators are loaded at once."""
+    changes = [rind.field_change for rind in rinds
+               if rind.field_change is not None]
+    if not changes:
+        return set()
+    latest = get_latest_orders_of_machines(
+        ts, list(set(fc.machine_id for fc in changes)))
+
+    # Load the runs at the start orders of the changes, and at the newest
+    # orders of their machines.
+    wanted = set((fc.machine_id, fc.start_order_id) for fc in changes)
+    wanted.update((machine_id, order.id)
+                  for machine_id, order in latest.items())
+    runs = util.multidict()
+    for run in ts.query(ts.Run) \
+            .filter(ts.Run.machine_id.in_(set(m for m, _ in wanted))) \
+            .filter(ts.Run.order_id.in_(set(o for _, o in wanted))):
+        if (run.machine_id, run.order_id) in wanted:
+            runs[(run.machine_id, run.order_id)] = run
+    runinfo = RunInfo(ts, [run.id for run_list in runs.values()
+                           for run in run_list],
+                      only_tests=list(set(fc.test_id for fc in changes)))
+
+    fixed = set()
+    for rind in rinds:
+        fc = rind.field_change
+        if fc is None or fc.machine_id not in latest:
+            continue
+        before = runs.get((fc.machine_id, fc.start_order_id), [])
+        after = runs.get((fc.machine_id, latest[fc.machine_id].id), [])
+        current_cr = runinfo.get_comparison_result(
+            after, before, fc.test_id, fc.field,
+            ts.Sample.get_hash_of_binary_field())
+        if current_cr.pct_delta < 0.01:
+            fixed.add(rind.id)
+    return fixed
+
+
+def fixed_regressions(ts, regressions):
+    """Comparing the current value to the regressions, return the ones which
+    are now fixed."""
+    if not regressions:
+        return []
+    rinds = ts.query(ts.RegressionIndicator) \
+        .filter(ts.RegressionIndicator.regression_id.in_(
+            [r.id for r in regressions])) \
+        .options(joinedload(ts.RegressionIndicator.field_change)) \
+        .all()
+    fixed = set()
+    for i in range(0, len(rinds), CHECK_CHUNK_SIZE):
+        fixed |= _fixed_rinds(ts, rinds[i:i + CHECK_CHUNK_SIZE])
+
+    rinds_of_regression = util.multidict()
+    for rind in rinds:
+        rinds_of_regression[rind.regression_id] = rind
+    return [r for r in regressions
+            if all(rind.id in fixed
+                   for rind in rinds_of_regression.get(r.id, []))]
+
 
 def is_fixed(ts, regression):
     """Comparing the current value to the regression, is this regression now
     fixed?
     """
-    r_inds = get_ris(ts, regression.id)
-    fixes = [_fixed_rind(ts, x) for x in r_inds]
-    return all(fixes)
+    return bool(fixed_regressions(ts, [regression]))
 
 
 @timed
-def regression_evolution(ts, run_id):
+def regression_evolution(ts, run_ids):
     """Analyse regressions. If they have changes, process them.
     Look at each regression in state detect.  Move to ignore if it is fixed.
     Look at each regression in state stage. Move to verify if fixed.
     Look at regressions in detect, do they match our policy? If no, move to NTBF.
 
+    Only the regressions with changes on the machines of the submitted runs
+    are looked at, or all of them if run_ids is empty.
     """
     note("Running regression evolution")
     changed = 0
-    regressions = ts.query(ts.Regression).all()
-    detects = [r for r in regressions if r.state == RegressionState.DETECTED]
-    
-    for regression in detects:
-        if is_fixed(ts, regression):
+    regressions = ts.query(ts.Regression) \
+        .filter(ts.Regression.state.in_(OPEN_STATES))
+    machine_ids = None
+    if run_ids:
+        machine_ids = set(machine_id for machine_id, in
+                          ts.query(ts.Run.machine_id)
+                          .filter(ts.Run.id.in_(run_ids)))
+        regressions = regressions \
+            .join(ts.RegressionIndicator,
+                  ts.RegressionIndicator.regression_id == ts.Regression.id) \
+            .join(ts.FieldChange,
+                  ts.RegressionIndicator.field_change_id ==
+                  ts.FieldChange.id) \
+            .filter(ts.FieldChange.machine_id.in_(machine_ids)) \
+            .distinct()
+    regressions = regressions.all() if not run_ids or machine_ids else []
+
+    for regression in fixed_regressions(ts, regressions):
+        if regression.state == RegressionState.DETECTED:
             note("Detected fixed regression" + str(regression))
             regression.state = RegressionState.IGNORED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
-    ts.commit()
-
-    staged = [r for r in regressions if r.state == RegressionState.STAGED]
-    
-    for regression in staged:
-        if is_fixed(ts, regression):
+        elif regression.state == RegressionState.STAGED:
             note("Staged fixed regression" + str(regression))
             regression.state = RegressionState.DETECTED_FIXED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
-    ts.commit()
-    
-    active = [r for r in regressions if r.state == RegressionState.ACTIVE]
-    
-    for regression in active:
-        if is_fixed(ts, regression):
+        else:
             note("Active fixed regression" + str(regression))
             regression.state = RegressionState.DETECTED_FIXED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
+        regression.title = regression.title + " [Detected Fixed]"
+        changed += 1
     ts.commit()
     note("Changed the state of {} regressions".format(changed))
-    
+
 post_submission_hook = regression_evolution
@@ -64,10 +64,11 @@ def register_hooks():
                 HOOKS[hook_name].append(globals[hook_name])
     return HOOKS
 
-def post_submission_hooks(ts, run_id):
-    """Run all the post submission hooks on the submitted run."""
+def post_submission_hooks(ts, run_ids):
+    """Run all the post submission hooks on the submitted runs. If run_ids is
+    empty, the hooks look at all the runs."""
     for func in HOOKS['post_submission_hook']:
-        func(ts, run_id)
+        func(ts, run_ids)
 
 def is_useful_change(ts, field_change):
     """Run all the change filters. If any are false, drop this change."""
@@ -5,9 +5,12 @@ These are a bit magical because the models themselves are driven by the test
 suite metadata, so we only create the classes at runtime.
 """
 
+import base64
+import collections
 import datetime
 import json
 import os
+import traceback
 
 import sqlalchemy
 from flask import session
@@ -16,6 +19,9 @@ from sqlalchemy import *
 import testsuite
 import lnt.testing.profile.profile as profile
 import lnt
+import lnt.server.db.util
+import lnt.testing
+from lnt.testing.util.commands import warning
 
 
 def strip(obj):
@@ -25,6 +31,121 @@ def strip(obj):
     return new_dict
 
 
+class ReportMappingPlan(object):
+    """
+    Precompiled mapping from the mangled test names of a report (for example
+    'nts.foo.exec.status') to a test name and the sample field the value is
+    reported for.
+
+    Sample field info keys are indexed by their dotted suffix, so resolving a
+    name only needs to look at its last few dot separated components instead of
+    scanning every sample field. Resolved names are memoized, since the same
+    tests tend to be reported by every submission.
+    """
+
+    # The pseudo info key used to report profiles.
+    PROFILE_KEY = '.profile'
+
+    # Upper bound on the number of memoized names.
+    MAX_CACHED_NAMES = 200000
+
+    def __init__(self, tag, sample_fields):
+        self.tag = tag
+        self.tag_prefix = "%s." % tag
+
+        # Index the info keys. If several sample fields use the same info key,
+        # the first one wins, which matches the order fields used to be
+        # scanned in.
+        self.suffix_index = {self.PROFILE_KEY: 'profile'}
+        self.unindexed_fields = []
+        for item in sample_fields:
+            if not item.info_key.startswith('.'):
+                # We can only index keys that start at a component boundary.
+                self.unindexed_fields.append(item)
+                continue
+            self.suffix_index.setdefault(item.info_key, item)
+
+        # The deepest info key determines how many components we have to look
+        # at when resolving a name.
+        self.max_components = max(key.count('.')
+                                  for key in self.suffix_index)
+
+        self._cache = {}
+
+    def _match(self, name):
+        # Find all the indexed suffixes of this name, and pick the field which
+        # comes first in the test suite definition.
+        best = None
+        pos = len(name)
+        for i in range(self.max_components):
+            pos = name.rfind('.', 0, pos)
+            if pos < 0:
+                break
+            item = self.suffix_index.get(name[pos:])
+            if item is None:
+                continue
+            if best is None or item == 'profile' or (
+                    best[1] != 'profile' and item.index < best[1].index):
+                best = (pos, item)
+
+        for item in self.unindexed_fields:
+            if name.endswith(item.info_key) and (
+                    best is None or (best[1] != 'profile' and
+                                     item.index < best[1].index)):
+                best = (len(name) - len(item.info_key), item)
+
+        return best
+
+    def resolve(self, name):
+        """
+        resolve(name) -> (test_name, sample_field)
+
+        Map a reported (tag prefixed) test name to a test name and the sample
+        field it reports. The sample field is 'profile' for profile data.
+        """
+        result = self._cache.get(name)
+        if result is not None:
+            return result
+
+        if not name.startswith(self.tag_prefix):
+            raise ValueError,"""\
+test %r is misnamed for reporting under schema %r""" % (
+                name, self.tag)
+        short_name = name[len(self.tag_prefix):]
+
+        match = self._match(short_name)
+        if match is None:
+            # Disallow tests which do not map to a sample field.
+            raise ValueError,"""\
+    test %r does not map to a sample field in the reported suite""" % (
+                short_name)
+        pos, sample_field = match
+        result = (short_name[:pos], sample_field)
+
+        if len(self._cache) >= self.MAX_CACHED_NAMES:
+            self._cache.clear()
+        self._cache[name] = result
+        return result
+
+    def resolve_metric(self, metric):
+        """
+        resolve_metric(metric) -> sample_field
+
+        Map a metric of a columnar report (for example 'exec.status') to the
+        sample field it reports. The sample field is 'profile' for profile data.
+        The metric of a field whose info key does not start with a '.' is its
+        info key.
+        """
+        sample_field = self.suffix_index.get('.' + metric)
+        if sample_field is None:
+            for item in self.unindexed_fields:
+                if item.info_key == metric:
+                    return item
+            raise ValueError,"""\
+metric %r does not map to a sample field in the reported suite""" % (metric,)
+        return sample_field
+
+
 class TestSuiteDB(object):
     """
     Wrapper object for an individual test suites database tables.
@@ -50,6 +171,10 @@ class TestSuiteDB(object):
         for i,field in enumerate(self.sample_fields):
             field.index = i
 
+        # Compile the mapping from reported test names to sample fields once,
+        # it is reused by every import into this suite.
+        self.report_mapping = ReportMappingPlan(self.name, self.sample_fields)
+
         self.base = sqlalchemy.ext.declarative.declarative_base()
 
         # Create parameterized model classes for this test suite.
@@ -84,6 +209,10 @@ class TestSuiteDB(object):
             # data is stored as a JSON encoded blob.
             parameters_data = Column("Parameters", Binary)
 
+            # A hash of the name, fields and parameters, used to find existing
+            # machines on import.
+            fingerprint = Column("Fingerprint", String(40), index=True)
+
             # Dynamically create fields for all of the test suite defined
             # machine fields.
             class_dict = locals()
@@ -110,6 +239,12 @@ class TestSuiteDB(object):
             @parameters.setter
             def parameters(self, data):
                 self.parameters_data = json.dumps(sorted(data.items()))
+
+            def compute_fingerprint(self):
+                fields = sorted(self.fields, key=lambda f: f.name)
+                return lnt.server.db.util.fingerprint(
+                    [self.name] + [self.get_field(item) for item in fields] +
+                    [self.parameters_data])
             
             def get_baseline_run(self):
                 ts = Machine.testsuite
@@ -174,6 +309,13 @@ class TestSuiteDB(object):
             previous_order_id = Column("PreviousOrder", Integer, ForeignKey(
                     "%s.ID" % __tablename__))
 
+            # The sort key materializes the total ordering (see
+            # lnt.server.db.util.order_sort_key), so that neighbours can be
+            # found with an indexed range query. The ordinal is the position of
+            # the order in the total ordering.
+            sort_key = Column("SortKey", String, index=True)
+            ordinal = Column("Ordinal", Integer, index=True)
+
             # This will implicitly create the previous_order relation.
             next_order = sqlalchemy.orm.relation("Order",
                                                  backref=sqlalchemy.orm.backref('previous_order',
@@ -202,6 +344,13 @@ class TestSuiteDB(object):
                 for item in self.fields:
                     self.set_field(item, kwargs.get(item.name))
 
+                self.sort_key = None
+                self.ordinal = None
+
+            def compute_sort_key(self):
+                return lnt.server.db.util.order_sort_key(
+                    self.get_field(item) for item in self.fields)
+
             def __repr__(self):
                 fields = dict((item.name, self.get_field(item))
                               for item in self.fields)
@@ -232,19 +381,11 @@ class TestSuiteDB(object):
 
                 # Compare each field numerically integer or integral version,
                 # where possible. We ignore whitespace and convert each dot
-                # separated component to an integer if is is numeric.
-                def convert_field(value):
-                    items = value.strip().split('.')
-                    for i,item in enumerate(items):
-                        if item.isdigit():
-                            items[i] = int(item, 10)
-                    return tuple(items)
-
-                # Compare every field in lexicographic order.
-                return cmp(tuple(convert_field(self.get_field(item))
-                                 for item in self.fields),
-                           tuple(convert_field(b.get_field(item))
-                                 for item in self.fields))
+                # separated component to an integer if is is numeric. The sort
+                # key encodes exactly that, so use the stored one if we have
+                # it.
+                return cmp(self.sort_key or self.compute_sort_key(),
+                           b.sort_key or b.compute_sort_key())
                                  
             def __json__(self):
                 order = dict((item.name, self.get_field(item))
@@ -272,6 +413,14 @@ class TestSuiteDB(object):
             # data is stored as a JSON encoded blob.
             parameters_data = Column("Parameters", Binary)
 
+            # A hash of the machine, order, times, fields and parameters, used
+            # to find duplicate submissions on import.
+            fingerprint = Column("Fingerprint", String(40), index=True)
+
+            # The hash of the submitted file the run was imported from, used to
+            # recognize exact resubmissions without loading them.
+            content_hash = Column("ContentHash", String(40), index=True)
+
             machine = sqlalchemy.orm.relation(Machine)
             order = sqlalchemy.orm.relation(Order)
 
@@ -309,6 +458,14 @@ class TestSuiteDB(object):
             @parameters.setter
             def parameters(self, data):
                 self.parameters_data = json.dumps(sorted(data.items()))
+
+            def compute_fingerprint(self):
+                fields = sorted(self.fields, key=lambda f: f.name)
+                return lnt.server.db.util.fingerprint(
+                    [self.machine_id, self.order_id, self.start_time,
+                     self.end_time] +
+                    [self.get_field(item) for item in fields] +
+                    [self.parameters_data])
                 
             def __json__(self):
                 self.machine
@@ -340,16 +497,40 @@ class TestSuiteDB(object):
             filename = Column("Filename", String(256))
             counters = Column("Counters", String(512))
 
-            def __init__(self, encoded, config, testid):
+            # Profiles are stored content addressed. The hash identifies the
+            # profile data, and the reference count is the number of samples
+            # which use this profile.
+            hash = Column("Hash", String(64), index=True, unique=True)
+            ref_count = Column("RefCount", Integer)
+            # The size of the stored file, in bytes.
+            size = Column("Size", Integer)
+
+            def __init__(self, data, digest, config):
                 self.created_time = datetime.datetime.now()
                 self.accessed_time = datetime.datetime.now()
+                self.hash = digest
+                self.ref_count = 0
+                self.size = None
 
                 if config is not None:
-                    self.filename = profile.Profile.saveFromRendered(encoded,
-                                                             profileDir=config.config.profileDir,
-                                                             prefix='t-%s-s-' % os.path.basename(testid))
+                    # Only store the profile during the import. Extracting its
+                    # counters means deserializing it, which is left to the
+                    # tasks run in the background after the submission (see
+                    # process_pending_profiles()). Until then, the profile is
+                    # being processed.
+                    profileDir = config.config.profileDir
+                    self.filename = profile.Profile.saveContentAddressed(
+                        data, profileDir, digest)
+                    self.size = len(data)
+                    self.counters = None
+                else:
+                    self.set_counters(profile.Profile.fromBytes(data))
+
+            @property
+            def is_processing(self):
+                return self.counters is None
 
-                p = profile.Profile.fromRendered(encoded)
+            def set_counters(self, p):
                 s = ','.join('%s=%s' % (k,v)
                              for k,v in p.getTopLevelCounters().items())
                 self.counters = s[:512]
@@ -622,6 +803,9 @@ class TestSuiteDB(object):
         # Create the compound index we cannot declare inline.
         sqlalchemy.schema.Index("ix_%s_Sample_RunID_TestID" % db_key_name,
                                 Sample.run_id, Sample.test_id)
+        sqlalchemy.schema.Index("ix_%s_FieldChangeV2_MachineID_EndOrderID" %
+                                db_key_name, FieldChange.machine_id,
+                                FieldChange.end_order_id)
 
         # Create the index we use to ensure machine uniqueness.
         args = [Machine.name, Machine.parameters_data]
@@ -694,6 +878,11 @@ class TestSuiteDB(object):
         query = query.filter(self.Machine.parameters_data ==
                              machine.parameters_data)
 
+        # Look the machine up by its fingerprint, which is indexed. The other
+        # filters only guard against hash collisions.
+        machine.fingerprint = machine.compute_fingerprint()
+        query = query.filter(self.Machine.fingerprint == machine.fingerprint)
+
         # Execute the query to see if we already have this machine.
         try:
             return query.one(),False
@@ -739,28 +928,45 @@ supplied run is missing required run parameter: %r""" % (
         except sqlalchemy.orm.exc.NoResultFound:
             # If not, then we need to insert this order into the total ordering
             # linked list.
-
-            # Add the new order and commit, to assign an ID.
+            order.sort_key = order.compute_sort_key()
+
+            # Find the order which precedes this one (if any), using the
+            # indexed sort key. Orders which compare equal are kept in
+            # insertion order.
+            previous_order = self.query(self.Order).\
+                filter(self.Order.sort_key <= order.sort_key).\
+                order_by(self.Order.sort_key.desc(),
+                         self.Order.id.desc()).first()
+
+            # The following order is the successor of the previous one, or the
+            # current first order.
+            if previous_order is not None:
+                next_order_id = previous_order.next_order_id
+                order.ordinal = previous_order.ordinal + 1
+            else:
+                first_order = self.query(self.Order.id).\
+                    order_by(self.Order.sort_key, self.Order.id).first()
+                next_order_id = first_order[0] if first_order else None
+                order.ordinal = 0
+
+            # Make room for this order in the ordinals. New orders are usually
+            # the latest ones, so this typically touches nothing.
+            self.query(self.Order).\
+                filter(self.Order.ordinal >= order.ordinal).\
+                update({self.Order.ordinal: self.Order.ordinal + 1},
+                       synchronize_session='evaluate')
+
+            # Add the new order and flush, to assign an ID.
             self.add(order)
-            self.v4db.session.commit()
-
-            # Load all the orders.
-            orders = list(self.query(self.Order))
-
-            # Sort the objects to form the total ordering.
-            orders.sort()
-
-            # Find the order we just added.
-            index = orders.index(order)
+            self.session.flush()
 
             # Insert this order into the linked list which forms the total
             # ordering.
-            if index > 0:
-                previous_order = orders[index - 1]
+            if previous_order is not None:
                 previous_order.next_order_id = order.id
                 order.previous_order_id = previous_order.id
-            if index + 1 < len(orders):
-                next_order = orders[index + 1]
+            if next_order_id is not None:
+                next_order = self.query(self.Order).get(next_order_id)
                 next_order.previous_order_id = order.id
                 order.next_order_id = next_order.id
 
@@ -819,6 +1025,16 @@ supplied run is missing required run parameter: %r""" % (
         run.parameters = run_parameters
         query = query.filter(self.Run.parameters_data == run.parameters_data)
 
+        # Look the run up by its fingerprint, which is indexed, as for
+        # machines. The machine and order IDs are part of the fingerprint, so
+        # make sure a new machine has been assigned one.
+        if machine.id is None:
+            self.session.flush()
+        run.machine_id = machine.id
+        run.order_id = order.id
+        run.fingerprint = run.compute_fingerprint()
+        query = query.filter(self.Run.fingerprint == run.fingerprint)
+
         # Execute the query to see if we already have this run.
         try:
             return query.one(),False
@@ -828,115 +1044,439 @@ supplied run is missing required run parameter: %r""" % (
 
             return run,True
 
-    def _importSampleValues(self, tests_data, run, tag, commit, config):
+    def _getTestIDs(self, test_names):
+        """
+        _getTestIDs(test_names) -> {name: id}, int
+
+        Return a map from test name to Test ID for the given names, bulk
+        inserting any tests which do not exist yet, and the number of tests
+        which were inserted.
+        """
+        test_ids = {}
+        if not test_names:
+            return test_ids, 0
+
+        # Find the tests which already exist. We query in chunks, to stay under
+        # the bound parameter limit of SQLite.
+        test_names = list(test_names)
+        chunk_size = 500
+        for i in range(0, len(test_names), chunk_size):
+            chunk = test_names[i:i + chunk_size]
+            test_ids.update(self.query(self.Test.name, self.Test.id).
+                            filter(self.Test.name.in_(chunk)))
+
+        # Insert all the missing tests with a single statement, then resolve
+        # their IDs.
+        new_test_names = [name for name in test_names
+                          if name not in test_ids]
+        if new_test_names:
+            self.session.execute(self.Test.__table__.insert(),
+                                 [{'Name': name} for name in new_test_names])
+            for i in range(0, len(new_test_names), chunk_size):
+                chunk = new_test_names[i:i + chunk_size]
+                test_ids.update(self.query(self.Test.name, self.Test.id).
+                                filter(self.Test.name.in_(chunk)))
+
+        return test_ids, len(new_test_names)
+
+    def _getOrCreateProfile(self, encoded, config, profiles):
+        """
+        _getOrCreateProfile(encoded, config, profiles) -> Profile
+
+        Return the Profile record for the given rendered profile, creating and
+        storing it only if an identical profile has not been stored before.
+        The profiles argument caches the records used by the current import,
+        keyed on the content hash.
+
+        The hash is unique, so when a concurrent import stores the same
+        profile first, its record is used.
+        """
+        data = base64.b64decode(encoded)
+        digest = profile.Profile.contentHash(data)
+
+        record = profiles.get(digest)
+        if record is None:
+            record = self.query(self.Profile).\
+                filter(self.Profile.hash == digest).first()
+        if record is None:
+            self._insertProfile(self.Profile(data, digest, config))
+            record = self.query(self.Profile).\
+                filter(self.Profile.hash == digest).one()
+        profiles[digest] = record
+        return record
+
+    def _insertProfile(self, record):
+        """
+        _insertProfile(record) -> None
+
+        Insert the row of a new Profile record, unless a profile with the same
+        hash was inserted in the meantime.
+        """
+        mapper = sqlalchemy.inspect(self.Profile)
+        values = dict((prop.columns[0].name, getattr(record, prop.key))
+                      for prop in mapper.column_attrs
+                      if prop.key != 'id')
+        connection = self.session.connection()
+        # A failed statement aborts a PostgreSQL transaction, unless it is
+        # rolled back to a savepoint. SQLite only undoes the statement, and
+        # pysqlite does not support savepoints properly.
+        savepoint = None
+        if connection.dialect.name != 'sqlite':
+            savepoint = connection.begin_nested()
+        try:
+            connection.execute(self.Profile.__table__.insert(), values)
+        except sqlalchemy.exc.IntegrityError:
+            if savepoint is not None:
+                savepoint.rollback()
+        else:
+            if savepoint is not None:
+                savepoint.commit()
+
+    def _addProfileReferences(self, counts):
+        """
+        _addProfileReferences(counts) -> None
+
+        Add to the reference counts of the profiles, given as a map from
+        Profile record to the number of new samples using it. The counts are
+        updated in the database, so concurrent imports don't lose updates.
+        """
+        for record, count in counts.items():
+            self.query(self.Profile).\
+                filter(self.Profile.id == record.id).\
+                update({self.Profile.ref_count:
+                        func.coalesce(self.Profile.ref_count, 0) + count},
+                       synchronize_session=False)
+            self.session.expire(record, ['ref_count'])
+
+    def process_pending_profiles(self, run_id=None):
+        """
+        process_pending_profiles([run_id]) -> int
+
+        Extract the counters of the profiles which are still being processed,
+        either all of them or only those used by the given run, and commit.
+        Returns the number of processed profiles.
+        """
+        query = self.query(self.Profile).\
+            filter(self.Profile.counters == None)
+        if run_id is not None:
+            query = query.filter(self.Profile.id.in_(
+                    self.query(self.Sample.profile_id).\
+                        filter(self.Sample.run_id == run_id)))
+
+        profileDir = self.v4db.config.profileDir
+        records = query.all()
+        for record in records:
+            try:
+                record.set_counters(record.load(profileDir))
+            except KeyboardInterrupt:
+                raise
+            except:
+                # Don't retry a profile we can't read, it has no counters.
+                warning("unable to process profile %r: %s" % (
+                        record.filename, traceback.format_exc()))
+                record.counters = ''
+        self.commit()
+        return len(records)
+
+    def release_profiles(self, sample_query):
+        """
+        release_profiles(sample_query) -> [(hash, filename)]
+
+        Drop the references the samples matched by the given query hold on
+        their profiles, prior to deleting those samples. Profiles which are no
+        longer referenced are deleted, and their hashes and filenames
+        (relative to the profile directory) returned so the caller can remove
+        the files once the deletion is committed, if no profile with the hash
+        was stored again in the meantime (see has_profile()).
+        """
+        counts = sample_query.\
+            filter(self.Sample.profile_id != None).\
+            with_entities(self.Sample.profile_id, func.count()).\
+            group_by(self.Sample.profile_id).all()
+
+        # Update the counts in the database, so concurrent imports don't lose
+        # updates. Profiles stored before reference counting have no count,
+        # they are only used by a single sample.
+        for profile_id, count in counts:
+            self.query(self.Profile).\
+                filter(self.Profile.id == profile_id).\
+                update({self.Profile.ref_count:
+                        func.coalesce(self.Profile.ref_count, 1) - count},
+                       synchronize_session=False)
+
+        unreferenced = []
+        profile_ids = [profile_id for profile_id, _ in counts]
+        chunk_size = 500
+        for i in range(0, len(profile_ids), chunk_size):
+            chunk = self.query(self.Profile.id, self.Profile.hash,
+                               self.Profile.filename).\
+                filter(self.Profile.id.in_(profile_ids[i:i + chunk_size])).\
+                filter(self.Profile.ref_count <= 0).all()
+            if not chunk:
+                continue
+            unreferenced.extend((digest, filename)
+                                for _, digest, filename in chunk
+                                if filename)
+            self.query(self.Profile).\
+                filter(self.Profile.id.in_([id for id, _, _ in chunk])).\
+                delete(synchronize_session=False)
+        return unreferenced
+
+    def has_profile(self, digest):
+        """
+        has_profile(digest) -> bool
+
+        Check whether a profile with the given content hash is stored.
+        """
+        return self.query(self.Profile.id).\
+            filter(self.Profile.hash == digest).first() is not None
+
+    def update_profile_sizes(self):
+        """
+        update_profile_sizes() -> int
+
+        Record the sizes of the stored profiles which do not have one yet,
+        because they were stored before sizes were recorded. Returns the
+        number of updated profiles.
+        """
+        profileDir = self.v4db.config.profileDir
+        records = self.query(self.Profile).\
+            filter(self.Profile.size == None).\
+            filter(self.Profile.filename != None).all()
+        for record in records:
+            try:
+                record.size = os.path.getsize(os.path.join(profileDir,
+                                                           record.filename))
+            except OSError:
+                # The file is gone, it takes no space.
+                record.size = 0
+        return len(records)
+
+    def _sampleRowsNeedORM(self):
+        """
+        _sampleRowsNeedORM() -> bool
+
+        Check whether samples must be added through the ORM, because hooks are
+        registered for inserting them. Column defaults are applied by Core
+        inserts as well.
+        """
+        dispatch = sqlalchemy.orm.class_mapper(self.Sample).dispatch
+        return bool(dispatch.before_insert or dispatch.after_insert)
+
+    def _insertSampleRows(self, run, sample_keys, sample_rows):
+        """
+        _insertSampleRows(run, sample_keys, sample_rows) -> None
+
+        Insert the samples of a run, given as rows of the values of the
+        sample_keys columns, with a single executemany. If the samples need
+        ORM behavior, they are added as Sample objects instead.
+        """
+        if not sample_rows:
+            return
+
+        if not self._sampleRowsNeedORM():
+            self.session.execute(self.Sample.__table__.insert(),
+                                 [dict(zip(sample_keys, row))
+                                  for row in sample_rows])
+            return
+
+        # Load the tests of the samples, in chunks to stay under the bound
+        # parameter limit of SQLite.
+        test_ids = list(set(row[1] for row in sample_rows))
+        tests = {}
+        chunk_size = 500
+        for i in range(0, len(test_ids), chunk_size):
+            chunk = test_ids[i:i + chunk_size]
+            tests.update((test.id, test) for test in
+                         self.query(self.Test).filter(self.Test.id.in_(chunk)))
+        for row in sample_rows:
+            values = dict(zip(sample_keys, row))
+            sample = self.Sample(run, tests[row[1]],
+                                 **dict((item.name, values[item.column.key])
+                                        for item in self.sample_fields))
+            sample.profile_id = row[2]
+            self.add(sample)
+
+    def _importSampleValues(self, tests_data, run, tag, commit, config,
+                            stats):
         # We now need to transform the old schema data (composite samples split
         # into multiple tests with mangling) into the V4DB format where each
         # sample is a complete record.
-        tag_dot = "%s." % tag
-        tag_dot_len = len(tag_dot)
-
-        # Load a map of all the tests, which we will extend when we find tests
-        # that need to be added.
-        test_cache = dict((test.name, test)
-                          for test in self.query(self.Test))
-
-        # First, we aggregate all of the samples by test name. The schema allows
-        # reporting multiple values for a test in two ways, one by multiple
-        # samples and the other by multiple test entries with the same test
-        # name. We need to handle both.
+        if tag != self.report_mapping.tag:
+            raise ValueError,"""\
+cannot import %r data into test suite %r""" % (tag, self.name)
+
+        # First, we aggregate all of the samples by test name and sample
+        # field. The schema allows reporting multiple values for a test in two
+        # ways, one by multiple samples and the other by multiple test entries
+        # with the same test name. We need to handle both.
+        #
+        # The tests may be a lazily decoded stream, so this is the only pass
+        # over them. Profiles are stored as they are seen, so their (large)
+        # encoded data is not retained.
+        resolve = self.report_mapping.resolve
+        profiles = {}
         tests_values = {}
         for test_data in tests_data:
             if test_data['Info']:
                 raise ValueError,"""\
 test parameter sets are not supported by V4DB databases"""
 
-            name = test_data['Name']
-            if not name.startswith(tag_dot):
-                raise ValueError,"""\
-test %r is misnamed for reporting under schema %r""" % (
-                    name, tag)
-            name = name[tag_dot_len:]
-
-            # Add all the values.
-            values = tests_values.get(name)
+            # Map the reported test name into a test name and a sample field.
+            key = resolve(test_data['Name'])
+            values = tests_values.get(key)
             if values is None:
-                tests_values[name] = values = []
-
-            values.extend(test_data['Data'])
+                tests_values[key] = values = []
 
-        # Next, build a map of test name to sample values, by scanning all the
-        # tests. This is complicated by the interchange's support of multiple
-        # values, which we cannot properly aggregate. We handle this by keying
-        # off of the test name and the sample index.
-        sample_records = {}
-        profiles = {}
-        for name,test_samples in tests_values.items():
-            # Map this reported test name into a test name and a sample field.
-            #
-            # FIXME: This is really slow.
-            if name.endswith('.profile'):
-                test_name = name[:-len('.profile')]
-                sample_field = 'profile'
+            if key[1] != 'profile':
+                values.extend(test_data['Data'])
             else:
-                for item in self.sample_fields:
-                    if name.endswith(item.info_key):
-                        test_name = name[:-len(item.info_key)]
-                        sample_field = item
-                        break
-                else:
-                    # Disallow tests which do not map to a sample field.
-                    raise ValueError,"""\
-    test %r does not map to a sample field in the reported suite""" % (
-                        name)
-
-            # Get or create the test.
-            test = test_cache.get(test_name)
-            if test is None:
-                test_cache[test_name] = test = self.Test(test_name)
-                self.add(test)
-
+                values.extend(self._getOrCreateProfile(value, config, profiles)
+                              for value in test_data['Data'])
+        mapped_values = [key + (test_samples,)
+                         for key,test_samples in tests_values.items()]
+
+        # Get or create all of the tests at once.
+        test_ids,stats['tests'] = self._getTestIDs(
+            set(test_name for test_name,_,_ in mapped_values))
+
+        # Make sure the run has been assigned an ID.
+        self.session.flush()
+
+        # Next, build the sample rows, by scanning all the tests. This is
+        # complicated by the interchange's support of multiple values, which we
+        # cannot properly aggregate. We handle this by keying off of the test
+        # name and the sample index.
+        #
+        # Each row is a list of the values for the columns in sample_keys.
+        sample_keys = ['RunID', 'TestID', 'ProfileID']
+        sample_keys.extend(item.column.key for item in self.sample_fields)
+        field_offset = 3
+        sample_records = {}
+        sample_rows = []
+        profile_refs = collections.Counter()
+        for test_name,sample_field,test_samples in mapped_values:
+            test_id = test_ids[test_name]
             for i, value in enumerate(test_samples):
                 record_key = (test_name, i)
-                sample = sample_records.get(record_key)
-                if sample is None:
-                    sample_records[record_key] = sample = self.Sample(run, test)
-                    self.add(sample)
+                row = sample_records.get(record_key)
+                if row is None:
+                    sample_records[record_key] = row = \
+                        [run.id, test_id, None] + [None] * len(self.sample_fields)
+                    sample_rows.append(row)
 
                 if sample_field != 'profile':
-                    sample.set_field(sample_field, value)
+                    row[field_offset + sample_field.index] = value
                 else:
-                    sample.profile = profiles.get(hash(value),
-                                                  self.Profile(value, config,
-                                                               test_name))
+                    row[2] = value.id
+                    profile_refs[value] += 1
+
+        self._addProfileReferences(profile_refs)
+
+        stats['samples'] = len(sample_rows)
+        self._insertSampleRows(run, sample_keys, sample_rows)
+
+    def _importColumnarSampleValues(self, tests_data, run, tag, config,
+                                    stats):
+        # Columnar reports (version 2) list each test once, with the samples
+        # of each metric in an array aligned with the test names, so the
+        # values map directly onto the sample table without demangling names.
+        if tag != self.report_mapping.tag:
+            raise ValueError,"""\
+cannot import %r data into test suite %r""" % (tag, self.name)
+
+        names = tests_data['Names']
+        columns = [(self.report_mapping.resolve_metric(metric), values)
+                   for metric,values in tests_data['Metrics'].items()]
+        for sample_field,values in columns:
+            if len(values) != len(names):
+                raise ValueError,"""\
+metric arrays must have one entry per test name"""
+
+        # Get or create all of the tests at once.
+        test_ids,stats['tests'] = self._getTestIDs(set(names))
+
+        # Make sure the run has been assigned an ID.
+        self.session.flush()
+
+        # Each test has as many sample rows as its longest metric has samples.
+        sample_keys = ['RunID', 'TestID', 'ProfileID']
+        sample_keys.extend(item.column.key for item in self.sample_fields)
+        field_offset = 3
+        test_rows = []
+        for i,name in enumerate(names):
+            num_samples = max([len(values[i] or [])
+                               for _,values in columns] or [0])
+            test_rows.append([[run.id, test_ids[name], None] +
+                              [None] * len(self.sample_fields)
+                              for j in range(num_samples)])
+        profile_refs = collections.Counter()
+        profiles = {}
+        for sample_field,values in columns:
+            for rows,test_values in zip(test_rows, values):
+                if test_values is None:
+                    continue
+                if sample_field != 'profile':
+                    column = field_offset + sample_field.index
+                    for row,value in zip(rows, test_values):
+                        row[column] = value
+                    continue
 
-    def importDataFromDict(self, data, commit, config=None):
+                for row,value in zip(rows, test_values):
+                    if value is not None:
+                        record = self._getOrCreateProfile(value, config,
+                                                          profiles)
+                        row[2] = record.id
+                        profile_refs[record] += 1
+        sample_rows = [row for rows in test_rows for row in rows]
+
+        self._addProfileReferences(profile_refs)
+
+        stats['samples'] = len(sample_rows)
+        self._insertSampleRows(run, sample_keys, sample_rows)
+
+    def importDataFromDict(self, data, commit, config=None, stats=None):
         """
-        importDataFromDict(data) -> Run, bool
+        importDataFromDict(data, commit, [config], [stats]) -> bool, Run
 
         Import a new run from the provided test interchange data, and return the
         constructed Run record.
 
         The boolean result indicates whether the returned record was constructed
         or not (i.e., whether the data was a duplicate submission).
+
+        If given, the stats dictionary is updated with the number of
+        'machines', 'runs', 'tests' and 'samples' which were added.
         """
+        added = dict.fromkeys(['machines', 'runs', 'tests', 'samples'], 0)
 
         # Construct the machine entry.
         machine,inserted = self._getOrCreateMachine(data['Machine'])
+        added['machines'] = int(inserted)
 
         # Construct the run entry.
         run,inserted = self._getOrCreateRun(data['Run'], machine)
+        added['runs'] = int(inserted)
 
         # Get the schema tag.
         tag = data['Run']['Info']['tag']
         
         # If we didn't construct a new run, this is a duplicate
-        # submission. Return the prior Run.
-        if not inserted:
-            return False, run
-        
-        self._importSampleValues(data['Tests'], run, tag, commit, config)
+        # submission, and we return the prior Run.
+        if inserted:
+            report_version = int(data['Run']['Info'].get('__report_version__',
+                                                         0))
+            if report_version == lnt.testing.columnar_version:
+                self._importColumnarSampleValues(data['Tests'], run, tag,
+                                                 config, added)
+            else:
+                self._importSampleValues(data['Tests'], run, tag, commit,
+                                         config, added)
 
-        return True, run
+        if stats is not None:
+            for key,value in added.items():
+                stats[key] = stats.get(key, 0) + value
+        return inserted, run
 
     # Simple query support (mostly used by templates)
 
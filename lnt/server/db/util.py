@@ -1,7 +1,79 @@
 
+import hashlib
+import json
 import re
+import struct
 
 PATH_DATABASE_TYPE_RE = re.compile('\w+\:\/\/')
 
 def path_has_no_database_type(path):
     return PATH_DATABASE_TYPE_RE.match(path) is None
+
+
+def is_sqlite_path(path):
+    """Whether the database at path is a SQLite database, which it is
+    assumed to be if the path includes no database type."""
+    return path_has_no_database_type(path) or path.startswith('sqlite:')
+
+
+def _encode_order_component(item):
+    if item.isdigit():
+        # Numeric components sort before any string component, and then by
+        # magnitude. Leading zeros are not significant.
+        digits = str(int(item, 10))
+        if len(digits) < 0xff:
+            return '\x01' + chr(len(digits)) + digits
+        # Longer numbers have their length in four more bytes, after a byte
+        # which sorts after every single byte length.
+        return '\x01\xff' + struct.pack('>I', len(digits)) + digits
+
+    # String components are terminated by a NUL byte, so that a string sorts
+    # before any longer string it is a prefix of. Embedded NULs are escaped to
+    # sort after the terminator.
+    if isinstance(item, unicode):
+        item = item.encode('utf-8')
+    return '\x02' + item.replace('\x00', '\x00\xff') + '\x00'
+
+
+def order_sort_key(values):
+    """
+    order_sort_key(values) -> str
+
+    Compute a key for an order from its field values (in field ordinal order),
+    such that comparing the keys as strings gives the same total ordering as
+    comparing the orders themselves: each field is split into dot separated
+    components, which compare numerically where they are integral.
+
+    The key is hex encoded, so that it compares the same under any database
+    collation and can be indexed and range queried.
+    """
+    key = []
+    for value in values:
+        for item in value.strip().split('.'):
+            key.append(_encode_order_component(item))
+        # Terminate the field, so a field sorts before any field it is a
+        # prefix of.
+        key.append('\x00')
+    return ''.join(key).encode('hex')
+
+
+def _fingerprint_value(value):
+    if value is None or isinstance(value, unicode):
+        return value
+    if isinstance(value, (str, buffer)):
+        return str(value).decode('utf-8', 'replace')
+    return unicode(value)
+
+
+def fingerprint(values):
+    """
+    fingerprint(values) -> str
+
+    Compute a hash of a list of column values, which can be stored in an
+    indexed column to find the records with identical values with a single
+    lookup. Values are hashed by their text, so the fingerprint of a record is
+    the same whether it is computed from freshly reported data or from what
+    was read back from the database.
+    """
+    text = json.dumps([_fingerprint_value(value) for value in values])
+    return hashlib.sha1(text).hexdigest()
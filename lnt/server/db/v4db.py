@@ -180,7 +180,43 @@ class V4DB(object):
         return sum([ts.query(ts.Test).count()
                     for ts in self.testsuite.values()])
 
-    def importDataFromDict(self, data, commit, config=None):
+    def getProfileStorage(self):
+        """
+        getProfileStorage() -> [(date, size, count)]
+
+        Return the total size in bytes and the number of the stored profiles
+        of all the test suites, by the date they were stored, in order.
+        """
+        if not self.testsuite.values():
+            return []
+        profiles = sqlalchemy.union_all(*[
+                sqlalchemy.select([
+                        sqlalchemy.func.date(ts.Profile.created_time).\
+                            label('date'),
+                        ts.Profile.size.label('size')]).\
+                    where(ts.Profile.size != None)
+                for ts in self.testsuite.values()]).alias('profiles')
+        return self.query(profiles.c.date,
+                          sqlalchemy.func.sum(profiles.c.size),
+                          sqlalchemy.func.count()).\
+            group_by(profiles.c.date).\
+            order_by(profiles.c.date).all()
+
+    def getRunByContentHash(self, content_hash):
+        """
+        getRunByContentHash(content_hash) -> Run or None
+
+        Return the run which was imported from a submission with the given
+        content hash, in any test suite, if there is one.
+        """
+        for ts in self.testsuite.values():
+            run = ts.query(ts.Run).\
+                filter(ts.Run.content_hash == content_hash).first()
+            if run is not None:
+                return run
+        return None
+
+    def importDataFromDict(self, data, commit, config=None, stats=None):
         # Select the database to import into.
         #
         # FIXME: Promote this to a top-level field in the data.
@@ -193,4 +229,4 @@ class V4DB(object):
             raise ValueError, "test suite %r not present in this database!" % (
                 db_name)
 
-        return db.importDataFromDict(data, commit, config)
+        return db.importDataFromDict(data, commit, config, stats)
@@ -61,7 +61,8 @@ class ComparisonResult:
     def __init__(self, aggregation_fn,
                  cur_failed, prev_failed, samples, prev_samples,
                  cur_hash, prev_hash, cur_profile=None, prev_profile=None,
-                 confidence_lv=0.05, bigger_is_better=False):
+                 confidence_lv=0.05, bigger_is_better=False,
+                 profile_processing=False):
         self.aggregation_fn = aggregation_fn
 
         # Special case: if we're using the minimum to aggregate, swap it for max
@@ -73,6 +74,8 @@ class ComparisonResult:
         self.prev_hash = prev_hash
         self.cur_profile = cur_profile
         self.prev_profile = prev_profile
+        # Whether either profile is still being processed after its import.
+        self.profile_processing = profile_processing
 
         if samples:
             self.current = aggregation_fn(samples)
@@ -259,6 +262,7 @@ class RunInfo(object):
 
         self.sample_map = util.multidict()
         self.profile_map = dict()
+        self.processing_profiles = set()
         self.loaded_run_ids = set()
 
         self._load_samples_for_runs(runs_to_load, only_tests)
@@ -361,7 +365,10 @@ class RunInfo(object):
                              prev_values, cur_hash, prev_hash,
                              cur_profile, prev_profile,
                              self.confidence_lv,
-                             bigger_is_better=field.bigger_is_better)
+                             bigger_is_better=field.bigger_is_better,
+                             profile_processing=bool(
+                                 self.processing_profiles.intersection(
+                                     (cur_profile, prev_profile))))
         return r
 
     def get_geomean_comparison_result(self, run, compare_to, field, tests):
@@ -392,6 +399,24 @@ class RunInfo(object):
                                 confidence_lv=0,
                                 bigger_is_better=field.bigger_is_better)
 
+    def load_runs(self, run_ids, only_tests=None):
+        """Load the samples of the runs which are not loaded yet."""
+        self._load_samples_for_runs(run_ids, only_tests)
+
+    def unload_runs(self, run_ids):
+        """Forget the samples of the runs, to bound the memory used when
+        walking over many runs."""
+        run_ids = set(run_ids) & self.loaded_run_ids
+        if not run_ids:
+            return
+        for key in self.sample_map.keys():
+            if key[0] in run_ids:
+                del self.sample_map.data[key]
+        for key in self.profile_map.keys():
+            if key[0] in run_ids:
+                del self.profile_map[key]
+        self.loaded_run_ids -= run_ids
+
     def _load_samples_for_runs(self, run_ids, only_tests):
         # Find the set of new runs to load.
         to_load = set(run_ids) - self.loaded_run_ids
@@ -401,22 +426,28 @@ class RunInfo(object):
         # Batch load all of the samples for the needed runs.
         #
         # We speed things up considerably by loading the column data directly
-        # here instead of requiring SA to materialize Sample objects.
-        columns = [self.testsuite.Sample.run_id,
-                   self.testsuite.Sample.test_id,
-                   self.testsuite.Sample.profile_id]
+        # here instead of requiring SA to materialize Sample objects. Whether
+        # the profile of a sample is still being processed comes with it.
+        Sample = self.testsuite.Sample
+        Profile = self.testsuite.Profile
+        columns = [Sample.run_id, Sample.test_id, Sample.profile_id,
+                   (Profile.counters == None)]
         columns.extend(f.column for f in self.testsuite.sample_fields)
-        q = self.testsuite.query(*columns)
+        q = self.testsuite.query(*columns) \
+            .outerjoin(Profile, Sample.profile_id == Profile.id)
         if only_tests:
-            q = q.filter(self.testsuite.Sample.test_id.in_(only_tests))
-        q = q.filter(self.testsuite.Sample.run_id.in_(to_load))
+            q = q.filter(Sample.test_id.in_(only_tests))
+        q = q.filter(Sample.run_id.in_(to_load))
         for data in q:
             run_id = data[0]
             test_id = data[1]
             profile_id = data[2]
-            sample_values = data[3:]
+            profile_processing = data[3]
+            sample_values = data[4:]
             self.sample_map[(run_id, test_id)] = sample_values
             if profile_id is not None:
                 self.profile_map[(run_id, test_id)] = profile_id
+                if profile_processing:
+                    self.processing_profiles.add(profile_id)
 
         self.loaded_run_ids |= to_load
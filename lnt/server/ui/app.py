@@ -1,6 +1,8 @@
 import StringIO
+import json
 import logging
 import logging.handlers
+import os
 import sys
 import time
 import traceback
@@ -23,8 +25,87 @@ import lnt.server.ui.globals
 import lnt.server.ui.profile_views
 import lnt.server.ui.regression_views
 import lnt.server.ui.views
+import lnt.util.async_ops
 from lnt.server.ui.api import load_api_resources
-from lnt.testing.util.commands import warning, error
+from lnt.testing.util.commands import warning, error, is_running
+
+
+class ProcessLogHandler(logging.Handler):
+    """
+    Log records to a file per process, for the /log view.
+
+    Every process, including the background processes forked by the server,
+    appends its records to a file of its own in the log directory, so logging
+    needs no communication between processes. The /log view reads and merges
+    the files when it is opened. Once a file grows beyond max_bytes, it is
+    rotated, keeping one previous file.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024, max_age=24 * 60 * 60):
+        logging.Handler.__init__(self)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pid = None
+        self.stream = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _open(self):
+        self.pid = os.getpid()
+        self.stream = open(os.path.join(self.path, '%d.log' % self.pid), 'a')
+
+    def emit(self, record):
+        try:
+            # A forked process logs to a file of its own.
+            if self.pid != os.getpid():
+                self._open()
+            self.stream.write(json.dumps({
+                        'created': record.created,
+                        'levelname': record.levelname,
+                        'filename': record.filename,
+                        'lineno': record.lineno,
+                        'process': record.process,
+                        'msg': record.getMessage()}) + '\n')
+            self.stream.flush()
+            if self.stream.tell() > self.max_bytes:
+                self.stream.close()
+                os.rename(self.stream.name, self.stream.name + '.1')
+                self._open()
+        except Exception:
+            self.handleError(record)
+
+    def records(self, limit=10000):
+        """
+        records([limit]) -> [dict]
+
+        Return the most recent records logged by all the processes, newest
+        first. The files of processes which exited more than max_age seconds
+        ago are removed.
+        """
+        records = []
+        for name in os.listdir(self.path):
+            pid = name.split('.')[0]
+            if not pid.isdigit():
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                if not is_running(int(pid)) and \
+                        time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # The record is still being written.
+                            pass
+            except (OSError, IOError):
+                # The file was rotated or removed meanwhile.
+                continue
+        records.sort(key=lambda record: record['created'], reverse=True)
+        return records[:limit]
 
 
 class RootSlashPatchMiddleware(object):
@@ -141,6 +222,10 @@ class App(LNTExceptionLoggerFlask):
         instance = lnt.server.instance.Instance.frompath(config_path)
         app = App.create_with_instance(instance)
         app.start_file_logging()
+
+        # Fork the background workers now, with the logging set up for the
+        # /log view, and before any thread serves requests.
+        lnt.util.async_ops.launch_workers()
         return app
 
     def __init__(self, name):
@@ -170,6 +255,10 @@ class App(LNTExceptionLoggerFlask):
 
         lnt.server.db.rules_manager.register_hooks()
 
+        # Nothing is left to finish the background imports of a server which
+        # exited.
+        lnt.util.async_ops.fail_orphaned_imports(self.old_config)
+
     def start_file_logging(self):
         """Start server production logging.  At this point flask already logs
         to stderr, so just log to a file as well.
@@ -180,12 +269,12 @@ class App(LNTExceptionLoggerFlask):
         ch.setLevel(logging.DEBUG)
         self.logger.addHandler(ch)
 
-        # Log to mem for the /log view.
-        h = logging.handlers.MemoryHandler(1024 * 1024, flushLevel=logging.CRITICAL)
+        # Log to a file per process for the /log view.
+        h = ProcessLogHandler(os.path.join(self.old_config.tempDir, 'log'))
         h.setLevel(logging.DEBUG)
         self.logger.addHandler(h)
-        # Also store the logger, so we can render the buffer in it.
-        self.config['mem_logger'] = h
+        # Also store the handler, so we can render its records.
+        self.config['log_handler'] = h
 
         if not self.debug:
             LOG_FILENAME = "lnt.log"
@@ -1,3 +1,4 @@
+import calendar
 import datetime
 from flask import g
 from flask import abort
@@ -14,42 +15,46 @@ import sys, os
 
 from flask import render_template, current_app
 import os, json
-from lnt.server.ui.decorators import v4_route, frontend
+from lnt.server.ui.decorators import db_route, v4_route, frontend
 from lnt.server.ui.globals import v4_url_for
 
-@frontend.route('/profile/admin')
+@db_route('/profile/admin', only_v3=False)
 def profile_admin():
-    profileDir = current_app.old_config.profileDir
-
-    history_path = os.path.join(profileDir, '_profile-history.json')
-    age_path = os.path.join(profileDir, '_profile-age.json')
-
-    try:
-        history = json.loads(open(history_path).read())
-    except:
-        history = []
-    try:
-        age = json.loads(open(age_path).read())
-    except:
-        age = []
-
-    # Convert from UNIX timestamps to Javascript timestamps.
-    history = [[x * 1000, y] for x,y in history]
-    age = [[x * 1000, y] for x,y in age]
+    db = request.get_db()
+
+    # The storage used by the profiles, by the day they were stored.
+    days = []
+    for date, size, count in db.getProfileStorage():
+        if not isinstance(date, datetime.date):
+            date = datetime.datetime.strptime(date, '%Y-%m-%d')
+        # Use Javascript timestamps, and kB.
+        timestamp = calendar.timegm(date.timetuple()) * 1000
+        days.append((timestamp, size / 1000.))
+
+    # The disk space used over time, by the profiles still stored.
+    history = []
+    total = 0
+    for timestamp, size in days:
+        total += size
+        history.append([timestamp, total])
 
     # Calculate a histogram bucket size that shows ~20 bars on the screen
     num_buckets = 20
-    
-    range = max(a[0] for a in age) - min(a[0] for a in age)
-    bucket_size = float(range) / float(num_buckets)
-    
-    # Construct the histogram.
-    hist = {}
-    for x,y in age:
-        z = int(float(x) / bucket_size)
-        hist.setdefault(z, 0)
-        hist[z] += y
-    age = [[k * bucket_size, hist[k]] for k in sorted(hist.keys())]
+
+    age = []
+    bucket_size = 0
+    if days:
+        range = days[-1][0] - days[0][0]
+        bucket_size = max(float(range) / float(num_buckets),
+                          24 * 60 * 60 * 1000.)
+
+        # Construct the histogram.
+        hist = {}
+        for x,y in days:
+            z = int(float(x) / bucket_size)
+            hist.setdefault(z, 0)
+            hist[z] += y
+        age = [[k * bucket_size, hist[k]] for k in sorted(hist.keys())]
 
     return render_template("profile_admin.html",
                            history=history, age=age, bucket_size=bucket_size)
@@ -190,7 +195,9 @@ def v4_profile(testid, run1_id, run2_id=None):
         'getCodeForFunction': v4_url_for('v4_profile_ajax_getCodeForFunction'),
 
     }
+    processing = any(p.is_processing for p in (profile1, profile2)
+                     if p is not None)
     return render_template("v4_profile.html",
                            ts=ts, test=test,
                            run1=json_run1, run2=json_run2,
-                           urls=urls)
+                           urls=urls, processing=processing)
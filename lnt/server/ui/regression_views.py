@@ -394,7 +394,7 @@ def v4_regression_detail(id):
 @v4_route("/hook", methods=["GET"])
 def v4_hook():
     ts = request.get_testsuite()
-    rule_hooks.post_submission_hooks(ts, 0)
+    rule_hooks.post_submission_hooks(ts, [])
     abort(400)
   
 
@@ -2,7 +2,10 @@ import datetime
 import json
 import os
 import re
+import StringIO
 import tempfile
+import threading
+import zlib
 from collections import namedtuple, defaultdict
 from urlparse import urlparse, urljoin
 
@@ -23,6 +26,7 @@ from typing import List, Optional
 from wtforms import SelectField, StringField, SubmitField
 from wtforms.validators import DataRequired, Length
 
+import lnt.server.db.jobqueue
 import lnt.server.db.rules_manager
 import lnt.server.db.search
 import lnt.server.reporting.analysis
@@ -96,30 +100,172 @@ def index():
 # Database Actions
 
 
+def _copy_submission(source, compressed, f, max_size):
+    """Copy a submitted report to the file f in chunks, decompressing it if it
+    is gzip compressed. Returns False if the report is larger than max_size
+    bytes (or None for no limit), once decompressed."""
+    chunk_size = 1 << 16
+    size = 0
+    if compressed:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for block in iter(lambda: source.read(chunk_size), ''):
+        while block:
+            if compressed:
+                # Decompress a chunk at a time, so a small compressed block
+                # can't expand into more than we accept.
+                data = decompressor.decompress(block, chunk_size)
+                block = decompressor.unconsumed_tail
+            else:
+                data, block = block, ''
+            size += len(data)
+            if max_size is not None and size > max_size:
+                return False
+            f.write(data)
+    if compressed:
+        data = decompressor.flush()
+        size += len(data)
+        if max_size is not None and size > max_size:
+            return False
+        f.write(data)
+    return True
+
+def _submission_error(error, is_batch, status=400):
+    """Reject a submission. Batch submissions, which come from `lnt submit`,
+    get the error as JSON with the status code, so the client can tell they
+    failed; others get the submission form again."""
+    if is_batch:
+        response = flask.jsonify(error=error)
+        response.status_code = status
+        return response
+    if status == 400:
+        return render_template("submit_run.html", error=error)
+    return render_template("submit_run.html", error=error), status
+
+def _is_gzip_stream(stream):
+    magic = stream.read(2)
+    stream.seek(0)
+    return magic == '\x1f\x8b'
+
+def _import_submission(path, commit, is_async):
+    """Import a stored submission, returning the JSON result object and the
+    status code."""
+    # In asynchronous mode, import the stored submission in the background
+    # and return a ticket which can be used to poll for the result.
+    if is_async:
+        ticket = os.path.basename(path)[:-len('.plist')]
+        async_ops.async_import(g.db_name, path, commit,
+                               _submission_status_path(path),
+                               request.url_root, current_app.old_config)
+        status_url = db_url_for('submit_run_status', ticket=ticket,
+                                _external=True)
+        return dict(ticket=ticket, status='pending',
+                    status_url=status_url), 202
+
+    # Get a DB connection.
+    db = request.get_db()
+
+    # Import the data. Committed submissions may be grouped with concurrent
+    # ones into a single transaction.
+    #
+    # FIXME: Gracefully handle formats failures and DOS attempts. Overly
+    # large inputs are rejected when they are stored.
+    group_commit = lnt.util.ImportData.get_group_commit(
+        current_app.old_config.databases[g.db_name])
+    if commit and group_commit is not None:
+        result = group_commit.import_and_report(
+            current_app.old_config, g.db_name, db, path, '<auto>')
+    else:
+        result = lnt.util.ImportData.import_and_report(
+            current_app.old_config, g.db_name, db, path, '<auto>', commit)
+
+    # It is nice to have a full URL to the run, so fixup the request URL
+    # here were we know more about the flask instance.
+    if result.get('result_url'):
+        result['result_url'] = request.url_root + result['result_url']
+
+    return result, 200
+
+# The number of submissions this server process is importing.
+_inflight_imports = 0
+_inflight_imports_lock = threading.Lock()
+
+def _busy_response(reason):
+    """Turn a submission away, asking the client to retry later."""
+    retry_after = current_app.old_config.retry_after
+    response = flask.jsonify(error=reason, retry_after=retry_after)
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @db_route('/submitRun', only_v3=False, methods=('GET', 'POST'))
 def submit_run():
+    """
+    Submit reports for import.
+
+    Reports are either given by the 'input_data' form field, uploaded as one
+    or more 'file' form fields, or sent as the request body itself (with the
+    parameters in the query string). Uploaded files and request bodies may be
+    gzip compressed, the latter using Content-Encoding.
+
+    With batch=1, the response contains a 'results' list with the result for
+    each report, otherwise only a single report may be submitted.
+
+    Submissions are answered with 429 (Too Many Requests) and a Retry-After
+    header while the server has too many imports or background jobs running.
+    """
     if request.method == 'GET':
         return render_template("submit_run.html")
 
     assert request.method == 'POST'
-    input_file = request.files.get('file')
-    input_data = request.form.get('input_data')
-    commit = int(request.form.get('commit', 0))
-
-    if input_file and not input_file.content_length:
-        input_file = None
-
-    if not input_file and not input_data:
-        return render_template(
-            "submit_run.html", error="must provide input file or data")
-    if input_file and input_data:
-        return render_template(
-            "submit_run.html", error="cannot provide input file *and* data")
-
-    if input_file:
-        data_value = input_file.read()  
+
+    # Check the server can take on more work, before accepting the upload.
+    global _inflight_imports
+    config = current_app.old_config
+    if config.max_background_jobs is not None and \
+            lnt.server.db.jobqueue.num_waiting_jobs(request.get_db()) >= \
+            config.max_background_jobs:
+        return _busy_response("too many background jobs")
+    with _inflight_imports_lock:
+        if config.max_inflight_imports is not None and \
+                _inflight_imports >= config.max_inflight_imports:
+            return _busy_response("too many imports in progress")
+        _inflight_imports += 1
+    try:
+        return _submit_reports()
+    finally:
+        with _inflight_imports_lock:
+            _inflight_imports -= 1
+
+def _submit_reports():
+    commit = int(request.values.get('commit', 0))
+    is_async = int(request.values.get('async', 0))
+    is_batch = int(request.values.get('batch', 0))
+
+    # Find the submitted reports, as (stream, is_compressed) pairs.
+    if request.mimetype in ('multipart/form-data',
+                            'application/x-www-form-urlencoded'):
+        input_files = [f for f in request.files.getlist('file')
+                       if f.filename]
+        input_data = request.form.get('input_data')
+        if input_files and input_data:
+            return _submission_error("cannot provide input file *and* data",
+                                     is_batch)
+        if input_data:
+            sources = [(StringIO.StringIO(input_data.encode('utf-8')), False)]
+        else:
+            sources = [(f.stream, _is_gzip_stream(f.stream))
+                       for f in input_files]
+    elif request.content_length:
+        sources = [(request.stream,
+                    request.headers.get('Content-Encoding') == 'gzip')]
     else:
-        data_value = input_data
+        sources = []
+
+    if not sources:
+        return _submission_error("must provide input file or data", is_batch)
+    if len(sources) > 1 and not is_batch:
+        return _submission_error("multiple files require batch mode",
+                                 is_batch)
 
     # Stash a copy of the raw submission.
     #
@@ -135,31 +281,81 @@ def submit_run():
 
     # Save the file under a name prefixed with the date, to make it easier
     # to use these files in cases we might need them for debugging or data
-    # recovery.
+    # recovery. Uploaded files are copied to disk in chunks, rather than being
+    # read into memory first.
     prefix = utcnow.strftime("data-%Y-%m-%d_%H-%M-%S")
-    fd,path = tempfile.mkstemp(prefix=prefix, suffix='.plist',
-                               dir=str(tmpdir))
-    os.write(fd, data_value)
-    os.close(fd)
+    paths = []
+    max_size = current_app.old_config.max_submission_size
+    for source,compressed in sources:
+        fd,path = tempfile.mkstemp(prefix=prefix, suffix='.plist',
+                                   dir=str(tmpdir))
+        paths.append(path)
+        with os.fdopen(fd, 'wb') as f:
+            copied = _copy_submission(source, compressed, f, max_size)
+        if not copied:
+            for path in paths:
+                os.remove(path)
+            return _submission_error(
+                "submission is larger than %d bytes" % max_size, is_batch,
+                413)
+
+    results = [_import_submission(path, commit, is_async) for path in paths]
+    if is_batch:
+        response = flask.jsonify(results=[result for result,_ in results])
+        response.status_code = max(status for _,status in results)
+        return response
+
+    (result,status), = results
+    response = flask.jsonify(**result)
+    response.status_code = status
+    if status == 202:
+        response.headers['Location'] = result['status_url']
+    return response
 
-    # Get a DB connection.
-    db = request.get_db()
+# Submission tickets are the name of the stored submission, which includes the
+# date it was received.
+_ticket_re = re.compile(r'^data-(\d{4})-(\d{2})-\d{2}_\d{2}-\d{2}-\d{2}\w+$')
 
-    # Import the data.
-    #
-    # FIXME: Gracefully handle formats failures and DOS attempts. We
-    # should at least reject overly large inputs.
+def _submission_status_path(path):
+    return os.path.splitext(path)[0] + '.status.json'
 
-    result = lnt.util.ImportData.import_and_report(
-        current_app.old_config, g.db_name, db, path, '<auto>', commit)
+@db_route('/submitRun/status/<ticket>', only_v3=False)
+def submit_run_status(ticket):
+    m = _ticket_re.match(ticket)
+    if m is None:
+        abort(404)
+    path = os.path.join(current_app.old_config.tempDir, g.db_name,
+                        "%s-%s" % m.groups(), ticket + '.plist')
+    status_path = _submission_status_path(path)
 
-    # It is nice to have a full URL to the run, so fixup the request URL
-    # here were we know more about the flask instance.
-    if result.get('result_url'):
-        result['result_url'] = request.url_root + result['result_url']
+    # The import is never done if the server importing it exited.
+    async_ops.fail_orphaned_imports(current_app.old_config, g.db_name, path)
 
-    return flask.jsonify(**result)
+    # Once the import is done, return its result.
+    if os.path.exists(status_path):
+        with open(status_path) as f:
+            return flask.jsonify(**json.load(f))
 
+    if not os.path.exists(path):
+        abort(404)
+    response = flask.jsonify(ticket=ticket, status='pending')
+    response.status_code = 202
+    return response
+
+
+@db_route('/jobs', only_v3=False)
+def jobs():
+    """Show the background job queue of the database."""
+    db = request.get_db()
+    BackgroundJob = lnt.server.db.jobqueue.BackgroundJob
+    queued_jobs = db.query(BackgroundJob).order_by(BackgroundJob.id).all()
+    state_counts = defaultdict(int)
+    for job in queued_jobs:
+        state_counts[job.state_name] += 1
+    return render_template("jobs.html", jobs=queued_jobs,
+                           state_counts=state_counts,
+                           job_states=lnt.server.db.jobqueue.JobState,
+                           active_jobs=async_ops.check_workers(False))
 
 
 ###
@@ -1354,7 +1550,9 @@ def rules():
 @frontend.route('/log')
 def log():
     async_ops.check_workers(True)
-    return render_template("log.html")
+    log_handler = current_app.config.get('log_handler')
+    records = log_handler.records() if log_handler else []
+    return render_template("log.html", records=records)
 
 @frontend.route('/debug')
 def debug():
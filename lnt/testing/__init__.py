@@ -54,15 +54,89 @@ class Report:
         self.run.update_endtime()
         self.check()
 
-    def render(self, indent=4):
+    def render(self, indent=4, columnar=False, metrics=None):
+        """render([indent], [columnar], [metrics]) -> str
+
+        Render the report as JSON. If columnar is true, the tests are rendered
+        in the compact columnar format of report version 2, see
+        render_columnar_tests(). Servers older than that format only accept the
+        default format.
+        """
+        run = self.run.render()
+        if columnar:
+            run['Info'] = dict(run['Info'])
+            run['Info']['__report_version__'] = str(columnar_version)
+            tests = self.render_columnar_tests(metrics)
+        else:
+            tests = [t.render() for t in self.tests]
+
         # Note that we specifically override the encoding to avoid the
         # possibility of encoding errors. Clients which care about the text
         # encoding should supply unicode string objects.
         return json.dumps({ 'Machine' : self.machine.render(),
-                            'Run' : self.run.render(),
-                            'Tests' : [t.render() for t in self.tests] },
+                            'Run' : run,
+                            'Tests' : tests },
                           sort_keys=True, indent=indent, encoding='latin-1')
 
+    def render_columnar_tests(self, metrics=None):
+        """render_columnar_tests([metrics]) -> dict
+
+        Render the tests in columnar form. 'Names' lists each test name once
+        (without the test suite tag), and 'Metrics' maps each metric (such as
+        'exec' or 'exec.status') to an array with the samples of each test, or
+        None where the test did not report the metric. The n-th samples of the
+        metrics of a test form its n-th sample row.
+
+        The reported test names are split into a test name and a metric by
+        their longest suffix in metrics, which defaults to the metrics of the
+        test suites LNT defines.
+        """
+        if metrics is None:
+            metrics = default_metrics
+        suffixes = sorted(('.' + metric for metric in metrics),
+                          key=len, reverse=True)
+        prefix = self.run.info['tag'] + '.'
+
+        # Collect the values of each test, keeping the order tests are first
+        # seen in.
+        test_values = {}
+        test_names = []
+        for t in self.tests:
+            if t.info:
+                raise ValueError("test parameter sets are not supported by "
+                                 "the columnar format")
+            if not t.name.startswith(prefix):
+                raise ValueError("test %r is misnamed for reporting under "
+                                 "schema %r" % (t.name, prefix[:-1]))
+            name = t.name[len(prefix):]
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    break
+            else:
+                raise ValueError("test %r does not report a known metric" % (
+                        t.name,))
+            test_name, metric = name[:-len(suffix)], suffix[1:]
+
+            values = test_values.get(test_name)
+            if values is None:
+                test_values[test_name] = values = {}
+                test_names.append(test_name)
+            values.setdefault(metric, []).extend(t.data)
+
+        # Emit the samples of each metric, aligned with the test names.
+        columns = dict((metric, [None] * len(test_names))
+                       for values in test_values.values()
+                       for metric in values)
+        for i,test_name in enumerate(test_names):
+            for metric,data in test_values[test_name].items():
+                if metric.endswith('.status'):
+                    # Statuses are small integers, don't render them as floats.
+                    data = [int(value) for value in data]
+                columns[metric][i] = data
+
+        return { 'Names' : test_names,
+                 'Metrics' : columns }
+
 class Machine:
     """Information on the machine the test was run on.
 
@@ -176,7 +250,20 @@ class TestSamples:
 #
 # Version 1 -- 2012-04-12: run_order was changed to not be padded, and allow
 # non-integral values.
+#
+# Version 2 -- 2026-10-16: the tests may be reported in a columnar format (see
+# Report.render_columnar_tests). Reports are never upgraded to it, since
+# splitting the mangled test names of earlier reports into a test name and a
+# metric depends on the test suite, so the server imports both formats.
 current_version = 1
+columnar_version = 2
+
+# The metrics reported by the test suites LNT defines.
+default_metrics = ['compile', 'compile.status', 'exec', 'exec.status',
+                   'hash', 'hash.status', 'score', 'mem', 'code_size',
+                   'user', 'user.status', 'sys', 'sys.status', 'wall',
+                   'wall.status', 'size', 'size.status', 'mem.status',
+                   'profile']
 
 def upgrade_0_to_1(data):
     # We recompute the run_order here if it looks like this run_order was
@@ -228,7 +315,7 @@ def upgrade_report(data):
     report_version = int(data['Run']['Info'].get('__report_version__', 0))
 
     # Check if the report is current.
-    if report_version == current_version:
+    if report_version in (current_version, columnar_version):
         return data
 
     # Check if the version is out-of-range.
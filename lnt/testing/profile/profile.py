@@ -1,4 +1,4 @@
-import os, tempfile, base64
+import os, tempfile, base64, hashlib
 import lnt.testing.profile
 
 class Profile(object):
@@ -38,7 +38,14 @@ class Profile(object):
         with Profile.render(). The format of this is not the same as the
         on-disk format; it is base64 encoded to survive wire transfer.
         """
-        s = base64.b64decode(s)
+        return Profile.fromBytes(base64.b64decode(s))
+
+    @staticmethod
+    def fromBytes(s):
+        """
+        Load a profile from a string holding the on-disk format, i.e. an
+        already decoded rendered profile.
+        """
         with tempfile.NamedTemporaryFile() as fd:
             fd.write(s)
             # Rewind to beginning.
@@ -54,6 +61,51 @@ class Profile(object):
                         return None
         raise RuntimeError('No profile implementations could read this file!')
 
+    @staticmethod
+    def contentHash(s):
+        """
+        Return the digest identifying the profile stored in the string 's' (in
+        the on-disk format) in a content addressed profile store.
+        """
+        return hashlib.sha1(s).hexdigest()
+
+    @staticmethod
+    def saveContentAddressed(s, profileDir, digest=None):
+        """
+        Save the profile stored in the string 's' (in the on-disk format) in
+        the content addressed store rooted at 'profileDir', unless an identical
+        profile is already stored there.
+
+        Profiles are fanned out over two levels of subdirectories keyed on the
+        digest, to keep directories small. The filename, relative to
+        'profileDir', is returned.
+        """
+        if digest is None:
+            digest = Profile.contentHash(s)
+        filename = os.path.join(digest[0:2], digest[2:4],
+                                digest + '.lntprof')
+        path = os.path.join(profileDir, filename)
+        if os.path.exists(path):
+            return filename
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Somebody else may have just created it.
+                if not os.path.isdir(directory):
+                    raise
+
+        # Write to a temporary file and rename it into place, so concurrent
+        # writers never expose a partial profile.
+        tf = tempfile.NamedTemporaryFile(suffix='.tmp', dir=directory,
+                                         delete=False)
+        with tf:
+            tf.write(s)
+        os.rename(tf.name, path)
+        return filename
+
     @staticmethod
     def saveFromRendered(s, filename=None, profileDir=None, prefix=''):
         """
@@ -82,6 +82,15 @@ def mkdir_p(path):
         if e.errno != errno.EEXIST:
             raise
 
+
+def is_running(pid):
+    """is_running(pid) - Whether the process "pid" is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
 def capture_with_result(args, include_stderr=False):
     import subprocess
     """capture_with_result(command) -> (output, exit code)
@@ -1,44 +1,91 @@
-import os, re, time
+import os, re, threading, time, traceback
 import collections
+import hashlib
 import lnt.testing
 import lnt.formats
 import lnt.server.reporting.analysis
-from lnt.testing.util.commands import note
+from lnt.testing.util.commands import note, warning
 from lnt.util import NTEmailReport
 from lnt.util import async_ops
 
+def load_report(file, format):
+    """
+    load_report(file, format) -> (data, error, load_time, num_samples)
+
+    Load, upgrade and validate a report, so that it can be passed to
+    import_and_report as data. On failure, data is None and error describes
+    the failure. This does not need a database, so it can run in a worker
+    process.
+    """
+    start_time = time.time()
+    try:
+        data = lnt.formats.read_any(file, format)
+        lnt.testing.upgrade_report(data)
+
+        # Check the report has everything the importer needs.
+        data['Machine']['Name']
+        data['Run']['Info']['tag']
+        if isinstance(data['Tests'], dict):
+            columns = data['Tests']['Metrics'].values()
+            num_samples = sum(
+                max([len(column[i] or []) for column in columns] or [0])
+                for i in range(len(data['Tests']['Names'])))
+        else:
+            num_samples = sum(len(test['Data']) for test in data['Tests'])
+    except KeyboardInterrupt:
+        raise
+    except:
+        return None, "load failure: %s" % traceback.format_exc(), \
+            time.time() - start_time, 0
+    return data, None, time.time() - start_time, num_samples
+
 def import_and_report(config, db_name, db, file, format, commit=False,
                       show_sample_count=False, disable_email=False,
-                      disable_report=False):
+                      disable_report=False, data=None, defer_commit=False):
     """
     import_and_report(config, db_name, db, file, format,
                       [commit], [show_sample_count],
-                      [disable_email]) -> ... object ...
+                      [disable_email], [disable_report],
+                      [data], [defer_commit]) -> ... object ...
 
     Import a test data file into an LNT server and generate a test report. On
     success, run is the newly imported run. Note that success is uneffected by
     the value of commit, this merely changes whether the run (on success) is
     committed to the database.
 
+    If data is given, it is the already loaded contents of the file. If
+    defer_commit is true, a run which should be committed is left pending in
+    the current transaction, and the caller is responsible for passing the
+    result to commit_deferred(), which also starts its shadow import.
+
     The result object is a dictionary containing information on the imported run
     and its comparison to the previous run.
     """
-    numMachines = db.getNumMachines()
-    numRuns = db.getNumRuns()
-    numTests = db.getNumTests()
-
-    # If the database gets fragmented, count(*) in SQLite can get really slow!?!
-    if show_sample_count:
-        numSamples = db.getNumSamples()
-
     result = {}
     result['success'] = False
     result['error'] = None
     result['import_file'] = file
 
+    # Find the database config, if we have a configuration object.
+    if config:
+        db_config = config.databases[db_name]
+    else:
+        db_config = None
+
+    # A shadow import reuses the loaded report, so it can't be streamed.
+    shadow_name = db_config and commit and db_config.shadow_import
+    if shadow_name and config.databases.get(shadow_name) is None:
+        raise ValueError, ("invalid configuration, shadow import "
+                           "database %r does not exist") % shadow_name
+
     startTime = time.time()
     try:
-        data = lnt.formats.read_any(file, format)
+        # Check whether this exact submission has been imported before, in
+        # which case there is no need to load it, unless for a shadow import.
+        content_hash = _hash_file(file)
+        run = db.getRunByContentHash(content_hash)
+        if data is None and (run is None or shadow_name):
+            data = lnt.formats.read_any(file, format, stream=not shadow_name)
     except KeyboardInterrupt:
         raise
     except:
@@ -48,38 +95,57 @@ def import_and_report(config, db_name, db, file, format, commit=False,
 
     result['load_time'] = time.time() - startTime
 
-    # Auto-upgrade the data, if necessary.
-    lnt.testing.upgrade_report(data)
+    if data is not None:
+        # Auto-upgrade the data, if necessary.
+        lnt.testing.upgrade_report(data)
 
-    # Find the database config, if we have a configuration object.
-    if config:
-        db_config = config.databases[db_name]
+    if run is None:
+        machineName = data.get('Machine',{}).get('Name')
+        ts_name = data['Run']['Info'].get('tag')
     else:
-        db_config = None
+        machineName = run.machine.name
+        ts_name = run.testsuite.name
 
     # Find the email address for this machine's results.
     toAddress = email_config = None
     if db_config and not disable_email:
         email_config = db_config.email_config
         if email_config.enabled:
-            # Find the machine name.
-            machineName = str(data.get('Machine',{}).get('Name'))
-            toAddress = email_config.get_to_address(machineName)
+            toAddress = email_config.get_to_address(str(machineName))
             if toAddress is None:
                 result['error'] = ("unable to match machine name "
                                    "for test results email address!")
                 return result
 
     importStartTime = time.time()
-    try:
-        success, run = db.importDataFromDict(data, commit, config=db_config)
-    except KeyboardInterrupt:
-        raise
-    except:
-        raise
-        import traceback
-        result['error'] = "import failure: %s" % traceback.format_exc()
-        return result
+    # The importer counts what it adds, rather than us counting every table
+    # before and after the import.
+    added = dict.fromkeys(['machines', 'runs', 'tests', 'samples'], 0)
+    if run is not None:
+        success = False
+    else:
+        try:
+            success, run = db.importDataFromDict(data, commit,
+                                                 config=db_config, stats=added)
+        except KeyboardInterrupt:
+            raise
+        except lnt.formats.FormatError:
+            # The tests are decoded as they are imported, so a malformed
+            # report may only be detected here.
+            db.rollback()
+            import traceback
+            result['error'] = "load failure: %s" % traceback.format_exc()
+            return result
+        except:
+            raise
+            import traceback
+            result['error'] = "import failure: %s" % traceback.format_exc()
+            return result
+
+        # Remember the submission, so that resubmitting it is recognized
+        # without loading it.
+        if success:
+            run.content_hash = content_hash
 
     # If the import succeeded, save the import path.
     run.imported_from = file
@@ -102,24 +168,20 @@ def import_and_report(config, db_name, db, file, format, commit=False,
         NTEmailReport.emailReport(result, db, run, report_url,
                                   email_config, toAddress, success, commit)
 
-    result['added_machines'] = db.getNumMachines() - numMachines
-    result['added_runs'] = db.getNumRuns() - numRuns
-    result['added_tests'] = db.getNumTests() - numTests
+    result['added_machines'] = added['machines']
+    result['added_runs'] = added['runs']
+    result['added_tests'] = added['tests']
     if show_sample_count:
-        result['added_samples'] = db.getNumSamples() - numSamples
+        result['added_samples'] = added['samples']
 
     result['committed'] = commit
     result['run_id'] = run.id
-    ts_name = data['Run']['Info'].get('tag')
+    result['testsuite'] = ts_name
     if commit:
-        db.commit()
-        if db_config:
-            #  If we are not in a dummy instance, also run background jobs.
-            #  We have to have a commit before we run, so subprocesses can
-            #  see the submitted data.
-            ts = db.testsuite.get(ts_name)
-            async_ops.async_fieldchange_calc(db_name, ts, run, config)
-
+        _queue_background_jobs(config, db_name, db, ts_name, run)
+        if not defer_commit:
+            db.commit()
+            _run_background_jobs(config, db_name, db, ts_name, run)
     else:
         db.rollback()
     # Add a handy relative link to the submitted run.
@@ -129,28 +191,194 @@ def import_and_report(config, db_name, db, file, format, commit=False,
     result['total_time'] = time.time() - startTime
     note("Successfully created {}".format(result['result_url']))
     # If this database has a shadow import configured, import the run into that
-    # database as well.
-    if config and config.databases[db_name].shadow_import:
-        # Load the shadow database to import into.
-        db_config = config.databases[db_name]
-        shadow_name = db_config.shadow_import
-        with closing(config.get_database(shadow_name)) as shadow_db:
-            if shadow_db is None:
-                raise ValueError, ("invalid configuration, shadow import "
-                                   "database %r does not exist") % shadow_name
-
-            # Perform the shadow import.
-            shadow_result = import_and_report(config, shadow_name,
-                                              shadow_db, file, format, commit,
-                                              show_sample_count, disable_email,
-                                              disable_report)
-
-            # Append the shadow result to the result.
-            result['shadow_result'] = shadow_result
+    # database as well, in the background, once the run is committed. The
+    # shadow import logs its own result.
+    if shadow_name:
+        result['shadow_import'] = shadow_name
+        shadow_import = (file, data, disable_email, disable_report)
+        if defer_commit:
+            result['deferred_shadow_import'] = shadow_import
+        else:
+            async_ops.async_shadow_import(config, shadow_name, *shadow_import)
 
     result['success'] = True
     return result
 
+def _hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _queue_background_jobs(config, db_name, db, ts_name, run):
+    if config and config.databases[db_name]:
+        #  If we are not in a dummy instance, queue the background jobs with
+        #  the run, so that they are run even if the server exits before
+        #  running them.
+        ts = db.testsuite.get(ts_name)
+        async_ops.queue_fieldchange_calc(db, ts, run)
+
+def _run_background_jobs(config, db_name, db, ts_name, run):
+    if config and config.databases[db_name]:
+        #  If we are not in a dummy instance, also run background jobs.
+        #  We have to have a commit before we run, so subprocesses can
+        #  see the submitted data.
+        ts = db.testsuite.get(ts_name)
+        async_ops.async_fieldchange_calc(db_name, ts, run, config)
+
+def commit_deferred(config, db_name, db, results):
+    """
+    commit_deferred(config, db_name, db, results) -> None
+
+    Commit the runs imported by import_and_report() with defer_commit, and
+    start the background jobs and shadow imports for them.
+    """
+    db.commit()
+    for result in results:
+        shadow_import = result.pop('deferred_shadow_import', None)
+        if not result.get('committed'):
+            continue
+        ts = db.testsuite.get(result['testsuite'])
+        run = ts.getRun(result['run_id'])
+        _run_background_jobs(config, db_name, db, result['testsuite'], run)
+        if shadow_import is not None:
+            async_ops.async_shadow_import(config, result['shadow_import'],
+                                          *shadow_import)
+
+class _GroupedSubmission(object):
+    def __init__(self, file, format):
+        self.file = file
+        self.format = format
+        self.result = None
+        self.done = threading.Event()
+
+class GroupCommit(object):
+    """
+    Coalesce the imports of concurrent submissions to a database into a single
+    transaction.
+
+    The first thread to submit becomes the leader: it waits for the group
+    commit window for more submissions to arrive, imports all of them with its
+    own database connection, and commits them together. The other threads wait
+    for their result, and the first submission left waiting becomes the next
+    leader.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.queue = []
+        self.has_leader = False
+
+    def import_and_report(self, config, db_name, db, file, format):
+        """
+        import_and_report(config, db_name, db, file, format) -> ... object ...
+
+        Import and commit a test data file as part of a group, returning the
+        same result as the import_and_report() function.
+        """
+        submission = _GroupedSubmission(file, format)
+        with self.lock:
+            self.queue.append(submission)
+            is_leader = not self.has_leader
+            self.has_leader = True
+
+        # Wait until the submission has been imported, or it is its turn to
+        # lead the next group.
+        if not is_leader:
+            submission.done.wait()
+            if submission.result is not None:
+                return submission.result
+
+        time.sleep(self.window)
+        with self.lock:
+            group, self.queue = self.queue, []
+        try:
+            self._import_group(config, db_name, db, group)
+        finally:
+            for grouped in group:
+                if grouped.result is None:
+                    grouped.result = {'success': False,
+                                      'import_file': grouped.file,
+                                      'error': "group commit was aborted"}
+                grouped.done.set()
+
+            # Hand over to the next leader.
+            with self.lock:
+                if self.queue:
+                    self.queue[0].done.set()
+                else:
+                    self.has_leader = False
+        return submission.result
+
+    def _import_group(self, config, db_name, db, group):
+        pending = list(group)
+        while pending:
+            results = []
+            for grouped in pending:
+                try:
+                    result = import_and_report(config, db_name, db,
+                                               grouped.file, grouped.format,
+                                               True, defer_commit=True)
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    import traceback
+                    result = {'success': False, 'import_file': grouped.file,
+                              'error': "import failure: %s" % (
+                                  traceback.format_exc(),)}
+                if result['error'] is not None:
+                    break
+                results.append(result)
+            else:
+                break
+
+            # A failed import may have rolled back the transaction, so report
+            # the failure and import the rest of the group again.
+            db.rollback()
+            grouped.result = result
+            pending.remove(grouped)
+
+        if not pending:
+            return
+        try:
+            commit_deferred(config, db_name, db, results)
+        except KeyboardInterrupt:
+            raise
+        except:
+            import traceback
+            db.rollback()
+            error = "import failure: %s" % (traceback.format_exc(),)
+            warning("Failed to commit a group of %d submissions" % (
+                len(pending),))
+            results = [{'success': False, 'import_file': grouped.file,
+                        'error': error}
+                       for grouped in pending]
+        else:
+            note("Committed a group of %d submissions" % (len(pending),))
+        for grouped,result in zip(pending, results):
+            grouped.result = result
+
+_group_commits = {}
+_group_commits_lock = threading.Lock()
+
+def get_group_commit(db_config):
+    """
+    get_group_commit(db_config) -> GroupCommit or None
+
+    Return the group commit submissions to the configured database should go
+    through, or None if the database does not use group commit.
+    """
+    if not db_config.group_commit_window:
+        return None
+    with _group_commits_lock:
+        group_commit = _group_commits.get(db_config.path)
+        if group_commit is None:
+            _group_commits[db_config.path] = group_commit = \
+                GroupCommit(db_config.group_commit_window)
+        return group_commit
+
 def print_report_result(result, out, err, verbose = True):
     """
     print_report_result(result, out, [err], [verbose]) -> None
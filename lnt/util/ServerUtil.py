@@ -2,11 +2,23 @@
 Utility for submitting files to a web server over HTTP.
 """
 
+import Queue
+import StringIO
+import contextlib
+import gzip
+import httplib
+import itertools
+import os
 import plistlib
+import random
+import socket
 import sys
+import threading
+import time
 import urllib
 import urllib2
-import contextlib
+import urlparse
+import uuid
 
 import lnt.server.instance
 from lnt.util import json
@@ -17,15 +29,36 @@ from lnt.util import ImportData
 # system to report to LNT, for example. It might be nice to factor the
 # simplified submit code into a separate utility.
 
-def submitFileToServer(url, file, commit):
-    with open(file, 'rb') as f:
-        values = { 'input_data' : f.read(),
-                   'commit' : ("0","1")[not not commit] }
+# Submissions the server is too busy to accept are retried up to this many
+# times, backing off exponentially from BUSY_BACKOFF seconds (at least for the
+# time the server asks for, and at most for MAX_BUSY_BACKOFF seconds).
+MAX_BUSY_RETRIES = 8
+BUSY_BACKOFF = 1.0
+MAX_BUSY_BACKOFF = 60.0
+
+def _busyDelay(attempt, retry_after):
+    """
+    Return the time to wait before retrying a submission the server turned
+    away, given the value of its Retry-After header.
+    """
+    delay = min(BUSY_BACKOFF * 2 ** attempt, MAX_BUSY_BACKOFF)
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        # The header is missing, or is a date.
+        pass
+
+    # Add some jitter, so clients which were turned away together don't all
+    # come back together.
+    return delay * random.uniform(1.0, 1.5)
 
-    data = urllib.urlencode(values)
-    response = urllib2.urlopen(urllib2.Request(url, data))
-    result_data = response.read()
+def _compress(data):
+    buffer = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+        f.write(data)
+    return buffer.getvalue()
 
+def _loadResult(result_data):
     # The result is expected to be a JSON object.
     try:
         return json.loads(result_data)
@@ -40,6 +73,156 @@ def submitFileToServer(url, file, commit):
         print result_data
         return
 
+def submitFileToServer(url, file, commit, compress=False):
+    with open(file, 'rb') as f:
+        data = f.read()
+
+    commit = ("0","1")[not not commit]
+    if compress:
+        # Send the compressed report as the request body, with the parameters
+        # in the query string.
+        request = urllib2.Request(
+            url + '?' + urllib.urlencode({'commit': commit}), _compress(data),
+            {'Content-Type': 'application/octet-stream',
+             'Content-Encoding': 'gzip'})
+    else:
+        values = { 'input_data' : data,
+                   'commit' : commit }
+        request = urllib2.Request(url, urllib.urlencode(values))
+
+    for attempt in itertools.count():
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, e:
+            if e.code != 429 or attempt == MAX_BUSY_RETRIES:
+                raise
+            time.sleep(_busyDelay(attempt, e.headers.get('Retry-After')))
+            continue
+        return _loadResult(response.read())
+
+class _ServerConnection(object):
+    """
+    A persistent connection for submitting batches of reports to a server.
+    """
+
+    def __init__(self, url):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme == 'https':
+            self.connection = httplib.HTTPSConnection(parts.netloc)
+        else:
+            self.connection = httplib.HTTPConnection(parts.netloc)
+        self.url = url
+        self.path = parts.path or '/'
+
+    def close(self):
+        self.connection.close()
+
+    def _post(self, path, body, headers):
+        self.connection.request('POST', path, body, headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def submit(self, files, commit, compress):
+        """
+        submit(files, commit, compress) -> [result]
+
+        Upload the files as a single batch, and return their results.
+        """
+        # Encode the reports as a multipart form.
+        boundary = '----lnt-submission-%s' % uuid.uuid4().hex
+        parts = []
+        for file in files:
+            with open(file, 'rb') as f:
+                data = f.read()
+            if compress:
+                data = _compress(data)
+            parts.extend([
+                    '--' + boundary,
+                    'Content-Disposition: form-data; name="file"; '
+                    'filename="%s"' % os.path.basename(file),
+                    'Content-Type: application/octet-stream',
+                    '',
+                    data])
+        parts.extend(['--' + boundary + '--', ''])
+        body = '\r\n'.join(parts)
+
+        path = self.path + '?' + urllib.urlencode({
+                'commit': ("0","1")[not not commit], 'batch': '1'})
+        headers = {'Content-Type':
+                       'multipart/form-data; boundary=%s' % boundary}
+        for attempt in itertools.count():
+            try:
+                try:
+                    response,result_data = self._post(path, body, headers)
+                except (httplib.HTTPException, socket.error):
+                    # The server may have closed the kept alive connection,
+                    # reconnect and try again. Should the batch have been
+                    # imported after all, the server reports the resubmitted
+                    # reports as duplicates.
+                    self.connection.close()
+                    response,result_data = self._post(path, body, headers)
+            except (httplib.HTTPException, socket.error), e:
+                self.connection.close()
+                raise urllib2.URLError(e)
+
+            if response.status != 429 or attempt == MAX_BUSY_RETRIES:
+                break
+            time.sleep(_busyDelay(attempt, response.getheader('Retry-After')))
+
+        if response.status >= 400:
+            raise urllib2.HTTPError(self.url, response.status, response.reason,
+                                    response.msg,
+                                    StringIO.StringIO(result_data))
+
+        result = _loadResult(result_data)
+        if result is None:
+            return [None] * len(files)
+        return result['results']
+
+def submitFilesToServer(url, files, commit, compress=False, batch_size=1,
+                        jobs=1):
+    """
+    submitFilesToServer(url, files, commit, [compress], [batch_size],
+                        [jobs]) -> [result]
+
+    Submit the files to the server in batches of up to batch_size reports per
+    request, using up to jobs concurrent requests. Each concurrent submitter
+    reuses its connection to the server. The results are returned in the
+    order of the files.
+    """
+    batches = Queue.Queue()
+    for i in range(0, len(files), batch_size):
+        batches.put((i, files[i:i + batch_size]))
+
+    results = [None] * len(files)
+    errors = []
+    def submitter():
+        connection = _ServerConnection(url)
+        try:
+            while not errors:
+                try:
+                    i,batch = batches.get_nowait()
+                except Queue.Empty:
+                    return
+                results[i:i + len(batch)] = connection.submit(batch, commit,
+                                                              compress)
+        except:
+            errors.append(sys.exc_info())
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=submitter)
+               for i in range(min(jobs, batches.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Report the first failure.
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
 def submitFileToInstance(path, file, commit):
     # Otherwise, assume it is a local url and submit to the default database
     # in the instance.
@@ -53,19 +236,25 @@ def submitFileToInstance(path, file, commit):
             config, db_name, db, file, format='<auto>', commit=commit)
 
 
-def submitFile(url, file, commit, verbose):
+def submitFile(url, file, commit, verbose, compress=False):
     # If this is a real url, submit it using urllib.
     if '://' in url:
-        result = submitFileToServer(url, file, commit)
+        result = submitFileToServer(url, file, commit, compress)
         if result is None:
             return
     else:
         result = submitFileToInstance(url, file, commit)
     return result
 
-def submitFiles(url, files, commit, verbose):
+def submitFiles(url, files, commit, verbose, compress=False, batch_size=1,
+                jobs=1):
+    # Batched and concurrent submission is only supported for servers.
+    if '://' in url and (batch_size > 1 or jobs > 1):
+        return submitFilesToServer(url, files, commit, compress, batch_size,
+                                   jobs)
+
     results = []
     for file in files:
-        result = submitFile(url, file, commit, verbose)
+        result = submitFile(url, file, commit, verbose, compress)
         results.append(result)
     return results
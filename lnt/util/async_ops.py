@@ -9,41 +9,441 @@ package in the system, but are generated on program load) we recreate the test
 suite that we need inside each subprocess before we execute the work job.
 """
 import atexit
+import glob
+import json
 import os
+import socket
+import tempfile
 import time
 import logging
 from flask import current_app, g
 import sys
-import lnt.server.db.fieldchange as fieldchange
+import lnt.server.db.jobqueue
+import lnt.server.db.util
 import lnt.server.db.v4db
 import traceback
 import signal
 from time import sleep
 import contextlib
 import multiprocessing
-from multiprocessing import Pool, TimeoutError, Manager, Process
+import collections
+import itertools
+import threading
+import Queue
+from multiprocessing import Pool, TimeoutError, Process
 from threading import Lock
 from lnt.testing.util.commands import note, warning, timed, error
+from lnt.testing.util.commands import is_running, mkdir_p, rm_f
 NUM_WORKERS = 4  # The number of subprocesses to spawn per LNT process.
 WORKERS = None  # The worker pool.
 
-JOBS = []
+# The jobs of the worker pool which import a submission, and a report into
+# a shadow database.
+IMPORT_JOB = '<import>'
+SHADOW_IMPORT_JOB = '<shadow import>'
+
+# Whether this process is itself a background process, which runs its jobs
+# itself rather than handing them to a worker pool.
+IN_BACKGROUND = False
+
+
+# The number of seconds between checks that the workers are still alive.
+WORKER_CHECK_INTERVAL = 1
+
+# The number of seconds between checks of the queues of the databases for
+# jobs which are waiting, but not known to the pool.
+RECOVERY_INTERVAL = 300
+
+# The number of seconds a worker may run a job before it is terminated. By
+# then, the jobs it was running are leased to the next worker anyway.
+WORKER_TIMEOUT = lnt.server.db.jobqueue.JOB_LEASE
+
+
+class _Worker(object):
+    """A worker process of a WorkerPool, with its own job queue."""
+
+    def __init__(self, worker_id, finished):
+        self.id = worker_id
+        self.jobs = multiprocessing.Queue()
+        # The key, config and arguments of the job the worker is running, or
+        # None, and when it was handed over.
+        self.running = None
+        self.started = None
+        self.process = Process(target=_worker_main,
+                               args=[worker_id, self.jobs, finished])
+        # Set this to make sure when parent dies, children are killed.
+        self.process.daemon = True
+        self.process.start()
+
+
+class WorkerPool(object):
+    """A pool of long-lived worker processes running the jobs of the
+    background job queue of the databases (see lnt.server.db.jobqueue).
+
+    The pool is told which machines have jobs waiting, and hands them to the
+    workers, which run all the waiting jobs of a machine together. Machines
+    wait here until a worker is free, so a burst of submissions for a machine
+    is handled by a single run of its jobs. Only as many machines as there are
+    workers are handed over to the workers at a time, and only one at a time
+    for a SQLite database, as SQLite does not allow concurrent writers.
+
+    The workers also import the submissions made in the background, which
+    are keyed on IMPORT_JOB, the database and the path of the submission, and
+    the reports shadowed into another database, which are keyed on
+    SHADOW_IMPORT_JOB, the database, the report file and a unique number.
+
+    Failed jobs are handed to the workers again once they are due to be
+    retried. The first time a database is used, the jobs left in its queue
+    (by a previous server which exited, for example) are picked up, and its
+    queue is checked again every RECOVERY_INTERVAL seconds for jobs the pool
+    lost track of, as when running them failed before they were claimed.
+
+    The workers keep their database connections open between jobs. A worker
+    which dies is replaced, and the jobs it was running are handed to a new
+    worker once their lease in the job queue expires. The import a dead
+    worker was running is reported as failed instead. A worker still running
+    a job after WORKER_TIMEOUT seconds is terminated, and replaced the same
+    way.
+
+    The workers are forked when the pool is created, so create it before the
+    process starts other threads: a process forked while another thread holds
+    a lock, such as a logging lock, can deadlock.
+    """
+
+    def __init__(self, num_workers):
+        self.lock = threading.Lock()
+        self.work_available = threading.Condition(self.lock)
+        self.all_done = threading.Condition(self.lock)
+        # Machines with waiting jobs, keyed on the job, database, test suite
+        # and machine, with the config and arguments of each. A job of None
+        # with no test suite and machine asks for the waiting jobs of the
+        # database.
+        self.pending = collections.OrderedDict()
+        self.num_dispatched = 0
+        # The SQLite databases a job is running on.
+        self.busy_databases = set()
+        # The databases whose queue is checked for waiting jobs, with the
+        # config of each.
+        self.recovered_databases = {}
+        self.last_recovery = time.time()
+        self.finished = multiprocessing.Queue()
+
+        self.worker_ids = itertools.count()
+        self.shadow_import_ids = itertools.count()
+        # The timers of the jobs waiting to be retried.
+        self.timers = set()
+        # Whether the process is exiting, and its workers are terminated.
+        self.closed = False
+        self.workers = [_Worker(next(self.worker_ids), self.finished)
+                        for i in range(num_workers)]
+
+        for target in (self._dispatch, self._collect):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, job, db_config, db_name, ts_name, machine_id):
+        """Run the waiting jobs of the machine, once a worker is free."""
+        with self.lock:
+            if db_name not in self.recovered_databases:
+                self._recover(db_config, db_name)
+            self._submit((job, db_name, ts_name, machine_id), db_config)
+
+    def _recover(self, db_config, db_name):
+        self.recovered_databases[db_name] = db_config
+        self._submit((None, db_name, None, None), db_config)
+
+    def _recover_all(self):
+        """Check the queues of all the databases used for waiting jobs, every
+        RECOVERY_INTERVAL seconds."""
+        if time.time() - self.last_recovery < RECOVERY_INTERVAL:
+            return
+        self.last_recovery = time.time()
+        for db_name, db_config in self.recovered_databases.items():
+            self._submit((None, db_name, None, None), db_config)
+
+    def submit_import(self, db_config, db_name, path, commit, status_path,
+                      url_root):
+        """Import the submission once a worker is free."""
+        with self.lock:
+            self._submit((IMPORT_JOB, db_name, path, None), db_config,
+                         (commit, status_path, url_root))
+
+    def submit_shadow_import(self, db_config, db_name, file, data,
+                             disable_email, disable_report):
+        """Import the report into the shadow database once a worker is
+        free."""
+        with self.lock:
+            self._submit((SHADOW_IMPORT_JOB, db_name, file,
+                          next(self.shadow_import_ids)), db_config,
+                         (data, disable_email, disable_report))
+
+    def _submit(self, key, db_config, args=None):
+        if key in self.pending:
+            note("Coalescing background jobs for {}".format(key))
+            return
+        self.pending[key] = db_config, args
+        self.work_available.notify()
+
+    def _submit_later(self, delay, key, db_config):
+        def submit():
+            with self.lock:
+                self.timers.discard(timer)
+                self._submit(key, db_config)
+        timer = threading.Timer(delay, submit)
+        timer.daemon = True
+        self.timers.add(timer)
+        timer.start()
+
+    def close(self):
+        """Stop handing out jobs and replacing workers, before the workers
+        are terminated as the process exits."""
+        with self.lock:
+            self.closed = True
+            for timer in self.timers:
+                timer.cancel()
+            self.timers.clear()
+
+    def _next_job(self):
+        """Remove and return the oldest waiting job which can run now, with
+        an idle worker to run it, or None."""
+        if self.closed:
+            return None
+        idle = [worker for worker in self.workers if worker.running is None]
+        if not idle:
+            return None
+        for key, (db_config, args) in self.pending.items():
+            db_name = key[1]
+            if db_name in self.busy_databases:
+                continue
+            del self.pending[key]
+            if lnt.server.db.util.is_sqlite_path(
+                    db_config.databases[db_name].path):
+                self.busy_databases.add(db_name)
+            return idle[0], key, db_config, args
+        return None
+
+    def _release(self, worker):
+        """Mark the job of the worker as done, and the worker as idle."""
+        key, db_config, args = worker.running
+        worker.running = worker.started = None
+        self.num_dispatched -= 1
+        self.busy_databases.discard(key[1])
+        self.work_available.notify()
+        return key, db_config, args
+
+    def _terminate_hung_workers(self):
+        """Terminate the workers which ran their job for too long, so that
+        they are replaced."""
+        if self.closed:
+            return
+        now = time.time()
+        for worker in self.workers:
+            if worker.running is None or \
+                    now - worker.started < WORKER_TIMEOUT:
+                continue
+            error("Background worker {} still runs {} after {}s, "
+                  "terminating it".format(worker.process.pid,
+                                          worker.running[0], WORKER_TIMEOUT))
+            worker.process.terminate()
+            worker.process.join()
+
+    def _replace_dead_workers(self):
+        if self.closed:
+            return
+        for i, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                continue
+            error("Background worker {} died with exit code {}".format(
+                    worker.process.pid, worker.process.exitcode))
+            if worker.running is not None:
+                key, db_config, args = self._release(worker)
+                if key[0] == IMPORT_JOB:
+                    # Importing the submission again may well kill the next
+                    # worker too.
+                    _, db_name, path, _ = key
+                    _fail_import(db_config, db_name, path, args[1],
+                                 "the background worker importing it died")
+                elif key[0] == SHADOW_IMPORT_JOB:
+                    error("Shadow import of {} into {} failed: the background "
+                          "worker importing it died".format(key[2], key[1]))
+                else:
+                    # Its jobs are still leased to it in the job queue, and
+                    # are run again once the lease expires.
+                    self._submit(key, db_config)
+            self.workers[i] = _Worker(next(self.worker_ids), self.finished)
+            self.work_available.notify()
+
+    def __len__(self):
+        """The number of jobs which are waiting or running."""
+        with self.lock:
+            return len(self.pending) + self.num_dispatched
+
+    def wait(self):
+        """Wait for all the jobs to finish, except those waiting to be
+        retried."""
+        with self.lock:
+            while not self.closed and (self.pending or self.num_dispatched):
+                self.all_done.wait(1)
+
+    def _dispatch(self):
+        while True:
+            with self.lock:
+                next_job = self._next_job()
+                while next_job is None:
+                    self.work_available.wait()
+                    next_job = self._next_job()
+                worker, key, db_config, args = next_job
+                worker.running = key, db_config, args
+                worker.started = time.time()
+                self.num_dispatched += 1
+            worker.jobs.put((key, db_config, args))
+
+    def _collect(self):
+        while True:
+            try:
+                worker_id, waiting = self.finished.get(
+                    timeout=WORKER_CHECK_INTERVAL)
+            except Queue.Empty:
+                worker_id, waiting = None, []
+            with self.lock:
+                # A worker which died after finishing its job was already
+                # released and replaced.
+                for worker in self.workers:
+                    if worker.id != worker_id or worker.running is None:
+                        continue
+                    (_, db_name, _, _), db_config, _ = self._release(worker)
+                    for (job, ts_name, machine_id), delay in waiting:
+                        key = (job, db_name, ts_name, machine_id)
+                        if delay > 0:
+                            self._submit_later(delay, key, db_config)
+                        else:
+                            self._submit(key, db_config)
+                self._terminate_hung_workers()
+                self._replace_dead_workers()
+                self._recover_all()
+                if not self.pending and not self.num_dispatched:
+                    self.all_done.notify_all()
+
+
+def _worker_main(worker_id, jobs, finished):
+    """Run jobs from the queue, keeping the databases open between them."""
+    global IN_BACKGROUND
+    IN_BACKGROUND = True
+    # Workers have nothing to clean up, and are terminated when the parent
+    # exits.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Don't share the parents database connections.
+    lnt.server.db.v4db.V4DB.close_all_engines()
+    databases = {}
+    while True:
+        (job, db_name, ts_name, machine_id), db_config, args = jobs.get()
+        db = None
+        # The machines which still have jobs waiting, with the number of
+        # seconds until they can be run.
+        waiting = []
+        try:
+            start_time = time.time()
+            db = databases.get(db_name)
+            if db is None:
+                databases[db_name] = db = db_config.get_database(db_name)
+            # Start from a fresh transaction, to see the submitted runs.
+            db.rollback()
+            if job == IMPORT_JOB:
+                # The key of an import holds the path of the submission.
+                _import(db_config, db_name, db, ts_name, *args)
+            elif job == SHADOW_IMPORT_JOB:
+                _shadow_import(db_config, db_name, db, ts_name, *args)
+            elif job is None:
+                waiting = lnt.server.db.jobqueue.waiting_jobs(db)
+                if waiting:
+                    note("Found {} machine(s) with waiting background jobs in "
+                         "{}".format(len(waiting), db_name))
+            else:
+                note("Running background job: {} for machine {} {}".format(
+                        job, machine_id, os.getpid()))
+                delay = lnt.server.db.jobqueue.run_jobs(db, job, ts_name,
+                                                        machine_id)
+                if delay is not None:
+                    waiting.append(((job, ts_name, machine_id), delay))
+                delta = time.time() - start_time
+                msg = "Finished: {name} in {time:.2f}s ".format(name=job,
+                                                                time=delta)
+                if delta < 100:
+                    note(msg)
+                else:
+                    warning(msg)
+        except:
+            # The jobs are left in the queue, check it again for waiting jobs
+            # once the database may be back.
+            waiting = [((None, None, None),
+                        lnt.server.db.jobqueue.RETRY_DELAY)]
+            error("Background job failed with:" +
+                  "".join(traceback.format_exception(*sys.exc_info())))
+            if job == IMPORT_JOB:
+                # Nothing imports the submission later.
+                _fail_import(db_config, db_name, ts_name, args[1],
+                             "the database is not available")
+            try:
+                if db is not None:
+                    db.rollback()
+            except:
+                # Start over with a new connection for the next job.
+                databases.pop(db_name, None)
+        finally:
+            finished.put((worker_id, waiting))
+
+
+def _import(config, db_name, db, path, commit, status_path, url_root):
+    """Import a submission in a worker, and save the result."""
+    # Imported here, as ImportData itself depends on this module.
+    import lnt.util.ImportData
+
+    try:
+        result = lnt.util.ImportData.import_and_report(
+            config, db_name, db, path, '<auto>', commit)
+        if result.get('result_url'):
+            result['result_url'] = url_root + result['result_url']
+    except:
+        error("Background import failed with:" +
+              "".join(traceback.format_exception(*sys.exc_info())))
+        result = {'success': False,
+                  'error': "import failure: %s" % traceback.format_exc(),
+                  'import_file': path}
+    write_status(status_path, result)
+    rm_f(_pending_import_path(config, db_name, path))
+
+
+def _shadow_import(config, db_name, db, file, data, disable_email,
+                   disable_report):
+    """Import a report into a shadow database, logging the result."""
+    # Imported here, as ImportData itself depends on this module.
+    import lnt.util.ImportData
+
+    try:
+        result = lnt.util.ImportData.import_and_report(
+            config, db_name, db, file, '<auto>', True,
+            disable_email=disable_email, disable_report=disable_report,
+            data=data)
+        if result['success']:
+            note("Shadow import of {} into {} succeeded: {}".format(
+                    file, db_name, result['result_url']))
+        else:
+            error("Shadow import of {} into {} failed with:{}".format(
+                    file, db_name, result['error']))
+    except:
+        error("Shadow import of {} into {} failed with:".format(file, db_name)
+              + "".join(traceback.format_exception(*sys.exc_info())))
 
 
 def launch_workers():
-    """Make sure we have a worker pool ready to queue."""
+    """Make sure we have a worker pool ready to queue. Servers call this
+    before serving requests, see WorkerPool."""
     global WORKERS
     if not WORKERS:
         note("Starting workers")
-        manager = Manager()
-        try:
-            current_app.config['mem_logger'].buffer = \
-                manager.list(current_app.config['mem_logger'].buffer)
-        except RuntimeError:
-            #  It might be the case that we are not running in the app.
-            #  In this case, don't bother memory logging, stdout should
-            #  sufficient for console mode.
-            pass
+        WORKERS = WorkerPool(NUM_WORKERS)
 
 
 def sig_handler(signo, frame):
@@ -53,29 +453,118 @@ def sig_handler(signo, frame):
 
 def cleanup():
     note("Running process cleanup.")
-    for p in JOBS:
-        note("Waiting for %s %s" % (p.name, p.pid))
-        if p.is_alive:
-            p.join()
+    if WORKERS is not None and not IN_BACKGROUND:
+        note("Waiting for {} background job(s)".format(len(WORKERS)))
+        WORKERS.wait()
+        WORKERS.close()
 
 
 atexit.register(cleanup)
 signal.signal(signal.SIGTERM, sig_handler)
 
 
+def queue_fieldchange_calc(db, ts, run):
+    """Queue the post submission tasks for a run, in the transaction which
+    commits the run."""
+    lnt.server.db.jobqueue.queue_job(db, 'post_submit_tasks', ts, run)
+
+
 def async_fieldchange_calc(db_name, ts, run, db_config):
-    """Run regenerate field changes in the background."""
-    func_args = {'run_id': run.id}
-    #  Make sure this run is in the database!
-    async_run_job(fieldchange.post_submit_tasks,
-                  db_name, ts,
-                  func_args, db_config)
+    """Run the queued post submission tasks for a committed run in the
+    background."""
+    async_run_job('post_submit_tasks', db_name, ts, run.machine_id, db_config)
+
+
+def async_import(db_name, path, commit, status_path, url_root, db_config):
+    """Import a submission in the background, and save the import result to
+    status_path once it is done."""
+    note("Queuing background import of {}".format(path))
+    launch_workers()
+    check_workers(True)
+
+    # Record the pending import, so it can be reported as failed if this
+    # process exits before it is done.
+    marker_path = _pending_import_path(db_config, db_name, path)
+    mkdir_p(os.path.dirname(marker_path))
+    write_status(marker_path, {'pid': os.getpid(),
+                               'host': socket.gethostname(),
+                               'db_name': db_name,
+                               'path': path,
+                               'status_path': status_path})
+    WORKERS.submit_import(db_config, db_name, path, commit, status_path,
+                          url_root)
+
+
+def _pending_import_path(config, db_name, path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(config.tempDir, db_name, 'pending', name + '.json')
+
+
+def _fail_import(config, db_name, path, status_path, reason):
+    """Report a background import which will never finish as failed."""
+    # The import may have finished just before its worker died.
+    if not os.path.exists(status_path):
+        error("Background import of {} failed: {}".format(path, reason))
+        write_status(status_path, {'success': False,
+                                   'error': "import failure: %s" % reason,
+                                   'import_file': path})
+    rm_f(_pending_import_path(config, db_name, path))
+
+
+def fail_orphaned_imports(config, db_name='*', path='*'):
+    """Report the background imports of processes on this host which exited
+    before they were done as failed, since nothing is left to finish them.
+    Only the imports of the submission path in the database are checked if
+    they are given."""
+    for marker_path in glob.glob(_pending_import_path(config, db_name, path)):
+        try:
+            with open(marker_path) as f:
+                pending = json.load(f)
+        except (IOError, ValueError):
+            # The import finished meanwhile.
+            continue
+        if pending['host'] != socket.gethostname() or \
+                is_running(pending['pid']):
+            continue
+        _fail_import(config, pending['db_name'], pending['path'],
+                     pending['status_path'], "the server importing it exited")
+
+
+def async_shadow_import(config, db_name, file, data, disable_email,
+                        disable_report):
+    """Import an already loaded report into a shadow database in the
+    background, logging the import result."""
+    if IN_BACKGROUND:
+        # Background processes are already off the submission path.
+        with contextlib.closing(config.get_database(db_name)) as db:
+            _shadow_import(config, db_name, db, file, data, disable_email,
+                           disable_report)
+        return
+
+    note("Queuing background shadow import of {} into {}".format(file,
+                                                                 db_name))
+    launch_workers()
+    check_workers(True)
+    WORKERS.submit_shadow_import(config, db_name, file, data, disable_email,
+                                 disable_report)
+
+
+def write_status(status_path, status):
+    """Atomically save a JSON status object, so readers never see a partially
+    written file."""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(status_path),
+                                    dir=os.path.dirname(status_path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(status, f)
+    os.rename(tmp_path, status_path)
 
 
 def check_workers(is_logged):
-    global JOBS
-    JOBS = [x for x in JOBS if x.is_alive()]
-    still_running = len(JOBS)
+    """Return the number of background imports and jobs which are waiting or
+    running, logging it if is_logged is set."""
+    still_running = 0
+    if WORKERS is not None:
+        still_running = len(WORKERS)
     msg = "{} Job(s) in the queue.".format(still_running)
     if is_logged:
         if still_running > 5:
@@ -86,68 +575,21 @@ def check_workers(is_logged):
             logging.getLogger("lnt.server.ui.app").info(msg)
         else:
             logging.getLogger("lnt.server.ui.app").info("Job queue empty.")
-    return len(JOBS)
+    return still_running
 
 
-def async_run_job(job, db_name, ts, func_args, db_config):
-    """Send a job to the async wrapper in the subprocess."""
-    # If the run is not in the database, we can't do anything more.
+def async_run_job(job, db_name, ts, machine_id, db_config):
+    """Run the queued jobs of the machine on the worker pool, where they may be
+    coalesced with other jobs of the machine."""
+    if IN_BACKGROUND:
+        # Background processes are already off the submission path.
+        lnt.server.db.jobqueue.run_jobs(ts.v4db, job, ts.name, machine_id)
+        return
+
     note("Queuing background job to process fieldchanges " + str(os.getpid()))
     launch_workers()
     check_workers(True)
-
-    args = {'tsname': ts.name,
-            'db': db_name,
-            'db_info': db_config}
-    job = Process(target=async_wrapper,
-                  args=[job, args, func_args])
-
-    # Set this to make sure when parent dies, children are killed.
-    job.daemon = True
-
-    job.start()
-    JOBS.append(job)
-
-# Flag to track if we have disposed of the parents database connections in
-# this subprocess.
-clean_db = False
-
-
-def async_wrapper(job, ts_args, func_args):
-    """Setup test-suite in this subprocess and run something.
-    
-    Because of multipocessing, capture excptions and log messages,
-    and return them.
-    """
-    global clean_db
-    try:
-        start_time = time.time()
-        
-        if not clean_db:
-            lnt.server.db.v4db.V4DB.close_all_engines()
-            clean_db = True
-        sleep(3)
-        note("Running async wrapper: {} ".format(job.__name__)+ str(os.getpid()))
-        config = ts_args['db_info']
-        _v4db = config.get_database(ts_args['db'])
-        #with contextlib.closing(_v4db) as db:
-        ts = _v4db.testsuite[ts_args['tsname']]
-        nothing = job(ts, **func_args)
-        assert nothing is None
-        end_time = time.time()
-        delta = end_time-start_time
-        msg = "Finished: {name} in {time:.2f}s ".format(name=job.__name__,
-                                                time=delta)
-        if delta < 100:
-            note(msg)
-        else:
-            warning(msg)
-    except:
-        # Put all exception text into an exception and raise that for our
-        # parent process.
-        error("Subprocess failed with:" + "".join(traceback.format_exception(*sys.exc_info())))
-        sys.exit(1)
-    sys.exit(0)
+    WORKERS.submit(job, db_config, db_name, ts.name, machine_id)
 
 
 def make_callback():
@@ -0,0 +1,53 @@
+# Check importing several files with a pool of loading processes.
+#
+# RUN: rm -rf %t.install
+# RUN: lnt create %t.install
+# RUN: echo "not a report" > %t.bad
+# RUN: not lnt import %t.install %{shared_inputs}/sample-a-small.plist %t.bad \
+# RUN:     %{shared_inputs}/sample-b-small.plist %{shared_inputs}/sample-a-small.plist \
+# RUN:     --commit=1 --jobs=2 --batch-size=2 > %t.log 2> %t.err
+# RUN: FileCheck --check-prefix=CHECK-LOG %s < %t.log
+# RUN: FileCheck --check-prefix=CHECK-ERR %s < %t.err
+#
+# CHECK-LOG: Import succeeded.
+# CHECK-LOG: Added Runs : 1
+# CHECK-LOG: Import succeeded.
+# CHECK-LOG: Added Runs : 1
+# CHECK-LOG: This submission is a duplicate of run 1
+# CHECK-LOG: --- Throughput ---
+# CHECK-LOG: Load (2 jobs): 4 files, 16 samples
+# CHECK-LOG: Import: 3 files, 16 samples
+#
+# CHECK-ERR: Import Failed:
+# CHECK-ERR: load failure
+#
+# RUN: python %s %t.install/data/lnt.db 2
+#
+# An import which fails with an exception rolls back the uncommitted imports
+# of its batch, which are reported as failed.
+# RUN: rm -rf %t2.install
+# RUN: lnt create %t2.install
+# RUN: sed -e 's/<string>nts</<string>nosuchsuite</' \
+# RUN:     %{shared_inputs}/sample-b-small.plist > %t.badsuite.plist
+# RUN: not lnt import %t2.install %{shared_inputs}/sample-a-small.plist \
+# RUN:     %t.badsuite.plist %{shared_inputs}/sample-b-small.plist \
+# RUN:     --commit=1 --jobs=2 --batch-size=2 > %t2.log 2> %t2.err
+# RUN: FileCheck --check-prefix=CHECK-ROLLBACK %s < %t2.err
+# RUN: python %s %t2.install/data/lnt.db 1
+#
+# CHECK-ROLLBACK: Import Failed:
+# CHECK-ROLLBACK: rolled back with its batch, after the import of {{.*}}badsuite.plist failed
+# CHECK-ROLLBACK: Import Failed:
+# CHECK-ROLLBACK: test suite 'nosuchsuite' not present in this database!
+
+import sys
+
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+db = v4db.V4DB("sqlite:///%s" % sys.argv[1], Config.dummy_instance())
+ts = db.testsuite['nts']
+expected_runs = int(sys.argv[2])
+assert ts.query(ts.Run).count() == expected_runs
+if expected_runs == 2:
+    assert ts.query(ts.Sample).count() == 3
@@ -0,0 +1,47 @@
+# Check importing the reports dropped into a spool directory.
+#
+# RUN: rm -rf %t.install %t.spool
+# RUN: lnt create %t.install
+# RUN: mkdir -p %t.spool
+# RUN: cp %{shared_inputs}/sample-a-small.plist %t.spool/a.plist
+# RUN: cp %{shared_inputs}/sample-b-small.plist %t.spool/b.plist
+# RUN: cp %{shared_inputs}/sample-a-small.plist %t.spool/c.plist
+# RUN: cp %{shared_inputs}/sample-b-small.plist %t.spool/.partial.plist
+# RUN: echo "not a report" > %t.spool/bad.json
+# RUN: lnt ingestd %t.install %t.spool --once --batch-size=2 --no-email \
+# RUN:     2> %t.err
+# RUN: FileCheck %s < %t.err
+#
+# CHECK: imported {{[0-9]}} reports ({{[0-9]}} failed), {{[0-9]+}} samples
+# CHECK: backlog: {{[0-9]}} reports
+# CHECK: imported 3 reports (1 failed), 16 samples
+#
+# Reports reusing the name of an earlier report don't replace it.
+# RUN: sed -e 's/2009-/2010-/g' %{shared_inputs}/sample-a-small.plist \
+# RUN:     > %t.spool/a.plist
+# RUN: lnt ingestd %t.install %t.spool --once --no-email 2> %t2.err
+# RUN: FileCheck --check-prefix=CHECK-REUSED %s < %t2.err
+#
+# CHECK-REUSED: imported 1 reports (0 failed)
+#
+# RUN: python %s %t.install/data/lnt.db %t.spool
+
+import os
+import sys
+
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+db_path, spool = sys.argv[1:]
+db = v4db.V4DB("sqlite:///%s" % db_path, Config.dummy_instance())
+ts = db.testsuite['nts']
+assert ts.query(ts.Run).count() == 3
+assert ts.query(ts.Sample).count() == 5
+
+assert sorted(os.listdir(os.path.join(spool, 'done'))) == [
+    'a.1.plist', 'a.plist', 'b.plist', 'c.plist']
+assert sorted(os.listdir(os.path.join(spool, 'failed'))) == [
+    'bad.json', 'bad.json.error']
+assert os.listdir(os.path.join(spool, 'processing')) == []
+assert sorted(os.listdir(spool)) == [
+    '.partial.plist', 'done', 'failed', 'processing']
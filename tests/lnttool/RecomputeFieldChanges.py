@@ -0,0 +1,52 @@
+# Check regenerating the field changes of past runs.
+#
+# RUN: rm -rf %t.install
+# RUN: lnt create %t.install
+# RUN: lnt import %t.install %{shared_inputs}/sample-a-small.plist \
+# RUN:     %{shared_inputs}/sample-b-small.plist --commit=1
+# RUN: python %s %t.install clear
+# RUN: not lnt updatedb %t.install --testsuite nts --recompute-fieldchanges \
+# RUN:     2> %t.err
+# RUN: FileCheck --check-prefix=CHECK-ERR %s < %t.err
+# RUN: lnt updatedb %t.install --testsuite nts --recompute-fieldchanges \
+# RUN:     --jobs 2 --commit=1 > %t.log
+# RUN: FileCheck %s < %t.log
+# RUN: python %s %t.install check
+#
+# Only recomputing the later orders of the machine keeps the same changes.
+# RUN: lnt updatedb %t.install --testsuite nts --recompute-fieldchanges \
+# RUN:     --machine "LNT SAMPLE MACHINE" --since 2 --commit=1 > %t2.log
+# RUN: FileCheck --check-prefix=CHECK-SINCE %s < %t2.log
+# RUN: python %s %t.install check
+#
+# CHECK-ERR: --recompute-fieldchanges requires --commit=1
+#
+# CHECK: [1/1] LNT SAMPLE MACHINE: 2 orders in
+# CHECK: Recomputed the field changes of 2 orders on 1 machines
+#
+# CHECK-SINCE: [1/1] LNT SAMPLE MACHINE: 1 orders in
+# CHECK-SINCE: Recomputed the field changes of 1 orders on 1 machines
+
+import sys
+
+import lnt.server.instance
+
+instance_path, action = sys.argv[1:]
+db = lnt.server.instance.Instance.frompath(instance_path).get_database(
+    'default')
+ts = db.testsuite['nts']
+
+if action == 'clear':
+    ts.query(ts.RegressionIndicator).delete()
+    ts.query(ts.Regression).delete()
+    ts.query(ts.FieldChange).delete()
+    db.commit()
+    sys.exit(0)
+
+changes = ts.query(ts.FieldChange).all()
+assert len(changes) == 1, changes
+change, = changes
+assert (change.start_order.llvm_project_revision,
+        change.end_order.llvm_project_revision) == ('1', '2')
+assert (change.old_value, change.new_value) == (0.3, 0.32)
+assert ts.query(ts.RegressionIndicator).count() == 1
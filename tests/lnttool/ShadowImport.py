@@ -0,0 +1,34 @@
+# Check that imports are shadowed into the configured database.
+#
+# RUN: rm -rf %t.install
+# RUN: lnt create %t.install
+# RUN: python %s setup %t.install
+# RUN: lnt import %t.install %{shared_inputs}/sample-a-small.plist \
+# RUN:     --commit=1 --show-raw-result > %t.log
+# RUN: FileCheck %s < %t.log
+# RUN: python %s check %t.install
+#
+# CHECK: 'shadow_import': 'shadow'
+# CHECK: 'success': True
+
+import os
+import sys
+
+import lnt.server.instance
+
+action, instance_path = sys.argv[1:]
+if action == 'setup':
+    with open(os.path.join(instance_path, 'lnt.cfg'), 'a') as f:
+        f.write("databases['default']['shadow_import'] = 'shadow'\n")
+        f.write("databases['shadow'] = { 'path' : 'shadow.db',\n"
+                "                        'db_version' : '0.4' }\n")
+    sys.exit(0)
+
+# The shadow import has finished once the import command exits.
+config = lnt.server.instance.Instance.frompath(instance_path).config
+for db_name in ('default', 'shadow'):
+    db = config.get_database(db_name)
+    ts = db.testsuite['nts']
+    assert ts.query(ts.Run).count() == 1, db_name
+    assert ts.query(ts.Sample).count() == 2, db_name
+    db.close()
@@ -0,0 +1,72 @@
+# Check that a report imports to the same samples in the default and the
+# columnar format.
+#
+# RUN: python %s
+
+import json
+import os
+import tempfile
+
+import lnt.testing
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+machine = lnt.testing.Machine('LNT COLUMNAR MACHINE', {'hardware': 'x86_64'})
+run = lnt.testing.Run('2017-01-01 00:00:00', '2017-01-01 01:00:00',
+                      {'tag': 'nts', 'run_order': '1'})
+tests = []
+for i in range(50):
+    tests.append(lnt.testing.TestSamples('nts.test-%d.compile' % i, [i]))
+    tests.append(lnt.testing.TestSamples('nts.test-%d.exec' % i,
+                                         [i + 0.5, i + 1.5]))
+tests.append(lnt.testing.TestSamples('nts.test-0.exec.status', [1]))
+report = lnt.testing.Report(machine, run, tests)
+
+v1 = report.render(indent=None)
+v2 = report.render(indent=None, columnar=True)
+assert len(v2) < len(v1) / 2
+
+data = json.loads(v2)
+assert data['Run']['Info']['__report_version__'] == '2'
+assert data['Tests']['Names'][:3] == ['test-0', 'test-1', 'test-2']
+assert len(data['Tests']['Names']) == 50
+assert data['Tests']['Metrics']['exec.status'][:2] == [[1], None]
+assert '"exec.status": [[1], null' in v2
+assert data['Tests']['Metrics']['compile'][:2] == [[0], [1]]
+assert data['Tests']['Metrics']['exec'][0] == [0.5, 1.5]
+
+
+def import_report(rendered):
+    # Import into a fresh database each time.
+    fd,path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    db = v4db.V4DB("sqlite:///%s" % path, Config.dummy_instance())
+    ts = db.testsuite['nts']
+    stats = {}
+    success,run = ts.importDataFromDict(
+        lnt.testing.upgrade_report(json.loads(rendered)), True, stats=stats)
+    assert success
+    samples = sorted((s.test.name, s.compile_time, s.execution_time,
+                      s.execution_status)
+                     for s in ts.query(ts.Sample))
+    db.close()
+    os.remove(path)
+    return stats, samples
+
+v1_stats, v1_samples = import_report(v1)
+v2_stats, v2_samples = import_report(v2)
+assert v1_stats == v2_stats == {'machines': 1, 'runs': 1, 'tests': 50,
+                                'samples': 100}
+assert v1_samples == v2_samples
+assert v2_samples[:2] == [('test-0', None, 1.5, None), ('test-0', 0, 0.5, 1)]
+
+# Metrics which do not map to a sample field are rejected.
+data = json.loads(v2)
+data['Tests']['Metrics']['bogus'] = data['Tests']['Metrics']['exec']
+try:
+    import_report(json.dumps(data))
+except ValueError:
+    pass
+else:
+    assert False, "expected a ValueError"
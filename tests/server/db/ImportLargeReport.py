@@ -0,0 +1,72 @@
+# Microbenchmark for importing a large report into a V4 test suite DB.
+#
+# This exercises the compiled test name to sample field mapping with a
+# synthetic report of 50k entries, and checks the import is still correct. The
+# timings are printed for comparison; ReportMapping.py checks the mapping on
+# every run.
+#
+# REQUIRES: long
+# RUN: python %s
+
+import json
+import sys
+import time
+
+import lnt.testing
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+NUM_TESTS = 10000
+SUFFIXES = [('compile', float), ('compile.status', int), ('exec', float),
+            ('exec.status', int), ('hash', str)]
+
+machine = lnt.testing.Machine('LNT BENCHMARK MACHINE',
+                              {'hardware': 'x86_64', 'os': 'SAMPLE OS'})
+run = lnt.testing.Run('2017-01-01 00:00:00', '2017-01-01 01:00:00',
+                      {'tag': 'nts', 'run_order': '1'})
+tests = []
+for i in range(NUM_TESTS):
+    for suffix, conv_f in SUFFIXES:
+        value = i if conv_f is not str else '%08x' % i
+        tests.append(lnt.testing.TestSamples(
+            'nts.benchmark/test-%05d.%s' % (i, suffix), [value],
+            conv_f=conv_f))
+assert len(tests) == 50000
+report = lnt.testing.Report(machine, run, tests)
+data = json.loads(report.render())
+
+db = v4db.V4DB("sqlite:///:memory:", Config.dummy_instance())
+ts = db.testsuite['nts']
+
+# Time the name resolution on its own.
+start_time = time.time()
+for test in data['Tests']:
+    ts.report_mapping.resolve(test['Name'])
+print >>sys.stderr, "resolve: %.3fs" % (time.time() - start_time,)
+
+# Resolving more distinct names than are cached keeps the cache bounded.
+report_mapping = ts.report_mapping
+num_names = report_mapping.MAX_CACHED_NAMES + 1000
+start_time = time.time()
+for i in range(num_names):
+    test_name, field = report_mapping.resolve('nts.t%d.exec.status' % i)
+    assert test_name == 't%d' % i
+assert field.name == 'execution_status'
+assert len(report_mapping._cache) < report_mapping.MAX_CACHED_NAMES
+print >>sys.stderr, "resolve %d distinct names: %.3fs" % (
+    num_names, time.time() - start_time)
+
+# Time the full import.
+start_time = time.time()
+success, imported_run = db.importDataFromDict(data, True)
+db.commit()
+print >>sys.stderr, "import: %.3fs" % (time.time() - start_time,)
+
+assert success
+assert ts.query(ts.Test).count() == NUM_TESTS
+assert ts.query(ts.Sample).count() == NUM_TESTS
+sample = ts.query(ts.Sample).join(ts.Test).\
+    filter(ts.Test.name == 'benchmark/test-00042').one()
+assert sample.compile_time == 42.0
+assert sample.execution_status == 42
+assert sample.hash == '0000002a'
@@ -8,10 +8,82 @@
 # RUN: lnt import %t.install %S/Inputs/profile-report.json \
 # RUN:   --commit=1 --show-sample-count > %t2.log
 # RUN: ls %t.install/data/profiles
-# RUN: python %s %t.install
+# RUN: python %s %t.install 1
+
+# The sizes of profiles stored before they were recorded are filled in by
+# updatedb.
+# RUN: python %s %t.install clear-sizes
+# RUN: lnt updatedb %t.install --testsuite nts --update-profile-sizes \
+# RUN:   --commit=1
+# RUN: python %s %t.install 1
+
+# Import the same profile for another order, it should only be stored once.
+# RUN: sed -e 's/154331/154332/g' %S/Inputs/profile-report.json > %t3.json
+# RUN: lnt import %t.install %t3.json --commit=1 > %t3.log
+# RUN: python %s %t.install 2
+
+# Deleting one of the runs keeps the shared profile around.
+# RUN: lnt updatedb %t.install --testsuite nts --delete-run 1 --commit=1
+# RUN: python %s %t.install 1
+
+# Deleting the last run using it removes the profile.
+# RUN: lnt updatedb %t.install --testsuite nts --delete-run 2 --commit=1
+# RUN: python %s %t.install 0
 
 import os, sys, glob
+import lnt.server.instance
 from lnt.testing.profile.profilev1impl import ProfileV1
 
-profile = glob.glob('%s/data/profiles/*.lntprof' % sys.argv[1])[0]
-assert ProfileV1.checkFile(profile)
+instance_path, action = sys.argv[1:]
+if action == 'clear-sizes':
+    db = lnt.server.instance.Instance.frompath(instance_path).get_database(
+        'default')
+    ts = db.testsuite['nts']
+    ts.query(ts.Profile).update({ts.Profile.size: None})
+    db.commit()
+    sys.exit(0)
+expected_refs = int(action)
+
+profiles = glob.glob('%s/data/profiles/*/*/*.lntprof' % instance_path)
+if expected_refs == 0:
+    assert len(profiles) == 0
+else:
+    assert len(profiles) == 1
+    assert ProfileV1.checkFile(profiles[0])
+
+instance = lnt.server.instance.Instance.frompath(instance_path)
+db = instance.get_database('default')
+ts = db.testsuite['nts']
+records = ts.query(ts.Profile).all()
+if expected_refs == 0:
+    assert len(records) == 0
+else:
+    assert len(records) == 1
+    assert records[0].ref_count == expected_refs
+    # The counters were extracted in the background after the import.
+    assert not records[0].is_processing
+    assert 'cycles' in records[0].counters
+    assert os.path.join(instance_path, 'data/profiles',
+                        records[0].filename) == profiles[0]
+    # The size of the stored profile is recorded.
+    assert records[0].size == os.path.getsize(profiles[0])
+
+# Storing a profile which a concurrent import stored first keeps the one
+# record.
+if expected_refs != 0:
+    with open(profiles[0], 'rb') as f:
+        data = f.read()
+    ts._insertProfile(ts.Profile(data, records[0].hash,
+                                 instance.config.databases['default']))
+    assert ts.query(ts.Profile).count() == 1
+    db.rollback()
+
+# The profile admin page reads the storage used by the profiles from the
+# database.
+import lnt.server.ui.app
+app = lnt.server.ui.app.App.create_standalone(instance_path)
+client = app.test_client()
+response = client.get('/profile/admin')
+assert response.status_code == 200
+if expected_refs != 0:
+    assert '%r]]' % (records[0].size / 1000.,) in response.data, response.data
@@ -0,0 +1,47 @@
+# Check that samples are added through the ORM when the test suite has hooks
+# for inserting them, and with a bulk insert otherwise.
+#
+# RUN: python %s
+
+import json
+
+import sqlalchemy.event
+
+import lnt.testing
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+machine = lnt.testing.Machine('LNT SAMPLE MACHINE', {'hardware': 'x86_64'})
+tests = [lnt.testing.TestSamples('nts.test-%d.exec' % i, [i, i + 0.5])
+         for i in range(10)]
+tests.append(lnt.testing.TestSamples('nts.test-0.exec.status', [1]))
+
+db = v4db.V4DB("sqlite:///:memory:", Config.dummy_instance())
+ts = db.testsuite['nts']
+
+
+def import_run(run_order):
+    run = lnt.testing.Run('2017-01-01 00:00:00', '2017-01-01 01:00:00',
+                          {'tag': 'nts', 'run_order': run_order})
+    data = json.loads(lnt.testing.Report(machine, run, tests).render())
+    success, run = db.importDataFromDict(data, True)
+    assert success
+    db.commit()
+    return sorted((s.test.name, s.execution_time, s.execution_status)
+                  for s in ts.query(ts.Sample).filter(ts.Sample.run == run))
+
+assert not ts._sampleRowsNeedORM()
+bulk_samples = import_run('1')
+
+inserted = []
+
+
+def before_insert(mapper, connection, sample):
+    inserted.append(sample)
+sqlalchemy.event.listen(ts.Sample, 'before_insert', before_insert)
+
+assert ts._sampleRowsNeedORM()
+orm_samples = import_run('2')
+assert len(inserted) == 20
+assert orm_samples == bulk_samples
+assert orm_samples[:2] == [('test-0', 0.0, 1), ('test-0', 0.5, None)]
@@ -35,7 +35,7 @@
 # Run consistency checks on the final database, to validate the import.
 # RUN: python %s %t.install/data/lnt.db
 
-import datetime, sys
+import datetime, hashlib, sys
 
 import lnt.testing
 from lnt.server.config import Config
@@ -96,6 +96,9 @@ assert run_a.order is order_a
 assert run_b.order is order_b
 assert run_a.imported_from.endswith("sample-a-small.plist")
 assert run_b.imported_from.endswith("sample-b-small.plist")
+assert run_a.content_hash == hashlib.sha1(
+    open(run_a.imported_from, 'rb').read()).hexdigest()
+assert db.getRunByContentHash(run_b.content_hash) is run_b
 assert run_a.start_time == datetime.datetime(2009, 11, 17, 2, 12, 25)
 assert run_a.end_time == datetime.datetime(2009, 11, 17, 3, 44, 48)
 assert tuple(sorted(run_a.parameters.items())) == \
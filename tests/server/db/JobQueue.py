@@ -0,0 +1,99 @@
+# Check the durable background job queue.
+#
+# RUN: rm -rf %t.install
+# RUN: lnt create %t.install
+# RUN: lnt import %t.install %{shared_inputs}/sample-a-small.plist --commit=1
+# RUN: python %s %t.install
+
+import datetime
+import subprocess
+import sys
+
+import lnt.server.instance
+import lnt.server.ui.app
+from lnt.server.db import jobqueue
+from lnt.server.db.jobqueue import BackgroundJob, JobState
+
+instance_path, = sys.argv[1:]
+config = lnt.server.instance.Instance.frompath(instance_path).config
+db = config.get_database('default')
+ts = db.testsuite['nts']
+run = ts.query(ts.Run).one()
+
+# The post submission tasks of the import were run, and removed from the queue.
+assert db.query(BackgroundJob).count() == 0
+
+calls = []
+failing = [True]
+def test_job(ts, run_ids):
+    calls.append(run_ids)
+    if failing[0]:
+        raise RuntimeError("job failed")
+jobqueue.JOB_FUNCTIONS['test_job'] = test_job
+jobqueue.MAX_ATTEMPTS = 2
+
+def make_due():
+    db.query(BackgroundJob).update({BackgroundJob.not_before:
+                                    datetime.datetime(2000, 1, 1)})
+    db.commit()
+
+# Jobs of the same machine are run together, and retried after failing.
+jobqueue.queue_job(db, 'test_job', ts, run)
+jobqueue.queue_job(db, 'test_job', ts, run)
+db.commit()
+delay = jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id)
+assert calls == [[run.id]]
+assert 0 < delay <= jobqueue.RETRY_DELAY
+jobs = db.query(BackgroundJob).all()
+assert [(j.state, j.attempts) for j in jobs] == [(JobState.PENDING, 1)] * 2
+assert 'job failed' in jobs[0].error
+
+# The jobs are not run again before they are due.
+assert jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id) > 0
+assert len(calls) == 1
+
+# After MAX_ATTEMPTS failures, the jobs are kept as failed.
+make_due()
+assert jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id) is None
+assert len(calls) == 2
+assert [j.state for j in db.query(BackgroundJob)] == [JobState.FAILED] * 2
+assert jobqueue.waiting_jobs(db) == []
+
+# The admin page lists the queue.
+app = lnt.server.ui.app.App.create_standalone(instance_path)
+client = app.test_client()
+response = client.get('/db_default/jobs')
+assert response.status_code == 200
+assert 'Failed: 2' in response.data
+assert 'job failed' in response.data
+
+# The page can't change the queue.
+response = client.post('/db_default/jobs')
+assert response.status_code == 405
+
+# Failed jobs can be retried, with lnt updatedb --retry-failed-jobs.
+db.rollback()
+subprocess.check_call(['lnt', 'updatedb', '--retry-failed-jobs',
+                       instance_path])
+assert jobqueue.waiting_jobs(db) == [(('test_job', 'nts', run.machine_id), 0)]
+failing[0] = False
+assert jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id) is None
+assert len(calls) == 3
+assert db.query(BackgroundJob).count() == 0
+
+# Jobs claimed by a worker which crashed are run again once their lease
+# expires.
+jobqueue.queue_job(db, 'test_job', ts, run)
+db.commit()
+db.query(BackgroundJob).update({
+        BackgroundJob.state: JobState.RUNNING,
+        BackgroundJob.claimed_at: datetime.datetime.utcnow()})
+db.commit()
+assert jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id) > 0
+assert len(calls) == 3
+db.query(BackgroundJob).update({
+        BackgroundJob.claimed_at: datetime.datetime(2000, 1, 1)})
+db.commit()
+assert jobqueue.run_jobs(db, 'test_job', 'nts', run.machine_id) is None
+assert len(calls) == 4
+assert db.query(BackgroundJob).count() == 0
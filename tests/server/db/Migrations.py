@@ -11,6 +11,8 @@ import glob
 
 import lnt.server.db.migrate
 import lnt.server.ui.app
+from lnt.server.config import Config
+from lnt.server.db import v4db
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -44,6 +46,13 @@ def sanity_check_instance(instance_path):
         overview = client.get(os.path.join("/", link))
         assert "LNT : %s - Recent Activity" % (name,) in overview.data
 
+def check_fingerprints(db_path):
+    # The backfilled fingerprints must match what the importer computes.
+    db = v4db.V4DB("sqlite:///%s" % db_path, Config.dummy_instance())
+    for ts in db.testsuite.values():
+        for item in ts.query(ts.Machine).all() + ts.query(ts.Run).all():
+            assert item.fingerprint == item.compute_fingerprint(), item
+
 def check_instance(instance_path, temp_path):
     logging.info("checking instance: %r", instance_path)
 
@@ -60,6 +69,7 @@ def check_instance(instance_path, temp_path):
     db_path = os.path.join(instance_temp_path, "data", "lnt.db")
     logging.info("migrating database: %r", db_path)
     lnt.server.db.migrate.update_path(db_path)
+    check_fingerprints(db_path)
 
     # Sanity check that the update instance works correctly.
     sanity_check_instance(instance_temp_path)
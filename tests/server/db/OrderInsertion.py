@@ -0,0 +1,53 @@
+# Check that new orders are inserted into the total ordering correctly.
+#
+# RUN: python %s
+
+import json
+
+import lnt.testing
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+db = v4db.V4DB("sqlite:///:memory:", Config.dummy_instance())
+ts = db.testsuite['nts']
+
+# Submit runs out of order, including orders which only compare correctly
+# component wise.
+revisions = ['3', '1', '1.10', '2', '1.9', '01', 'a', '1.9.1']
+for i, revision in enumerate(revisions):
+    machine = lnt.testing.Machine('LNT SAMPLE MACHINE')
+    run = lnt.testing.Run('2017-01-01 00:00:%02d' % i,
+                          '2017-01-01 00:01:%02d' % i,
+                          {'tag': 'nts', 'run_order': revision})
+    report = lnt.testing.Report(machine, run, [])
+    data = json.loads(report.render())
+    success, _ = db.importDataFromDict(data, True)
+    assert success
+    db.commit()
+
+expected = ['1', '01', '1.9', '1.9.1', '1.10', '2', '3', 'a']
+
+# Check the ordinals.
+orders = ts.query(ts.Order).order_by(ts.Order.ordinal).all()
+assert [o.llvm_project_revision for o in orders] == expected
+assert [o.ordinal for o in orders] == range(len(expected))
+
+# Check the sort keys agree.
+orders = ts.query(ts.Order).order_by(ts.Order.sort_key, ts.Order.id).all()
+assert [o.llvm_project_revision for o in orders] == expected
+
+# Check the linked list.
+order = ts.query(ts.Order).filter(ts.Order.previous_order_id == None).one()
+linked = []
+while order is not None:
+    linked.append(order.llvm_project_revision)
+    order = order.next_order
+assert linked == expected, linked
+
+# Numbers too long for a single byte length still sort by magnitude.
+from lnt.server.db.util import order_sort_key
+numbers = ['9' * 254, '1' + '0' * 254, '1' + '0' * 300, '2' + '0' * 300,
+           '1' + '0' * 1000]
+keys = [order_sort_key([n]) for n in numbers]
+assert keys == sorted(keys)
+assert order_sort_key(['1' + '0' * 1000]) < order_sort_key(['a'])
@@ -0,0 +1,63 @@
+# Check the compiled test name to sample field mapping of a V4 test suite DB,
+# and that a report covering every mapped field imports correctly.
+#
+# RUN: python %s
+
+import json
+
+import lnt.testing
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+NUM_TESTS = 50
+SUFFIXES = [('compile', float), ('compile.status', int), ('exec', float),
+            ('exec.status', int), ('hash', str)]
+
+machine = lnt.testing.Machine('LNT SAMPLE MACHINE',
+                              {'hardware': 'x86_64', 'os': 'SAMPLE OS'})
+run = lnt.testing.Run('2017-01-01 00:00:00', '2017-01-01 01:00:00',
+                      {'tag': 'nts', 'run_order': '1'})
+tests = []
+for i in range(NUM_TESTS):
+    for suffix, conv_f in SUFFIXES:
+        value = i if conv_f is not str else '%08x' % i
+        tests.append(lnt.testing.TestSamples(
+            'nts.benchmark/test-%05d.%s' % (i, suffix), [value],
+            conv_f=conv_f))
+report = lnt.testing.Report(machine, run, tests)
+data = json.loads(report.render())
+
+db = v4db.V4DB("sqlite:///:memory:", Config.dummy_instance())
+ts = db.testsuite['nts']
+
+test_name, field = ts.report_mapping.resolve('nts.a.b.exec.status')
+assert test_name == 'a.b'
+assert field.name == 'execution_status'
+test_name, field = ts.report_mapping.resolve('nts.a.b.exec')
+assert test_name == 'a.b'
+assert field.name == 'execution_time'
+test_name, field = ts.report_mapping.resolve('nts.a.b.profile')
+assert test_name == 'a.b'
+assert field == 'profile'
+try:
+    ts.report_mapping.resolve('nts.a.b.unknown')
+    assert False, "expected an unmapped test name to be rejected"
+except ValueError:
+    pass
+try:
+    ts.report_mapping.resolve('compile.a.b.exec')
+    assert False, "expected a misnamed test to be rejected"
+except ValueError:
+    pass
+
+success, imported_run = db.importDataFromDict(data, True)
+db.commit()
+
+assert success
+assert ts.query(ts.Test).count() == NUM_TESTS
+assert ts.query(ts.Sample).count() == NUM_TESTS
+sample = ts.query(ts.Sample).join(ts.Test).\
+    filter(ts.Test.name == 'benchmark/test-00042').one()
+assert sample.compile_time == 42.0
+assert sample.execution_status == 42
+assert sample.hash == '0000002a'
@@ -0,0 +1,77 @@
+# Check format detection, the streaming JSON reader, and importing a streamed
+# report.
+#
+# RUN: python %s %S/../../Formats/Inputs
+
+import StringIO
+import os
+import sys
+import tempfile
+
+import lnt.testing
+from lnt import formats
+from lnt.formats import JSONFormat
+from lnt.server.config import Config
+from lnt.server.db import v4db
+
+inputs = sys.argv[1]
+assert formats.guess_format(os.path.join(inputs, 'test.json'))['name'] == 'json'
+assert formats.guess_format(os.path.join(inputs, 'test.plist'))['name'] == 'plist'
+assert formats.guess_format(os.path.join(inputs, 'test.nightlytest')) is None
+
+# Use a tiny window, so values straddle the reads.
+JSONFormat._StreamReader.chunk_size = 3
+
+report = ('\xef\xbb\xbf {"Machine": {"Name": "m\\u00e9"}, "Run": {"Info": {}},'
+          ' "Tests": [{"Name": "a", "Data": [1.5, 12345]},'
+          ' {"Name": "b", "Data": []}], "Zzz": 10}')
+f = StringIO.StringIO(report)
+assert formats.guess_format(f) is formats.json
+data = formats.read_any(f, '<auto>', stream=True)
+assert data['Machine'] == {'Name': u'm\xe9'}
+assert not isinstance(data['Tests'], list)
+assert list(data['Tests']) == [{'Name': 'a', 'Data': [1.5, 12345]},
+                               {'Name': 'b', 'Data': []}]
+assert data['Zzz'] == 10
+
+# Tests which precede the run are loaded eagerly.
+f = StringIO.StringIO('{"Tests": [], "Machine": {}, "Run": {}}')
+assert formats.read_any(f, 'json', stream=True) == {
+    'Tests': [], 'Machine': {}, 'Run': {}}
+
+# Malformed tests are reported when they are reached.
+f = StringIO.StringIO('{"Machine": {}, "Run": {}, "Tests": [{"Name": }]}')
+data = formats.read_any(f, 'json', stream=True)
+try:
+    list(data['Tests'])
+except formats.FormatError:
+    pass
+else:
+    assert False, "expected a FormatError"
+
+# Import a rendered report, decoding its tests as they are imported.
+JSONFormat._StreamReader.chunk_size = 64
+machine = lnt.testing.Machine('LNT STREAM MACHINE', {'hardware': 'x86_64'})
+run = lnt.testing.Run('2017-01-01 00:00:00', '2017-01-01 01:00:00',
+                      {'tag': 'nts', 'run_order': '1'})
+tests = [lnt.testing.TestSamples('nts.test-%d.%s' % (i, suffix), [i, i + 1])
+         for i in range(100) for suffix in ('compile', 'exec')]
+fd,path = tempfile.mkstemp(suffix='.json')
+os.write(fd, lnt.testing.Report(machine, run, tests).render())
+os.close(fd)
+
+db = v4db.V4DB("sqlite:///:memory:", Config.dummy_instance())
+ts = db.testsuite['nts']
+data = formats.read_any(path, '<auto>', stream=True)
+assert not isinstance(data['Tests'], list)
+stats = {}
+success,run = ts.importDataFromDict(data, True, stats=stats)
+os.remove(path)
+assert success
+assert stats == {'machines': 1, 'runs': 1, 'tests': 100, 'samples': 200}
+assert ts.query(ts.Test).count() == 100
+samples = ts.query(ts.Sample).all()
+assert len(samples) == 200
+assert sorted((s.test.name, s.compile_time, s.execution_time)
+              for s in samples)[:2] == [
+    ('test-0', 0, 0), ('test-0', 1, 1)]
@@ -0,0 +1,137 @@
+# Check that the background worker pool survives workers which die or hang.
+#
+# RUN: rm -rf %t.install %t.died %t.ran %t.ran.busy %t.ran.overlap %t.ran.hung
+# RUN: lnt create %t.install
+# RUN: lnt import %t.install %{shared_inputs}/sample-a-small.plist --commit=1
+# RUN: python %s %t.install %t.died %t.ran
+
+import os
+import sys
+import time
+
+import lnt.server.instance
+from lnt.server.db import jobqueue
+from lnt.server.db.jobqueue import BackgroundJob
+from lnt.util import async_ops
+
+instance_path, died_path, ran_path = sys.argv[1:]
+config = lnt.server.instance.Instance.frompath(instance_path).config
+db = config.get_database('default')
+ts = db.testsuite['nts']
+run = ts.query(ts.Run).one()
+
+
+def test_job(ts, run_ids):
+    # The first worker running the job dies, without releasing it.
+    if not os.path.exists(died_path):
+        open(died_path, 'w').close()
+        os._exit(1)
+    open(ran_path, 'w').close()
+jobqueue.JOB_FUNCTIONS['test_job'] = test_job
+jobqueue.JOB_LEASE = 1
+
+jobqueue.queue_job(db, 'test_job', ts, run)
+db.commit()
+
+pool = async_ops.WorkerPool(1)
+pool.submit('test_job', config, 'default', 'nts', run.machine_id)
+
+# The dead worker is replaced, and the job is run again once its lease
+# expired.
+deadline = time.time() + 60
+while not os.path.exists(ran_path):
+    assert time.time() < deadline, "the job was not run again"
+    time.sleep(0.1)
+pool.wait()
+assert os.path.exists(died_path)
+assert len(pool) == 0
+assert pool.busy_databases == set()
+assert all(worker.process.is_alive() for worker in pool.workers)
+db.rollback()
+assert db.query(BackgroundJob).count() == 0
+
+# Jobs the pool was not told about are found by the periodic check of the
+# queues of the databases.
+os.unlink(ran_path)
+async_ops.RECOVERY_INTERVAL = 0
+jobqueue.queue_job(db, 'test_job', ts, run)
+db.commit()
+deadline = time.time() + 60
+while not os.path.exists(ran_path):
+    assert time.time() < deadline, "the queue was not checked again"
+    time.sleep(0.1)
+
+# The workers are not replaced once the pool is closed, as they are
+# terminated when the process exits.
+pool.close()
+async_ops.RECOVERY_INTERVAL = 300
+
+# The jobs of different machines are run one at a time on a SQLite database,
+# even with a free worker for each.
+other_machine = ts.Machine('other-machine')
+other_run = ts.Run(other_machine, run.order, run.start_time, run.end_time)
+ts.add(other_run)
+db.commit()
+busy_path = ran_path + '.busy'
+overlap_path = ran_path + '.overlap'
+os.unlink(ran_path)
+
+
+def serial_job(ts, run_ids):
+    try:
+        fd = os.open(busy_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError:
+        open(overlap_path, 'w').close()
+        return
+    time.sleep(0.5)
+    os.close(fd)
+    os.unlink(busy_path)
+    with open(ran_path, 'a') as f:
+        f.write('%d\n' % run_ids[0])
+jobqueue.JOB_FUNCTIONS['serial_job'] = serial_job
+
+assert not config.databases['default'].path.startswith('sqlite:')
+for r in (run, other_run):
+    jobqueue.queue_job(db, 'serial_job', ts, r)
+db.commit()
+serial_pool = async_ops.WorkerPool(2)
+for r in (run, other_run):
+    serial_pool.submit('serial_job', config, 'default', 'nts', r.machine_id)
+deadline = time.time() + 60
+while not os.path.exists(ran_path) or \
+        len(open(ran_path).read().split()) < 2:
+    assert time.time() < deadline, "the jobs were not run"
+    assert not os.path.exists(overlap_path), "the jobs ran at the same time"
+    time.sleep(0.1)
+serial_pool.wait()
+assert not os.path.exists(overlap_path), "the jobs ran at the same time"
+assert sorted(open(ran_path).read().split()) == \
+    sorted([str(run.id), str(other_run.id)])
+serial_pool.close()
+
+# A worker which hangs is terminated once it ran its job for too long, and
+# the job is run again.
+hung_path = ran_path + '.hung'
+os.unlink(ran_path)
+
+
+def hanging_job(ts, run_ids):
+    if not os.path.exists(hung_path):
+        open(hung_path, 'w').close()
+        time.sleep(3600)
+    open(ran_path, 'w').close()
+jobqueue.JOB_FUNCTIONS['hanging_job'] = hanging_job
+async_ops.WORKER_TIMEOUT = 1
+
+jobqueue.queue_job(db, 'hanging_job', ts, run)
+db.commit()
+hang_pool = async_ops.WorkerPool(1)
+hang_pool.submit('hanging_job', config, 'default', 'nts', run.machine_id)
+deadline = time.time() + 60
+while not os.path.exists(ran_path):
+    assert time.time() < deadline, "the hung job was not run again"
+    time.sleep(0.1)
+hang_pool.wait()
+assert os.path.exists(hung_path)
+assert hang_pool.busy_databases == set()
+hang_pool.close()
@@ -0,0 +1,295 @@
+# Check synchronous and asynchronous submission through /submitRun.
+#
+# RUN: rm -rf %t.instance
+# RUN: lnt create %t.instance
+# RUN: python %s %t.instance %{shared_inputs}
+
+import StringIO
+import datetime
+import gzip
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import werkzeug.serving
+
+import lnt.server.db.jobqueue
+import lnt.server.ui.app
+from lnt.util import ServerUtil
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class SubmitRunTester(unittest.TestCase):
+    """Test submitting runs."""
+
+    def setUp(self):
+        """Bind to the LNT test instance."""
+        _, instance_path, shared_inputs = sys.argv
+        app = lnt.server.ui.app.App.create_standalone(instance_path)
+        app.testing = True
+        self.app = app
+        self.client = app.test_client()
+        self.shared_inputs = shared_inputs
+
+    def read_input(self, name):
+        with open(os.path.join(self.shared_inputs, name)) as f:
+            return f.read()
+
+    def submit(self, name, **form):
+        with open(os.path.join(self.shared_inputs, name)) as f:
+            form['input_data'] = f.read()
+        form['commit'] = '1'
+        return self.client.post('db_default/submitRun', data=form)
+
+    def test_sync_submit(self):
+        response = self.submit('sample-b-small.plist')
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertTrue(result['success'])
+        self.assertTrue(result['result_url'].startswith('http://localhost/'))
+
+    def test_async_submit(self):
+        response = self.submit('sample-a-small.plist', async='1')
+        self.assertEqual(response.status_code, 202)
+        ticket = json.loads(response.data)
+        self.assertEqual(ticket['status'], 'pending')
+        self.assertEqual(response.headers['Location'], ticket['status_url'])
+
+        # Poll for the import result.
+        status_url = 'db_default/submitRun/status/' + ticket['ticket']
+        for i in range(120):
+            response = self.client.get(status_url)
+            if response.status_code != 202:
+                break
+            time.sleep(0.5)
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertTrue(result['success'])
+        self.assertTrue(result['committed'])
+        self.assertTrue(result['result_url'].startswith('http://localhost/'))
+
+        # The log of the import process is shown in the /log view.
+        records = self.app.config['log_handler'].records()
+        self.assertTrue(any(record['process'] != os.getpid() and
+                            record['msg'].startswith('Successfully created')
+                            for record in records))
+        response = self.client.get('/log')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Successfully created', response.data)
+
+    def test_orphaned_import(self):
+        # The import of a submission whose server exited is reported as
+        # failed.
+        config = self.app.old_config
+        ticket = 'data-2017-01-01_00-00-00orphan'
+        path = os.path.join(config.tempDir, 'default', '2017-01',
+                            ticket + '.plist')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(self.read_input('sample-a-small.plist'))
+        server = subprocess.Popen([sys.executable, '-c', 'pass'])
+        server.wait()
+        marker_path = os.path.join(config.tempDir, 'default', 'pending',
+                                   ticket + '.json')
+        if not os.path.exists(os.path.dirname(marker_path)):
+            os.makedirs(os.path.dirname(marker_path))
+        with open(marker_path, 'w') as f:
+            json.dump({'pid': server.pid, 'host': socket.gethostname(),
+                       'db_name': 'default', 'path': path,
+                       'status_path': path[:-len('.plist')] + '.status.json'},
+                      f)
+
+        response = self.client.get('db_default/submitRun/status/' + ticket)
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertFalse(result['success'])
+        self.assertIn('the server importing it exited', result['error'])
+        self.assertFalse(os.path.exists(marker_path))
+
+    def test_compressed_body(self):
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+            f.write(self.read_input('sample-b-small.plist'))
+        response = self.client.post(
+            'db_default/submitRun?commit=1', data=buffer.getvalue(),
+            headers={'Content-Encoding': 'gzip'},
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertTrue(result['success'])
+
+    def test_batch_submit(self):
+        files = [(StringIO.StringIO(self.read_input(name)), name)
+                 for name in ('sample-a-small.plist', 'sample-b-small.plist')]
+        response = self.client.post('db_default/submitRun',
+                                    data={'file': files, 'commit': '1',
+                                          'batch': '1'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(result['success'] for result in results))
+
+        # Several files are only accepted in batch mode.
+        files = [(StringIO.StringIO(self.read_input(name)), name)
+                 for name in ('sample-a-small.plist', 'sample-b-small.plist')]
+        response = self.client.post('db_default/submitRun',
+                                    data={'file': files, 'commit': '1'})
+        self.assertIn('multiple files require batch mode', response.data)
+
+        # Batch mode errors are reported as JSON.
+        response = self.client.post('db_default/submitRun',
+                                    data={'commit': '1', 'batch': '1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'],
+                         'must provide input file or data')
+
+    def test_submission_size_limit(self):
+        # A compressed submission is limited by its decompressed size.
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+            f.write(' ' * (1 << 20))
+        config = self.app.old_config
+        config.max_submission_size = 1 << 19
+        try:
+            response = self.client.post(
+                'db_default/submitRun?commit=1&batch=1',
+                data=buffer.getvalue(), headers={'Content-Encoding': 'gzip'},
+                content_type='application/octet-stream')
+        finally:
+            config.max_submission_size = 1 << 30
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('larger than', json.loads(response.data)['error'])
+
+    def test_concurrent_client(self):
+        server = werkzeug.serving.make_server('localhost', 0, self.app,
+                                              threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://localhost:%d/db_default/submitRun' % (
+                server.server_port,)
+            files = [os.path.join(self.shared_inputs, name)
+                     for name in ('sample-a-small.plist',
+                                  'sample-b-small.plist',
+                                  'sample-a-small.plist')]
+            results = ServerUtil.submitFiles(url, files, True, False,
+                                             compress=True, batch_size=2,
+                                             jobs=2)
+        finally:
+            server.shutdown()
+            thread.join()
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertTrue(all(result['import_file'].endswith('.plist')
+                            for result in results))
+
+    def test_group_commit(self):
+        db_config = self.app.old_config.databases['default']
+        db_config.group_commit_window = 0.5
+        try:
+            # Submit runs which have not been submitted by the other tests.
+            names = ['sample-a-small.plist', 'sample-b-small.plist',
+                     'sample-a-small.plist']
+            inputs = [self.read_input(name).replace('2009-', '2010-')
+                      for name in names]
+            responses = [None] * len(names)
+            def submit(i):
+                client = self.app.test_client()
+                responses[i] = client.post(
+                    'db_default/submitRun',
+                    data={'input_data': inputs[i], 'commit': '1'})
+            threads = [threading.Thread(target=submit, args=(i,))
+                       for i in range(len(names))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            db_config.group_commit_window = 0
+
+        results = [json.loads(response.data) for response in responses]
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertTrue(all(result['committed'] for result in results))
+        # The runs were imported in some order, but each submission still
+        # gets its own result, and one of the identical submissions is
+        # recognized as a duplicate of the other.
+        self.assertEqual(results[0]['run_id'], results[2]['run_id'])
+        self.assertEqual(
+            len([result for result in results if 'original_run' in result]),
+            1)
+        self.assertNotEqual(results[0]['run_id'], results[1]['run_id'])
+
+    def test_admission_control(self):
+        config = self.app.old_config
+        config.max_inflight_imports = 0
+        config.retry_after = 0
+        busy_backoff = ServerUtil.BUSY_BACKOFF
+        try:
+            response = self.submit('sample-a-small.plist')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '0')
+
+            # The client retries until the server accepts the submission.
+            server = werkzeug.serving.make_server('localhost', 0, self.app,
+                                                  threaded=True)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            ServerUtil.BUSY_BACKOFF = 0.1
+            def admit():
+                config.max_inflight_imports = None
+            timer = threading.Timer(0.5, admit)
+            timer.start()
+            try:
+                url = 'http://localhost:%d/db_default/submitRun' % (
+                    server.server_port,)
+                result = ServerUtil.submitFileToServer(
+                    url, os.path.join(self.shared_inputs,
+                                      'sample-a-small.plist'), True)
+            finally:
+                timer.join()
+                server.shutdown()
+                thread.join()
+            self.assertTrue(result['success'])
+        finally:
+            config.max_inflight_imports = None
+            config.retry_after = 5
+            ServerUtil.BUSY_BACKOFF = busy_backoff
+
+    def test_background_job_limit(self):
+        # Submissions are turned away while the job queue of the database has
+        # too many waiting jobs.
+        config = self.app.old_config
+        db = config.get_database('default')
+        job = lnt.server.db.jobqueue.BackgroundJob('post_submit_tasks', 'nts',
+                                                   0, 0)
+        job.not_before = datetime.datetime(9999, 1, 1)
+        db.add(job)
+        db.commit()
+        config.max_background_jobs = 1
+        try:
+            response = self.submit('sample-a-small.plist')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('background jobs',
+                          json.loads(response.data)['error'])
+        finally:
+            config.max_background_jobs = None
+            db.delete(job)
+            db.commit()
+            db.close()
+
+    def test_unknown_ticket(self):
+        for ticket in ('data-2017-01-01_00-00-00abcdef', '..', 'foo'):
+            response = self.client.get('db_default/submitRun/status/' +
+                                       ticket)
+            self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
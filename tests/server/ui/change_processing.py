@@ -14,6 +14,8 @@ import datetime
 
 from lnt.server.config import Config
 from lnt.server.db import v4db
+from lnt.server.db import fieldchange
+from lnt.server.db import rules_manager
 from lnt.server.db.fieldchange import is_overlaping, identify_related_changes
 from lnt.server.db.regression import rebuild_title, RegressionState
 from lnt.server.db.rules import rule_update_fixed_regressions
@@ -114,6 +116,7 @@ class ChangeProcessingTests(unittest.TestCase):
     def _mkorder(self, ts, rev):
         order = ts.Order()
         order.llvm_project_revision = rev
+        order.sort_key = order.compute_sort_key()
         ts.add(order)
         return order
     
@@ -183,15 +186,123 @@ class ChangeProcessingTests(unittest.TestCase):
         EXPECTED_TITLE = "Regression of 6 benchmarks: foo, bar"
         self.assertEquals(r2.title, EXPECTED_TITLE)
 
+    def test_regression_index(self):
+        ts_db = self.ts_db
+        index = fieldchange.RegressionIndex(ts_db)
+
+        # Both changes of the regression overlap, in the order of the
+        # indicators.
+        self.assertEquals(index.overlapping(self.field_change2),
+                          [(self.regression, self.field_change),
+                           (self.regression, self.field_change2)])
+        # Changes which are not in an open regression are not indexed.
+        self.assertEquals(index.overlapping(self.field_change3), [])
+
+        field_change8 = ts_db.FieldChange(self.order1236, self.order1238,
+                                          self.machine, self.test2,
+                                          self.a_field)
+        self.assertEquals(index.overlapping(field_change8), [])
+        index.add(self.regression, self.field_change3)
+        self.assertEquals(index.overlapping(field_change8),
+                          [(self.regression, self.field_change3)])
+
     def test_regression_evolution(self):
         ts_db = self.ts_db
-        rule_update_fixed_regressions.regression_evolution(ts_db, self.regressions)
+        # Only the regressions with changes on the machine of the run are
+        # checked.
+        rule_update_fixed_regressions.regression_evolution(ts_db,
+                                                           [self.run2.id])
+        self.assertEquals(self.regression.state, RegressionState.DETECTED)
+        rule_update_fixed_regressions.regression_evolution(ts_db,
+                                                           [self.run.id])
+        self.assertEquals(self.regression.state, RegressionState.IGNORED)
         
     def test_fc_deletion(self):
         delete_fieldchange(self.ts_db, self.field_change)
         delete_fieldchange(self.ts_db, self.field_change2)
         delete_fieldchange(self.ts_db, self.field_change3)
 
+    def test_post_submit_tasks_for_runs(self):
+        ts_db = self.ts_db
+        run3 = ts_db.Run(self.machine, self.order1235, self.run.start_time,
+                         self.run.end_time)
+        ts_db.add(run3)
+        ts_db.commit()
+
+        regenerated = []
+        def regenerate(ts, run_id, run_hooks=True):
+            self.assertFalse(run_hooks)
+            regenerated.append(run_id)
+        old_regenerate = fieldchange.regenerate_fieldchanges_for_run
+        fieldchange.regenerate_fieldchanges_for_run = regenerate
+        try:
+            # The field changes of an order are regenerated once per machine,
+            # and deleted runs are skipped.
+            fieldchange.post_submit_tasks_for_runs(
+                ts_db, [self.run.id, run3.id, self.run2.id, 1000])
+        finally:
+            fieldchange.regenerate_fieldchanges_for_run = old_regenerate
+        self.assertEquals(regenerated, [self.run.id, self.run2.id])
+
+    def test_regenerate_fieldchanges_for_run(self):
+        ts_db = self.ts_db
+        run = ts_db.Run(self.machine, self.order1236, self.run.start_time,
+                        self.run.end_time)
+        ts_db.add(run)
+        sample = ts_db.Sample(run, self.test, compile_time=2.0, score=4.2)
+        ts_db.add(sample)
+        ts_db.commit()
+
+        def run_changes():
+            return ts_db.query(ts_db.FieldChange) \
+                .filter(ts_db.FieldChange.run_id == run.id).all()
+
+        # Only the changed field gets a field change, in a new regression.
+        fieldchange.regenerate_fieldchanges_for_run(ts_db, run.id)
+        changes = run_changes()
+        self.assertEquals(len(changes), 1)
+        change = changes[0]
+        self.assertEquals((change.start_order, change.end_order),
+                          (self.order1235, self.order1236))
+        self.assertEquals((change.old_value, change.new_value), (1.0, 2.0))
+        self.assertEquals(ts_db.query(ts_db.RegressionIndicator)
+                          .filter_by(field_change_id=change.id).count(), 1)
+
+        # Regenerating again updates the existing field change.
+        sample.compile_time = 3.0
+        ts_db.commit()
+        fieldchange.regenerate_fieldchanges_for_run(ts_db, run.id)
+        self.assertEquals(run_changes(), [change])
+        self.assertEquals(change.new_value, 3.0)
+
+        # And removes it once it is no longer a change.
+        sample.compile_time = 1.0
+        ts_db.commit()
+        fieldchange.regenerate_fieldchanges_for_run(ts_db, run.id)
+        self.assertEquals(run_changes(), [])
+
+    def test_regenerate_filtered_fieldchanges(self):
+        ts_db = self.ts_db
+        run = ts_db.Run(self.machine, self.order1236, self.run.start_time,
+                        self.run.end_time)
+        ts_db.add(run)
+        sample = ts_db.Sample(run, self.test, compile_time=2.0, score=4.2)
+        ts_db.add(sample)
+        ts_db.commit()
+        fieldchange.regenerate_fieldchanges_for_run(ts_db, run.id)
+        changes = ts_db.query(ts_db.FieldChange) \
+            .filter(ts_db.FieldChange.run_id == run.id)
+        self.assertEquals(changes.count(), 1)
+
+        # An existing change is removed once the rules filter it out.
+        hooks = rules_manager.HOOKS['is_useful_change']
+        hooks.append(lambda ts, field_change: False)
+        try:
+            fieldchange.regenerate_fieldchanges_for_run(ts_db, run.id)
+        finally:
+            hooks.pop()
+        self.assertEquals(changes.count(), 0)
+
 
 if __name__ == '__main__':
     unittest.main(argv=[sys.argv[0], ])